@@ -0,0 +1,424 @@
+"""
+SFU CMPT 756
+Client of the database service, shared by the user, music and
+playlist services.
+
+`DatastoreClient` sends every call through one `requests.Session` per
+process.  Its pool keeps connections to the database service open, so
+a call no longer pays for a TCP handshake, and the sidecar's connection
+setup, as a bare `requests.get` does.  Every call has a timeout.
+
+A call is retried, a bounded number of times with full-jitter
+exponential backoff, when it is safe to repeat:
+- Any call whose connection could not be opened, since it never
+  reached the database service.
+- An idempotent call that timed out, lost its connection or got a 429,
+  502, 503 or 504.  The idempotent calls are reads, deletes, updates
+  that only set attributes, and batch writes whose items all carry
+  their own `uuid`.  After a 429 or 503 with a Retry-After header (the
+  database service's rate limiter or DynamoDB's throttling), the retry
+  waits at least Retry-After seconds; a longer Retry-After than
+  `max_retry_after` returns the refusal to the caller instead.
+Other writes, and updates with `$ops` or `$condition`, are not repeated
+after they may have reached the database service.  Even a 429 or 503
+may follow a batch write that was partly applied.
+
+A read that finds no item is answered 404, with the body
+`{"Count": 0, "Items": []}` that the database service returns with a
+200, so callers that only look at `Items` are unchanged.  For the
+objtypes in `miss_objtypes`, the key is then remembered as missing for
+a few seconds, and reads of it in that time are answered 404 without a
+call.  This is the negative cache.  An update of the key or a write
+that names it, through the same client, ends the entry early, and
+`consistent` reads always ask the database service.  Items created
+elsewhere, such as by another service, replica or the loader, are seen
+once the entry expires, so each service caches the misses of only the
+objtypes it creates itself.
+
+The methods return the `requests.Response`, so callers check
+`status_code` and read `json()` as before.  A handler that would only
+return the database service's answer unchanged passes it to `relay`
+instead, which sends on the body bytes without parsing and
+re-encoding them.
+
+Environment variables:
+- DB_URL: base URL of the database service's API.
+- DB_POOL_SIZE: connections kept open per process (default: the
+  request threads per Gunicorn worker, GUNICORN_THREADS, or 8).
+- DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT: seconds (default 1 and 10).
+- DB_RETRIES: retries per call (default 3; 0 disables them).
+- DB_MISS_TTL: seconds a key is remembered as missing (default 5).
+- DB_MISS_CACHE_SIZE: missing keys remembered (default 10000; 0
+  disables the negative cache).
+
+Each image is built from its service's directory, so this one copy is
+copied into those directories by `make -f k8s-tpl.mak templates` and
+before each image build (see DATASTORE_COPIES in k8s-tpl.mak).  Edit
+it here; git ignores the copies.
+"""
+
+# Standard library modules
+import base64
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Installed packages
+from flask import Response
+
+from prometheus_client import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URL = 'http://cmpt756db:30002/api/v1/datastore'
+
+# Statuses worth another try of an idempotent call
+RETRY_STATUSES = (429, 502, 503, 504)
+# Statuses whose Retry-After header a retry honours
+REFUSED_STATUSES = (429, 503)
+
+# Headers of the database service's response that `relay` passes on
+RELAYED_HEADERS = ('Retry-After',)
+
+# What `/read` returns for a missing item.  Bodies longer than this
+# hold an item, so only these short ones need parsing to spot a miss.
+NOT_FOUND_BODY = b'{"Count":0,"Items":[]}'
+MISS_BODY_MAX = 32
+
+RETRIES = Counter('datastore_client_retries',
+                  'Calls to the database service that were retried',
+                  ['endpoint', 'reason'])
+NEGATIVE_HITS = Counter('datastore_client_negative_hits',
+                        'Reads of missing items answered without a call')
+
+
+def relay(response):
+    '''Return a Flask response with the body, status and content type
+    of the database service's `response`, unchanged'''
+    return Response(response.content,
+                    status=response.status_code,
+                    headers={h: response.headers[h] for h in RELAYED_HEADERS
+                             if h in response.headers},
+                    content_type=response.headers.get('Content-Type'))
+
+
+def binary(data):
+    '''Return the bytes `data` as a value that a write or update
+    stores as a Binary attribute.  Reads return it base64-encoded.'''
+    return {"$binary": base64.b64encode(data).decode()}
+
+
+def not_found():
+    '''Return a 404 response, as if from the database service, for a
+    read of a missing item'''
+    response = requests.Response()
+    response.status_code = 404
+    response.headers['Content-Type'] = 'application/json'
+    response._content = NOT_FOUND_BODY
+    return response
+
+
+class MissCache():
+    """Thread-safe set of keys recently found missing, each remembered
+    for `ttl` seconds, at most `maxsize` of them.
+
+    As with the read caches, a reader calls `token()` before the
+    backend read and passes the result to `add()`, which ignores the
+    miss if the key was discarded in between: an item written while
+    the read was in flight is never hidden.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of keys. 0 disables the cache.
+    ttl: float
+        Seconds a key stays missing after it is added.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+        # Sequence number of the most recent discard of each key,
+        # bounded like the keys.  `_floor` is the largest sequence
+        # number forgotten from `_discarded`.
+        self._seq = 0
+        self._discarded = OrderedDict()
+        self._floor = 0
+
+    def __contains__(self, key):
+        if not self.maxsize:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            expires = self._keys.get(key)
+            if expires is None:
+                return False
+            if expires <= now:
+                del self._keys[key]
+                return False
+            return True
+
+    def token(self):
+        '''Return a token to pass to a later add()'''
+        with self._lock:
+            return self._seq
+
+    def add(self, key, token):
+        '''Remember `key` as missing unless it was discarded after
+        `token`'''
+        if not self.maxsize:
+            return
+        with self._lock:
+            if max(self._floor, self._discarded.get(key, 0)) > token:
+                return
+            self._keys[key] = time.monotonic() + self.ttl
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def discard(self, key):
+        '''Forget `key`, which may now exist, and refuse adds that
+        started before this call'''
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._seq += 1
+            self._keys.pop(key, None)
+            self._discarded[key] = self._seq
+            self._discarded.move_to_end(key)
+            while len(self._discarded) > self.maxsize:
+                _, seq = self._discarded.popitem(last=False)
+                self._floor = max(self._floor, seq)
+
+
+class DatastoreClient():
+    """Pooled, retrying client of the database service's endpoints.
+
+    Safe to share between the threads of a process.
+
+    Parameters
+    ----------
+    url: string
+        Base URL of the API, without a trailing slash.
+    pool_size: int
+        Connections kept open; the most concurrent calls expected.
+    connect_timeout, read_timeout: float
+        Seconds allowed to open a connection and to wait for data.
+    retries: int
+        Retries of a call after its first attempt.
+    backoff_base, backoff_cap: float
+        Seconds of the first backoff and the most any backoff may be.
+    max_retry_after: float
+        Longest Retry-After worth waiting for.
+    misses: MissCache
+        Negative cache of reads (default: sized by DB_MISS_CACHE_SIZE
+        and DB_MISS_TTL).
+    miss_objtypes: iterable
+        Objtypes whose misses `misses` keeps (default: all).
+    """
+    def __init__(self, url=None, pool_size=None, connect_timeout=None,
+                 read_timeout=None, retries=None, backoff_base=0.05,
+                 backoff_cap=1.0, max_retry_after=2.0, misses=None,
+                 miss_objtypes=None):
+        env = os.environ
+        self.url = url or env.get('DB_URL', DEFAULT_URL)
+        if pool_size is None:
+            pool_size = int(env.get('DB_POOL_SIZE',
+                                    env.get('GUNICORN_THREADS', '8')))
+        self.timeout = (
+            connect_timeout or float(env.get('DB_CONNECT_TIMEOUT', '1')),
+            read_timeout or float(env.get('DB_READ_TIMEOUT', '10')))
+        self.retries = (int(env.get('DB_RETRIES', '3')) if retries is None
+                        else retries)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.misses = misses or MissCache(
+            int(env.get('DB_MISS_CACHE_SIZE', '10000')),
+            float(env.get('DB_MISS_TTL', '5')))
+        self.miss_objtypes = (None if miss_objtypes is None
+                              else frozenset(miss_objtypes))
+        self.session = requests.Session()
+        # Retries are ours, as urllib3's do not know which calls are
+        # idempotent.  A call beyond `pool_size` concurrent ones opens
+        # an extra connection rather than waiting for one.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff_delay(self, attempt):
+        '''Seconds to wait before retry number `attempt` (full-jitter
+        exponential)'''
+        return random.uniform(
+            0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response):
+        '''Return the seconds a refusal asks us to wait, or None if it
+        is not a refusal we may retry'''
+        if response.status_code not in REFUSED_STATUSES:
+            return None
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return None
+
+    def _call(self, method, endpoint, idempotent, auth=None, timeout=None,
+              **kwargs):
+        '''Send one call, retrying it as the module describes'''
+        url = self.url + '/' + endpoint
+        headers = {'Authorization': auth} if auth else None
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = self.session.request(
+                    method, url, headers=headers,
+                    timeout=timeout or self.timeout, **kwargs)
+            except requests.ConnectTimeout:
+                if last:
+                    raise
+                reason = 'connect'
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last or not idempotent:
+                    raise
+                reason = ('timeout' if isinstance(e, requests.Timeout)
+                          else 'connection')
+            else:
+                if last or not idempotent:
+                    return response
+                retry_after = self._retry_after(response)
+                if retry_after is not None:
+                    if retry_after > self.max_retry_after:
+                        return response
+                    reason = str(response.status_code)
+                    delay = max(retry_after, self._backoff_delay(attempt))
+                elif response.status_code in RETRY_STATUSES:
+                    reason = str(response.status_code)
+                    delay = self._backoff_delay(attempt)
+                else:
+                    return response
+                RETRIES.labels(endpoint, reason).inc()
+                time.sleep(delay)
+                continue
+            RETRIES.labels(endpoint, reason).inc()
+            time.sleep(self._backoff_delay(attempt))
+
+    def read(self, objtype, objkey, fields=None, consistent=False,
+             auth=None, timeout=None):
+        '''Read one item, or only its `fields`, answering 404 if it is
+        missing'''
+        key = (objtype, objkey)
+        cached = (self.miss_objtypes is None or
+                  objtype in self.miss_objtypes)
+        if cached and not consistent and key in self.misses:
+            NEGATIVE_HITS.inc()
+            return not_found()
+        token = self.misses.token()
+        params = {"objtype": objtype, "objkey": objkey}
+        if fields:
+            params["fields"] = ','.join(fields)
+        if consistent:
+            params["consistent"] = "true"
+        response = self._call('GET', 'read', True, auth, timeout,
+                              params=params)
+        if (response.status_code == 200 and
+                len(response.content) <= MISS_BODY_MAX and
+                response.json()['Count'] == 0):
+            if cached:
+                self.misses.add(key, token)
+            return not_found()
+        return response
+
+    def batch_read(self, objtype, objkeys, auth=None, timeout=None):
+        '''Read many items, returned in the order of `objkeys`'''
+        return self._call('POST', 'batch_read', True, auth, timeout,
+                          json={"objtype": objtype,
+                                "objkeys": list(objkeys)})
+
+    def scan(self, objtype, limit=None, cursor=None, auth=None,
+             timeout=None):
+        '''Read one page of a table; pass back the response's `Cursor`
+        as `cursor` for the next'''
+        params = {"objtype": objtype}
+        if limit is not None:
+            params["limit"] = limit
+        if cursor:
+            params["cursor"] = cursor
+        return self._call('GET', 'scan', True, auth, timeout,
+                          params=params)
+
+    def query(self, objtype, index, key, fields=None, limit=None,
+              cursor=None, auth=None, timeout=None):
+        '''Read one page of the items whose `index` hash key is `key`'''
+        params = {"objtype": objtype, "index": index, "key": key}
+        if fields:
+            params["fields"] = ','.join(fields)
+        if limit is not None:
+            params["limit"] = limit
+        if cursor:
+            params["cursor"] = cursor
+        return self._call('GET', 'query', True, auth, timeout,
+                          params=params)
+
+    def write(self, objtype, item, auth=None, timeout=None):
+        '''Create an item under a new UUID'''
+        response = self._call('POST', 'write', False, auth, timeout,
+                              json=dict(item, objtype=objtype))
+        if response.status_code == 200:
+            # The body is {<key attribute>: <new UUID>}
+            for objkey in response.json().values():
+                self.misses.discard((objtype, objkey))
+        return response
+
+    def batch_write(self, objtype, items, auth=None, timeout=None):
+        '''Create many items, each under a new UUID or the `uuid` it
+        carries'''
+        items = list(items)
+        # Writing items under their own keys again changes nothing
+        response = self._call('POST', 'batch_write',
+                              all('uuid' in item for item in items),
+                              auth, timeout,
+                              json={"objtype": objtype, "items": items})
+        for item in items:
+            if 'uuid' in item:
+                self.misses.discard((objtype, item['uuid']))
+        return response
+
+    def update(self, objtype, objkey, attrs=None, ops=None, condition=None,
+               return_values=None, auth=None, timeout=None):
+        '''Set `attrs` and apply `ops` to one item, atomically and only
+        if every check in `condition` holds (see the database service's
+        `/update`)'''
+        body = dict(attrs or {})
+        if ops:
+            body["$ops"] = ops
+        if condition:
+            body["$condition"] = condition
+        if return_values:
+            body["$return"] = return_values
+        response = self._call('PUT', 'update', not (ops or condition),
+                              auth, timeout,
+                              params={"objtype": objtype, "objkey": objkey},
+                              json=body)
+        # An update without a condition creates a missing item
+        self.misses.discard((objtype, objkey))
+        return response
+
+    def delete(self, objtype, objkey, auth=None, timeout=None):
+        '''Delete one item; deleting a missing item succeeds'''
+        token = self.misses.token()
+        response = self._call('DELETE', 'delete', True, auth, timeout,
+                              params={"objtype": objtype, "objkey": objkey})
+        if response.status_code == 200:
+            self.misses.add((objtype, objkey), token)
+        return response
+
+    def batch_delete(self, objtype, objkeys, auth=None, timeout=None):
+        '''Delete many items'''
+        return self._call('POST', 'batch_delete', True, auth, timeout,
+                          json={"objtype": objtype,
+                                "objkeys": list(objkeys)})
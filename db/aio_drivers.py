@@ -0,0 +1,270 @@
+"""
+SFU CMPT 756
+Asynchronous storage drivers for the asyncio build of the database
+service (`asgi.py`).
+
+These mirror the `Driver` interface in `drivers.py` with coroutine
+methods.  `AsyncDynamoDBDriver` uses aioboto3, so an in-flight DynamoDB
+call costs a coroutine rather than an OS thread.  `AsyncDriver` wraps
+any synchronous driver, such as `SQLiteDriver`, by running its calls on
+a thread pool.
+
+Both bound the number of backend calls in flight at once to
+`max_inflight`; further calls wait their turn.
+"""
+
+# Standard library modules
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from contextlib import asynccontextmanager
+
+# Installed packages
+import aioboto3
+from botocore.config import Config
+
+# Local modules
+import backend_metrics
+import drivers
+from backend_metrics import RETRIES
+from drivers import DriverError
+from drivers import client_errors
+
+
+class AsyncDriver():
+    """Coroutine wrapper around a synchronous driver.
+
+    Parameters
+    ----------
+    driver: drivers.Driver
+        The driver whose calls are run on the thread pool.
+    max_inflight: int
+        Size of the thread pool, and so the number of concurrent calls.
+    """
+    def __init__(self, driver, max_inflight):
+        self._driver = driver
+        self._pool = ThreadPoolExecutor(max_workers=max_inflight)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        self._pool.shutdown(wait=False)
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._pool, functools.partial(fn, *args, **kwargs))
+
+    async def get(self, *args, **kwargs):
+        return await self._run(self._driver.get, *args, **kwargs)
+
+    async def query(self, *args, **kwargs):
+        return await self._run(self._driver.query, *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        return await self._run(self._driver.put, *args, **kwargs)
+
+    async def update(self, *args, **kwargs):
+        return await self._run(self._driver.update, *args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        return await self._run(self._driver.delete, *args, **kwargs)
+
+    async def batch_get(self, *args, **kwargs):
+        return await self._run(self._driver.batch_get, *args, **kwargs)
+
+    async def batch_write(self, *args, **kwargs):
+        return await self._run(self._driver.batch_write, *args, **kwargs)
+
+    async def scan(self, *args, **kwargs):
+        return await self._run(self._driver.scan, *args, **kwargs)
+
+    @asynccontextmanager
+    async def writer(self, table, key_name):
+        cm = self._driver.writer(table, key_name)
+        w = await self._run(cm.__enter__)
+        yield AsyncWriter(self, w)
+        await self._run(cm.__exit__, None, None, None)
+
+
+class AsyncWriter():
+    '''Coroutine `put_item` in front of a synchronous driver writer'''
+    def __init__(self, driver, writer):
+        self._driver = driver
+        self._writer = writer
+
+    async def put_item(self, Item):
+        await self._driver._run(self._writer.put_item, Item=Item)
+
+
+class AsyncDynamoDBDriver():
+    """Driver for Amazon DynamoDB (or DynamoDB Local) using aioboto3.
+
+    Call `start()` inside the event loop before use and `close()` at
+    shutdown.
+
+    Parameters
+    ----------
+    region, access_key, secret_access_key: string
+        AWS connection parameters.
+    endpoint_url: string
+        If non-empty, the URL of a DynamoDB Local instance.
+    max_inflight: int
+        Maximum concurrent DynamoDB calls; also the HTTP pool size.
+    hooks: sequence of callables
+        Each is called with the botocore event system of the client
+        once `start()` creates it.
+    """
+    def __init__(self, region, access_key, secret_access_key,
+                 endpoint_url='', max_inflight=256, hooks=()):
+        self._kwargs = {
+            'region_name': region,
+            'aws_access_key_id': access_key,
+            'aws_secret_access_key': secret_access_key,
+            'config': Config(max_pool_connections=max_inflight),
+        }
+        if endpoint_url:
+            self._kwargs['endpoint_url'] = endpoint_url
+        self._max_inflight = max_inflight
+        self._hooks = hooks
+        self._stack = None
+        self._dynamodb = None
+        self._sem = None
+        self._tables = {}
+
+    async def start(self):
+        self._stack = AsyncExitStack()
+        self._dynamodb = await self._stack.enter_async_context(
+            aioboto3.Session().resource('dynamodb', **self._kwargs))
+        for hook in self._hooks:
+            hook(self._dynamodb.meta.client.meta.events)
+        backend_metrics.instrument(self._dynamodb.meta.client.meta.events)
+        self._sem = asyncio.Semaphore(self._max_inflight)
+
+    async def close(self):
+        await self._stack.aclose()
+
+    async def _table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            table = await self._dynamodb.Table(name)
+            self._tables[name] = table
+        return table
+
+    async def _call(self, table, method, **kwargs):
+        t = await self._table(table)
+        async with self._sem:
+            with client_errors():
+                return await getattr(t, method)(**kwargs)
+
+    async def get(self, table, key_name, key, fields=None, consistent=False):
+        response = await self._call(
+            table, 'get_item',
+            **drivers.get_item_kwargs(key_name, key, fields, consistent))
+        return response.get('Item')
+
+    async def query(self, table, key_name, index, key_conditions,
+                    filters=(), fields=None, limit=None, start_key=None):
+        response = await self._call(
+            table, 'query',
+            **drivers.query_kwargs(key_name, index, key_conditions,
+                                   filters, fields, limit, start_key))
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    async def put(self, table, key_name, item):
+        await self._call(table, 'put_item', Item=item)
+
+    async def update(self, table, key_name, key, values, ops=(),
+                     conditions=(), return_values='NONE'):
+        response = await self._call(
+            table, 'update_item',
+            **drivers.update_item_kwargs(key_name, key, values, ops,
+                                         conditions, return_values))
+        return response.get('Attributes', {})
+
+    async def delete(self, table, key_name, key):
+        await self._call(table, 'delete_item', Key={key_name: key})
+
+    async def _batch_get_chunk(self, table, key_name, keys):
+        request_items = {table: {'Keys': [{key_name: k} for k in keys]}}
+        items = []
+        attempt = 0
+        while True:
+            try:
+                async with self._sem:
+                    with client_errors():
+                        response = await self._dynamodb.batch_get_item(
+                            RequestItems=request_items)
+            except DriverError as e:
+                return items, [k[key_name]
+                               for k in request_items[table]['Keys']], e
+            items.extend(response['Responses'].get(table, []))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                return items, [], None
+            if attempt >= drivers.BATCH_MAX_RETRIES:
+                return items, [k[key_name]
+                               for k in request_items[table]['Keys']], None
+            RETRIES.labels(table, 'BatchGetItem').inc()
+            await asyncio.sleep(drivers.backoff_delay(attempt))
+            attempt += 1
+
+    async def batch_get(self, table, key_name, keys):
+        results = await asyncio.gather(*[
+            self._batch_get_chunk(table, key_name, c)
+            for c in drivers.chunks(keys, drivers.BATCH_READ_MAX_KEYS)])
+        return drivers.merge_batch_gets(results)
+
+    async def _batch_write_chunk(self, table, key_name, write_requests):
+        outcome = {drivers.write_request_key(r, key_name): "ok"
+                   for r in write_requests}
+        request_items = {table: write_requests}
+        attempt = 0
+        while True:
+            try:
+                async with self._sem:
+                    with client_errors():
+                        response = await self._dynamodb.batch_write_item(
+                            RequestItems=request_items)
+            except DriverError as e:
+                reason = e.code
+                for r in request_items[table]:
+                    outcome[drivers.write_request_key(r, key_name)] = reason
+                return outcome
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return outcome
+            if attempt >= drivers.BATCH_MAX_RETRIES:
+                for r in request_items[table]:
+                    outcome[drivers.write_request_key(r, key_name)] = \
+                        "unprocessed"
+                return outcome
+            RETRIES.labels(table, 'BatchWriteItem').inc()
+            await asyncio.sleep(drivers.backoff_delay(attempt))
+            attempt += 1
+
+    async def batch_write(self, table, key_name, write_requests):
+        results = await asyncio.gather(*[
+            self._batch_write_chunk(table, key_name, c)
+            for c in drivers.chunks(write_requests,
+                                    drivers.BATCH_WRITE_MAX_ITEMS)])
+        outcome = {}
+        for r in results:
+            outcome.update(r)
+        return outcome
+
+    async def scan(self, table, key_name, limit=None, start_key=None,
+                   segment=None, total_segments=None):
+        response = await self._call(
+            table, 'scan',
+            **drivers.scan_kwargs(limit, start_key, segment, total_segments))
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    @asynccontextmanager
+    async def writer(self, table, key_name):
+        t = await self._table(table)
+        with client_errors():
+            async with t.batch_writer(overwrite_by_pkeys=[key_name]) as w:
+                yield w
@@ -6,30 +6,76 @@ Sample application---database service.
 # Standard library modules
 import base64
 import logging
+import math
 import os
+import queue
 import sys
+import threading
 import urllib.parse
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 # Installed packages
-
-import boto3
-from boto3.dynamodb.conditions import Key
-
 from flask import Blueprint
 from flask import Flask
+from flask.json import JSONEncoder
 from flask import request
 from flask import Response
+from flask import stream_with_context
+
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import REGISTRY
 
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import simplejson as json
 
+# Local modules
+import drivers
+import fastjson
+import throttle
+from cache import TTLCache
+from hotkeys import HotKeys
+from hotkeys import HotKeysCollector
+from singleflight import SingleFlight
+
 # The application
 
+
+def json_default(o):
+    '''Encode DynamoDB sets, which JSON lacks, as arrays'''
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
+class DatastoreJSONEncoder(JSONEncoder):
+    def default(self, o):
+        if isinstance(o, (set, frozenset)):
+            return json_default(o)
+        return super().default(o)
+
+
 app = Flask(__name__)
+app.json_encoder = DatastoreJSONEncoder
+
 
-metrics = PrometheusMetrics(app)
+def json_response(obj, status=200):
+    '''Return `obj` as a JSON response, encoded by fastjson'''
+    return Response(fastjson.dumps(obj),
+                    status=status,
+                    mimetype='application/json')
+
+
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'Database process')
 
 bp = Blueprint('app', __name__)
@@ -48,98 +94,475 @@ loader_token = os.getenv('SVC_LOADER_TOKEN')
 # In some testing contexts, we pass in the DynamoDB URL
 dynamodb_url = os.getenv('DYNAMODB_URL', '')
 
-if dynamodb_url == '':
-    dynamodb = boto3.resource(
-        'dynamodb',
-        region_name=region,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_access_key)
+# Storage backend: 'dynamodb' (default) or 'sqlite' for a self-contained
+# run on a laptop or CI box
+driver_name = os.getenv('DB_DRIVER', 'dynamodb')
+
+# Client-side limit on the DynamoDB call rate of each table, adapted
+# AIMD-style to the throttles DynamoDB returns.  A table is only limited
+# once it has throttled, starting at DB_RATE_INITIAL.  A call that cannot
+# get a turn within DB_RATE_MAX_WAIT seconds is refused with a 429.
+limiter = throttle.AIMDLimiter(
+    initial_rate=float(os.getenv('DB_RATE_INITIAL', '100')),
+    min_rate=float(os.getenv('DB_RATE_MIN', '1')),
+    max_rate=float(os.getenv('DB_RATE_MAX', '5000')),
+    max_wait=float(os.getenv('DB_RATE_MAX_WAIT', '0.5')))
+
+if driver_name == 'sqlite':
+    driver = drivers.SQLiteDriver(
+        os.getenv('DB_SQLITE_PATH', 'datastore.sqlite3'))
 else:
-    # See
-    # https://stackoverflow.com/questions/31948742/localhost-endpoint-to-dynamodb-local-with-boto3
-    dynamodb = boto3.resource(
-        'dynamodb',
+    driver = drivers.DynamoDBDriver(
+        region,
+        access_key,
+        secret_access_key,
         endpoint_url=dynamodb_url,
-        region_name=region,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_access_key)
+        workers=int(os.getenv('DB_BATCH_WORKERS', '16')),
+        hooks=[limiter.install])
+
+# Worker processes started by gunicorn.conf.py, which each hold their
+# own copy of the in-memory state below
+web_concurrency = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# Read-through cache of /read results, keyed by (objtype, objkey).
+# Writes through this process invalidate their keys; the TTL bounds
+# staleness from writes made by any other replica.  Under the gunicorn
+# launcher every worker process has its own cache, which would miss the
+# writes of its sibling workers, so with several workers the cache is
+# off unless DB_CACHE_SIZE asks for it.
+cache_hits = Counter('datastore_cache_hits',
+                     'Reads served from the datastore cache')
+cache_misses = Counter('datastore_cache_misses',
+                       'Reads that went to the storage backend')
+cache_evictions = Counter('datastore_cache_evictions',
+                          'Cache entries evicted to stay within size')
+cache = TTLCache(
+    int(os.getenv('DB_CACHE_SIZE',
+                  '10000' if web_concurrency == 1 else '0')),
+    float(os.getenv('DB_CACHE_TTL', '30')),
+    on_evict=cache_evictions.inc)
+# Set on every change rather than through set_function(), which the
+# multiprocess metrics of the gunicorn launcher cannot see
+cache_entries = Gauge('datastore_cache_entries',
+                      'Entries in the datastore cache',
+                      multiprocess_mode='livesum')
+
+# Concurrent cache misses for the same (objtype, objkey, projection)
+# share one backend read.  Writes detach the read in flight, so later
+# readers never share a read that began before the write completed.
+coalesced_reads = Counter('datastore_coalesced_reads',
+                          'Reads that shared an identical in-flight read')
+flights = SingleFlight(on_shared=coalesced_reads.inc)
+
+# Most accessed keys, counted with a Space-Saving sketch of
+# DB_HOTKEYS_CAPACITY keys per kind over DB_HOTKEYS_WINDOW-second
+# windows.  See `/stats/hotkeys`; the top HOTKEYS_EXPORTED keys are also
+# exported to Prometheus.
+HOTKEYS_EXPORTED = 10
+hotkeys = HotKeys(('read', 'write'), ('objtype', 'objkey'),
+                  int(os.getenv('DB_HOTKEYS_CAPACITY', '100')),
+                  float(os.getenv('DB_HOTKEYS_WINDOW', '60')))
+REGISTRY.register(HotKeysCollector(hotkeys, HOTKEYS_EXPORTED))
+
+# The app is loaded once, before the workers fork, so these are logged
+# once per start
+if web_concurrency > 1:
+    if not cache.maxsize:
+        logging.warning(
+            '%d workers: the read cache is off; setting DB_CACHE_SIZE '
+            'turns it on, but a worker may then serve a value up to '
+            'DB_CACHE_TTL seconds old after a write through another',
+            web_concurrency)
+    logging.warning(
+        '%d workers: /stats/hotkeys counts only the accesses of the '
+        'worker that serves it, and datastore_hotkey_requests is not '
+        'exported', web_concurrency)
+
+# Upper bound on the number of items in one /batch_write or /batch_delete
+BATCH_REQUEST_LIMIT = 10000
+# A streaming /load reports progress after this many rows
+LOAD_PROGRESS_EVERY = 1000
+# Page sizes for /scan and /query
+SCAN_DEFAULT_LIMIT = 100
+SCAN_MAX_LIMIT = 1000
+# Upper bound on parallel segments in one `/scan?segments=N`
+SCAN_MAX_SEGMENTS = 16
+
+# Global secondary indexes of each objtype's table, as defined in
+# create_tables.py and the CloudFormation template:
+# index name -> (hash key, range key or None)
+INDEXES = {
+    'music': {'Artist-index': ('Artist', 'SongTitle')},
+    'user': {'email-index': ('email', None)},
+}
+
+# Threads that run the segments of parallel scans
+scan_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('DB_SCAN_WORKERS', '32')))
+
+# Map storage errors to HTTP statuses; anything else is a 500
+DRIVER_ERROR_STATUS = {
+    'ValidationException': 400,
+    'ResourceNotFoundException': 404,
+    'ConditionalCheckFailedException': 409,
+    # Refused by our rate limiter before reaching DynamoDB
+    'RateLimitedException': 429,
+    # Throttled by DynamoDB even after the SDK's retries
+    'ProvisionedThroughputExceededException': 503,
+    'ThrottlingException': 503,
+    'RequestLimitExceeded': 503,
+}
+
+
+def table_names(objtype):
+    '''Return the (table name, key attribute) pair for an objtype'''
+    return objtype.capitalize()+"-ZZ-REG-ID", objtype + "_id"
+
+
+def invalidate(objtype, objkey):
+    '''Call after every write of an item, once the write has completed'''
+    cache.invalidate((objtype, objkey))
+    cache_entries.set(len(cache))
+    flights.forget((objtype, objkey))
+
+
+@bp.errorhandler(drivers.DriverError)
+def driver_error(e):
+    status = DRIVER_ERROR_STATUS.get(e.code, 500)
+    headers = {}
+    if status in (429, 503):
+        headers['Retry-After'] = str(math.ceil(e.retry_after or 1))
+    return Response(
+        json.dumps({"http_status_code": status, "reason": e.code}),
+        status=status,
+        headers=headers,
+        mimetype='application/json')
 
 
-# Change the implementation of this: you should probably have a separate
-# driver class for interfacing with a db like dynamodb in a different file.
 @bp.route('/update', methods=['PUT'])
 def update():
+    '''
+    Update one item atomically.
+
+    Each top-level attribute in the body is set, as before.  The body
+    may also hold these reserved keys:
+    - `$ops`: a list of server-side operations, such as
+      `{"op": "append", "attr": "music_id_list", "values": [id]}`
+      (see drivers.UPDATE_OPS for the full list).
+    - `$condition`: a list of checks that must all hold, such as
+      `{"attr": "music_id_list", "cmp": "not_contains", "value": id}`
+      (see drivers.CONDITION_EXPRESSIONS).  A failed check changes
+      nothing and returns 409.
+    - `$return`: 'ALL_NEW' or 'ALL_OLD' to get the item back in
+      `Attributes`.
+
+    As with `/write`, a value given as `{"$binary": <base64>}` is
+    stored as a Binary attribute; reads return it as a base64 string.
+    '''
     headers = request.headers  # noqa: F841
     # check header here
-    content = request.get_json()
+    # Parse numbers as Decimal, which is what DynamoDB accepts
+    content = json.loads(request.get_data(), use_decimal=True,
+                         object_hook=drivers.decode_binary)
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
     objkey = urllib.parse.unquote_plus(request.args.get('objkey'))
-    table_name = objtype.capitalize()+"-ZZ-REG-ID"
-    table_id = objtype + "_id"
-    table = dynamodb.Table(table_name)
-    expression = 'SET '
-    x = 1
-    attrvals = {}
-    for k in content.keys():
-        expression += k + ' = :val' + str(x) + ', '
-        attrvals[':val' + str(x)] = content[k]
-        x += 1
-    expression = expression[:-2]
-    response = table.update_item(Key={table_id: objkey},
-                                 UpdateExpression=expression,
-                                 ExpressionAttributeValues=attrvals)
-    return response
+    hotkeys.add('write', (objtype, objkey))
+    ops = content.pop('$ops', [])
+    conditions = content.pop('$condition', [])
+    return_values = content.pop('$return', 'NONE')
+    table_name, table_id = table_names(objtype)
+    attributes = driver.update(table_name, table_id, objkey, content,
+                               ops=ops, conditions=conditions,
+                               return_values=return_values)
+    invalidate(objtype, objkey)
+    if attributes:
+        return json_response({"Attributes": attributes})
+    return {}
+
+
+def fetch(objtype, objkey, fields):
+    '''Read an item from the backend, caching it if it is whole'''
+    table_name, table_id = table_names(objtype)
+    token = cache.token()
+    item = driver.get(table_name, table_id, objkey, fields=fields)
+    # Only whole items are cached; projections are cut from them
+    if item is not None and not fields:
+        cache.put((objtype, objkey), item, token)
+        cache_entries.set(len(cache))
+    return item
 
 
 @bp.route('/read', methods=['GET'])
 def read():
+    '''
+    Read one item by primary key with GetItem.
+
+    Optional query parameters:
+    - `fields`: attribute names to return (comma-separated or
+      repeated); the key attribute is always included.
+    - `consistent`: 'true' for a strongly consistent read, which
+      also bypasses the cache and is never coalesced.
+
+    Concurrent cache misses for the same item and projection share one
+    backend read (see `flights`).
+
+    The response is `{"Count": 0 or 1, "Items": [...]}`, the shape
+    the old Query-based implementation returned.
+    '''
     headers = request.headers  # noqa: F841
     # check header here
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
     objkey = urllib.parse.unquote_plus(request.args.get('objkey'))
-    table_name = objtype.capitalize()+"-ZZ-REG-ID"
-    table_id = objtype + "_id"
-    table = dynamodb.Table(table_name)
-    response = table.query(Select='ALL_ATTRIBUTES',
-                           KeyConditionExpression=Key(table_id).eq(objkey))
-    return response
-
-# @bp.route('/batch_read', methods=['GET'])
-# def batch_read():
-#     headers = request.headers  # noqa: F841
-#     # check header here
-#     objtype = request.args.get('objtype')
-#     objkeys = request.args.getlist('objkeys')
-#     table_name = objtype.capitalize()+"-ZZ-REG-ID"
-#     batch_keys = {
-#         table_name: {
-#             'Keys': [{'music_id': objkey} for objkey in objkeys]
-#         }
-#     }
-#     response = dynamodb.batch_get_item(RequestItems=batch_keys)
-#     if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-#         return json.dumps({'error': 'Failed to do batch get'})
-#     return Response(json.dumps({'Responses': response['Responses'][table_name]}), status=200)
+    hotkeys.add('read', (objtype, objkey))
+    fields = [f for arg in request.args.getlist('fields')
+              for f in arg.split(',') if f]
+    consistent = request.args.get('consistent', '').lower() == 'true'
+    table_name, table_id = table_names(objtype)
+    hit, item = False, None
+    if not consistent:
+        hit, item = cache.get((objtype, objkey))
+    if hit:
+        cache_hits.inc()
+        if fields:
+            item = drivers.project(item, table_id, fields)
+    elif consistent:
+        item = driver.get(table_name, table_id, objkey,
+                          fields=fields, consistent=True)
+    else:
+        cache_misses.inc()
+        item = flights.do((objtype, objkey), frozenset(fields),
+                          lambda: fetch(objtype, objkey, fields))
+    items = [item] if item is not None else []
+    return json_response({"Count": len(items), "Items": items})
+
+
+@bp.route('/batch_read', methods=['GET', 'POST'])
+def batch_read():
+    '''
+    Read many items of one objtype in as few round trips as possible.
+
+    Keys come from repeated `objkeys` query parameters (GET) or from a
+    JSON body `{"objtype": ..., "objkeys": [...]}` (POST) when the list
+    is too long for a URL.  The DynamoDB driver splits the keys into
+    BatchGetItem calls of at most 100 keys, which run in parallel.
+
+    The response has the same shape as `/read`, with `Items` in the
+    order the keys were requested.  Keys that do not exist are listed
+    in `Missing`; keys the backend still would not serve after retrying
+    are listed in `Unprocessed`, as are the keys of a call that failed
+    while others succeeded.  If every call failed, the request fails
+    with the first call's error.
+    '''
+    headers = request.headers  # noqa: F841
+    # check header here
+    if request.method == 'POST':
+        content = request.get_json()
+        objtype = content['objtype']
+        objkeys = content['objkeys']
+    else:
+        objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+        objkeys = [urllib.parse.unquote_plus(k)
+                   for k in request.args.getlist('objkeys')]
+    table_name, table_id = table_names(objtype)
+    # BatchGetItem rejects duplicate keys within one request
+    unique_keys = list(dict.fromkeys(objkeys))
+    items, unprocessed = driver.batch_get(table_name, table_id, unique_keys)
+    found = {item[table_id]: item for item in items}
+    pending = set(unprocessed)
+    result = {
+        "Items": [found[k] for k in objkeys if k in found],
+        "Missing": [k for k in unique_keys
+                    if k not in found and k not in pending]
+    }
+    result["Count"] = len(result["Items"])
+    if unprocessed:
+        result["Unprocessed"] = unprocessed
+    return json_response(result)
+
+
+@bp.route('/scan', methods=['GET'])
+def scan():
+    '''
+    Enumerate every item of one objtype.
+
+    By default this returns one page, `{"Count", "Items", "Cursor"}`,
+    of at most `limit` items.  `Cursor` is present only if more items
+    remain; pass it back as `cursor` to get the next page.
+
+    With `segments=N` the whole table is instead read as N parallel
+    scan segments and streamed back as NDJSON, one `{"Item": ...}`
+    line per item followed by `{"done": true, "Count": n}` (or
+    `{"done": false, "reason": code}` if the backend failed).
+
+    A `limit` or `segments` that is not an integer in range is answered
+    400 `ValidationException`; a `limit` above SCAN_MAX_LIMIT is cut
+    to it.
+    '''
+    headers = request.headers  # noqa: F841
+    # check header here
+    objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+    table_name, table_id = table_names(objtype)
+    segments = drivers.int_arg(request.args.get('segments'), 0, 0,
+                               SCAN_MAX_SEGMENTS)
+    if segments:
+        return Response(parallel_scan(table_name, table_id, segments),
+                        status=200,
+                        mimetype='application/x-ndjson')
+    # A larger limit is cut to SCAN_MAX_LIMIT, as a page may hold
+    # fewer items than asked for anyway
+    limit = min(drivers.int_arg(request.args.get('limit'),
+                                SCAN_DEFAULT_LIMIT, 1), SCAN_MAX_LIMIT)
+    cursor = request.args.get('cursor')
+    items, last_key = driver.scan(
+        table_name, table_id, limit=limit,
+        start_key=drivers.decode_cursor(cursor) if cursor else None)
+    result = {"Count": len(items), "Items": items}
+    if last_key:
+        result["Cursor"] = drivers.encode_cursor(last_key)
+    return json_response(result)
+
+
+def parallel_scan(table_name, table_id, segments):
+    '''
+    Generate NDJSON lines for a scan split into `segments` parallel
+    segments.  Each segment runs on `scan_pool` and feeds a bounded
+    queue, so a slow client slows the scan instead of filling memory.
+    '''
+    out = queue.Queue(maxsize=SCAN_MAX_LIMIT)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                out.put(entry, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def run_segment(segment):
+        start_key = None
+        try:
+            while not stop.is_set():
+                items, start_key = driver.scan(
+                    table_name, table_id, limit=SCAN_MAX_LIMIT,
+                    start_key=start_key, segment=segment,
+                    total_segments=segments)
+                for item in items:
+                    put(('item', item))
+                if not start_key:
+                    break
+            put(('done', None))
+        except drivers.DriverError as e:
+            put(('error', e.code))
+
+    for segment in range(segments):
+        scan_pool.submit(run_segment, segment)
+    count = 0
+    finished = 0
+    try:
+        while finished < segments:
+            kind, value = out.get()
+            if kind == 'item':
+                count += 1
+                yield fastjson.dumps({"Item": value}, newline=True)
+            elif kind == 'done':
+                finished += 1
+            else:
+                yield json.dumps({"done": False, "reason": value}) + '\n'
+                return
+        yield json.dumps({"done": True, "Count": count}) + '\n'
+    finally:
+        # Also reached when the client disconnects mid-stream
+        stop.set()
+
+
+def index_keys(objtype, index):
+    '''Return the (hash key, range key) attributes of an objtype's index'''
+    try:
+        return INDEXES[objtype][index]
+    except KeyError as e:
+        raise drivers.DriverError(
+            'ValidationException',
+            'No index {} on {}'.format(index, objtype)) from e
+
+
+@bp.route('/query', methods=['GET', 'POST'])
+def query():
+    '''
+    Find the items of one objtype by a global secondary index (see
+    INDEXES), reading only the matching items instead of the table.
+
+    GET takes `objtype`, `index` and `key`, the value of the index's
+    hash key, plus optional `fields`, `limit` and `cursor` as for
+    `/read` and `/scan`.  POST takes the same as a JSON body, which may
+    also hold:
+    - `range`: a condition on the index's range key, such as
+      `{"cmp": "begins_with", "value": "The"}` (see
+      drivers.KEY_CONDITIONS).
+    - `filter`: a list of conditions that returned items must also
+      meet, in the format of `/update`'s `$condition`.
+
+    The response is one page, `{"Count", "Items", "Cursor"}`, as for
+    `/scan`.  Because `limit` counts the items examined before
+    filtering, a filtered page may be short, or even empty, and still
+    have a `Cursor`.
+    '''
+    headers = request.headers  # noqa: F841
+    # check header here
+    if request.method == 'POST':
+        content = json.loads(request.get_data(), use_decimal=True)
+    else:
+        content = {k: urllib.parse.unquote_plus(request.args.get(k))
+                   for k in ('objtype', 'index', 'key', 'cursor')
+                   if k in request.args}
+        content['fields'] = [f for arg in request.args.getlist('fields')
+                             for f in arg.split(',') if f]
+        if 'limit' in request.args:
+            content['limit'] = request.args['limit']
+    try:
+        objtype = content['objtype']
+        hash_key, range_key = index_keys(objtype, content['index'])
+        key_conditions = [{'attr': hash_key, 'cmp': 'eq',
+                           'value': content['key']}]
+        if 'range' in content:
+            if range_key is None:
+                raise ValueError('Index has no range key')
+            key_conditions.append(dict(content['range'], attr=range_key))
+        limit = max(1, min(int(content.get('limit') or SCAN_DEFAULT_LIMIT),
+                           SCAN_MAX_LIMIT))
+    except (KeyError, TypeError, ValueError) as e:
+        raise drivers.DriverError('ValidationException', str(e)) from e
+    cursor = content.get('cursor')
+    table_name, table_id = table_names(objtype)
+    items, last_key = driver.query(
+        table_name, table_id, content['index'], key_conditions,
+        filters=content.get('filter', ()), fields=content.get('fields'),
+        limit=limit,
+        start_key=drivers.decode_cursor(cursor) if cursor else None)
+    result = {"Count": len(items), "Items": items}
+    if last_key:
+        result["Cursor"] = drivers.encode_cursor(last_key)
+    return json_response(result)
+
 
 @bp.route('/write', methods=['POST'])
 def write():
     headers = request.headers  # noqa: F841
     # check header here
-    content = request.get_json()
-    table_name = content['objtype'].capitalize()+"-ZZ-REG-ID"
+    # Numbers as Decimal, which is what DynamoDB accepts, and
+    # {"$binary": <base64>} values as Binary attributes
+    content = json.loads(request.get_data(), use_decimal=True,
+                         object_hook=drivers.decode_binary)
     objtype = content['objtype']
-    table_id = objtype + "_id"
+    table_name, table_id = table_names(objtype)
     payload = {table_id: str(uuid.uuid4())}
     del content['objtype']
     for k in content.keys():
         payload[k] = content[k]
-    table = dynamodb.Table(table_name)
-    response = table.put_item(Item=payload)
-    returnval = ''
-    if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-        returnval = {"message": "fail"}
-    return json.dumps(
-        ({table_id: payload[table_id]}, returnval)['returnval' in globals()])
+    hotkeys.add('write', (objtype, payload[table_id]))
+    driver.put(table_name, table_id, payload)
+    invalidate(objtype, payload[table_id])
+    return json.dumps({table_id: payload[table_id]})
 
 
 def decode_auth_token(token):
@@ -170,8 +593,11 @@ def load():
        400 is returned if this condition is not met.
     2. The caller must include an "Authorization" header accepted
        by load_auth(). A 401 status is returned for authorization failure.
-    3. If the database returns a non-200 status code, this routine
-       responds with an {http_status_code: status} object.
+    3. If the database fails, this routine responds with an
+       {http_status_code: status, reason: code} object.
+
+    A body of type `application/x-ndjson` is a stream of such objects,
+    one per line, and is handled by load_stream().
 
     This routine potentially could share a common subroutine with
     write() but the HTTP error processing in write() seems wrong
@@ -185,36 +611,230 @@ def load():
             status=401,
             mimetype='application/json')
 
-    content = request.get_json()
+    if request.mimetype == 'application/x-ndjson':
+        return load_stream()
+
+    content = json.loads(request.get_data(), use_decimal=True)
     if 'uuid' not in content:
         return json.dumps({"http_status_code": 400, "reason": 'Missing uuid'})
-    table_name = content['objtype'].capitalize()+"-ZZ-REG-ID"
     objtype = content['objtype']
-    table_id = objtype + "_id"
+    table_name, table_id = table_names(objtype)
     payload = {table_id: content['uuid']}
     del content['objtype']
     del content['uuid']
     for k in content.keys():
         payload[k] = content[k]
-    table = dynamodb.Table(table_name)
-    response = table.put_item(Item=payload)
-    status = response['ResponseMetadata']['HTTPStatusCode']
-    if status != 200:
-        return json.dumps({"http_status_code": status})
+    driver.put(table_name, table_id, payload)
+    invalidate(objtype, payload[table_id])
     return json.dumps({table_id: payload[table_id]})
 
 
+def load_stream():
+    '''
+    Bulk-load a (possibly chunked) NDJSON body, one `/load` object
+    per line.
+
+    The caller has already been authorized once for the whole stream.
+    Rows are parsed as they arrive and queued on a per-table driver
+    writer, which sends them in batches and resends any unprocessed
+    items.  The response is itself NDJSON:
+
+    - `{"line": n, "reason": ...}` for each row that was rejected,
+    - `{"loaded": n, "errors": e}` every LOAD_PROGRESS_EVERY rows,
+    - `{"done": true, "loaded": n, "errors": e}` at the end, or
+      `{"done": false, ..., "reason": code}` if the backend failed and
+      the load stopped.
+    '''
+    stream = request.stream
+
+    def generate():
+        loaded = 0
+        errors = 0
+        try:
+            with ExitStack() as stack:
+                writers = {}
+                for lineno, raw in enumerate(stream, 1):
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    try:
+                        content = json.loads(line, use_decimal=True)
+                        objtype = content.pop('objtype')
+                        objkey = content.pop('uuid')
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        errors += 1
+                        yield json.dumps({
+                            "line": lineno,
+                            "reason": "Malformed row or missing "
+                                      "objtype/uuid"}) + '\n'
+                        continue
+                    table_name, table_id = table_names(objtype)
+                    writer = writers.get(objtype)
+                    if writer is None:
+                        writer = stack.enter_context(
+                            driver.writer(table_name, table_id))
+                        writers[objtype] = writer
+                    content[table_id] = objkey
+                    writer.put_item(Item=content)
+                    # The row may not be flushed yet; a read racing the
+                    # flush can cache the old item for at most the TTL
+                    invalidate(objtype, objkey)
+                    loaded += 1
+                    if loaded % LOAD_PROGRESS_EVERY == 0:
+                        yield json.dumps({"loaded": loaded,
+                                          "errors": errors}) + '\n'
+        except drivers.DriverError as e:
+            yield json.dumps({"done": False,
+                              "loaded": loaded,
+                              "errors": errors,
+                              "reason": e.code}) + '\n'
+            return
+        yield json.dumps({"done": True,
+                          "loaded": loaded,
+                          "errors": errors}) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    status=200,
+                    mimetype='application/x-ndjson')
+
+
+def batch_response(table_id, keys, outcome, duplicates=()):
+    '''
+    Build the per-item report for /batch_write and /batch_delete.
+    `keys` is in request order; `duplicates` holds the positions of
+    items that were dropped because an earlier item had the same key.
+    '''
+    results = [{table_id: k,
+                "status": "duplicate" if i in duplicates else outcome[k]}
+               for i, k in enumerate(keys)]
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return json_response({"Count": ok,
+                          "Failed": len(results) - ok,
+                          "Results": results})
+
+
+@bp.route('/batch_write', methods=['POST'])
+def batch_write():
+    '''
+    Write many items of one objtype with BatchWriteItem.
+
+    The body is `{"objtype": ..., "items": [{...}, ...]}`.  As with
+    write(), each item is assigned a fresh UUID.  An item may instead
+    carry its own `uuid`, as with load(); the request then needs the
+    same Authorization header as `/load`.
+
+    The DynamoDB driver sends items 25 to a call, with the calls running
+    concurrently.  The response reports the outcome of every item, in
+    request order: "ok", "unprocessed" (DynamoDB kept throttling it),
+    "duplicate" (another item in the request has the same key), or the
+    backend error code.
+    '''
+    try:
+        content = json.loads(request.get_data(), use_decimal=True,
+                             object_hook=drivers.decode_binary)
+        objtype = content['objtype']
+        items = content['items']
+    except (KeyError, TypeError, ValueError):
+        return Response(
+            json.dumps({"http_status_code": 400,
+                        "reason": "Missing objtype or items"}),
+            status=400,
+            mimetype='application/json')
+    if len(items) > BATCH_REQUEST_LIMIT:
+        return Response(
+            json.dumps({"http_status_code": 400,
+                        "reason": "Too many items"}),
+            status=400,
+            mimetype='application/json')
+    if (any('uuid' in item for item in items)
+            and not load_auth(request.headers)):
+        return Response(
+            json.dumps({"http_status_code": 401,
+                        "reason": "Invalid authorization for uuid"}),
+            status=401,
+            mimetype='application/json')
+    table_name, table_id = table_names(objtype)
+    keys = []
+    write_requests = []
+    duplicates = set()
+    seen = set()
+    for i, item in enumerate(items):
+        payload = dict(item)
+        payload[table_id] = payload.pop('uuid', None) or str(uuid.uuid4())
+        keys.append(payload[table_id])
+        # BatchWriteItem rejects a request naming the same key twice
+        if payload[table_id] in seen:
+            duplicates.add(i)
+            continue
+        seen.add(payload[table_id])
+        write_requests.append({'PutRequest': {'Item': payload}})
+    outcome = driver.batch_write(table_name, table_id, write_requests)
+    for k in seen:
+        invalidate(objtype, k)
+    return batch_response(table_id, keys, outcome, duplicates)
+
+
 @bp.route('/delete', methods=['DELETE'])
 def delete():
     headers = request.headers  # noqa: F841
     # check header here
     objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
     objkey = urllib.parse.unquote_plus(request.args.get('objkey'))
-    table_name = objtype.capitalize()+"-ZZ-REG-ID"
-    table_id = objtype + "_id"
-    table = dynamodb.Table(table_name)
-    response = table.delete_item(Key={table_id: objkey})
-    return response
+    table_name, table_id = table_names(objtype)
+    driver.delete(table_name, table_id, objkey)
+    invalidate(objtype, objkey)
+    return {}
+
+
+@bp.route('/batch_delete', methods=['DELETE', 'POST'])
+def batch_delete():
+    '''
+    Delete many items of one objtype with BatchWriteItem.
+
+    Keys come from repeated `objkeys` query parameters or from a JSON
+    body `{"objtype": ..., "objkeys": [...]}`.  The response has the
+    same per-item shape as `/batch_write`.  Deleting a key that does
+    not exist succeeds, so repeated keys are all reported "ok".
+    '''
+    headers = request.headers  # noqa: F841
+    # check header here
+    content = request.get_json(silent=True)
+    if content:
+        objtype = content['objtype']
+        objkeys = content['objkeys']
+    else:
+        objtype = urllib.parse.unquote_plus(request.args.get('objtype'))
+        objkeys = [urllib.parse.unquote_plus(k)
+                   for k in request.args.getlist('objkeys')]
+    if len(objkeys) > BATCH_REQUEST_LIMIT:
+        return Response(
+            json.dumps({"http_status_code": 400,
+                        "reason": "Too many items"}),
+            status=400,
+            mimetype='application/json')
+    table_name, table_id = table_names(objtype)
+    write_requests = [{'DeleteRequest': {'Key': {table_id: k}}}
+                      for k in dict.fromkeys(objkeys)]
+    outcome = driver.batch_write(table_name, table_id, write_requests)
+    for k in objkeys:
+        invalidate(objtype, k)
+    return batch_response(table_id, objkeys, outcome)
+
+
+@bp.route('/stats/hotkeys', methods=['GET'])
+@metrics.do_not_track()
+def hot_keys():
+    '''
+    Report the most accessed keys.
+
+    `/read` counts as a read and `/update` and `/write` as writes.  For
+    the window in progress and the last complete one, each kind lists
+    its `Total` accesses and up to `n` (default 20) keys, most accessed
+    first.  A key's `count` overestimates its accesses by at most its
+    `error`.
+    '''
+    n = drivers.int_arg(request.args.get('n'), 20, 0)
+    return hotkeys.report(n)
 
 
 @bp.route('/health')
@@ -0,0 +1,705 @@
+"""
+SFU CMPT 756
+Sample application---database service, asyncio (ASGI) build.
+
+Serves the same `/api/v1/datastore/` API as `app.py`, with the same
+environment variables and Prometheus metric names, but every storage
+call is a coroutine.  A single process can therefore hold thousands of
+backend calls in flight without a thread for each.  `DB_MAX_INFLIGHT`
+caps the number of concurrent storage calls; requests beyond it queue
+inside the process rather than overloading DynamoDB.
+
+Run with
+    python asgi.py 30002
+"""
+
+# Standard library modules
+import asyncio
+import base64
+import logging
+import math
+import os
+import sys
+import time
+import urllib.parse
+import uuid
+from contextlib import AsyncExitStack
+from contextlib import asynccontextmanager
+
+# Installed packages
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import REGISTRY
+from prometheus_client import generate_latest
+from prometheus_client import Histogram
+
+import simplejson as json
+
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.responses import StreamingResponse
+from starlette.routing import Mount
+from starlette.routing import Route
+
+import uvicorn
+
+# Local modules
+import aio_drivers
+import drivers
+import fastjson
+import throttle
+from cache import TTLCache
+from hotkeys import HotKeys
+from hotkeys import HotKeysCollector
+from singleflight import AsyncSingleFlight
+
+# default to us-east-1 if no region is specified
+# (us-east-1 is the default/only supported region for a starter account)
+region = os.getenv('AWS_REGION', 'us-east-1')
+
+# these must be present; if they are missing, we should probably bail now
+access_key = os.getenv('AWS_ACCESS_KEY_ID')
+secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+
+# Must be presented to authorize call to `/load`
+loader_token = os.getenv('SVC_LOADER_TOKEN')
+
+# In some testing contexts, we pass in the DynamoDB URL
+dynamodb_url = os.getenv('DYNAMODB_URL', '')
+
+# Maximum storage calls in flight at once across all requests
+max_inflight = int(os.getenv('DB_MAX_INFLIGHT', '512'))
+
+# Storage backend: 'dynamodb' (default) or 'sqlite' for a self-contained
+# run on a laptop or CI box
+driver_name = os.getenv('DB_DRIVER', 'dynamodb')
+
+# Client-side limit on the DynamoDB call rate of each table, adapted
+# AIMD-style to the throttles DynamoDB returns.  A call that cannot get
+# a turn within DB_RATE_MAX_WAIT seconds is refused with a 429.
+limiter = throttle.AIMDLimiter(
+    initial_rate=float(os.getenv('DB_RATE_INITIAL', '100')),
+    min_rate=float(os.getenv('DB_RATE_MIN', '1')),
+    max_rate=float(os.getenv('DB_RATE_MAX', '5000')),
+    max_wait=float(os.getenv('DB_RATE_MAX_WAIT', '0.5')))
+
+if driver_name == 'sqlite':
+    driver = aio_drivers.AsyncDriver(
+        drivers.SQLiteDriver(
+            os.getenv('DB_SQLITE_PATH', 'datastore.sqlite3')),
+        max_inflight=min(max_inflight, 64))
+else:
+    driver = aio_drivers.AsyncDynamoDBDriver(
+        region,
+        access_key,
+        secret_access_key,
+        endpoint_url=dynamodb_url,
+        max_inflight=max_inflight,
+        hooks=[limiter.install_async])
+
+# The same metric names as prometheus_flask_exporter in app.py, so
+# dashboards work against either build
+request_duration = Histogram('flask_http_request_duration_seconds',
+                             'Flask HTTP request duration in seconds',
+                             ['method', 'path', 'status'])
+request_total = Counter('flask_http_request_total',
+                        'Total number of HTTP requests',
+                        ['method', 'status'])
+Gauge('app_info', 'Database process (asyncio)').set(1)
+
+# Read-through cache of /read results, keyed by (objtype, objkey).
+# Writes through this process invalidate their keys; the TTL bounds
+# staleness from writes made by any other replica.
+cache_hits = Counter('datastore_cache_hits',
+                     'Reads served from the datastore cache')
+cache_misses = Counter('datastore_cache_misses',
+                       'Reads that went to the storage backend')
+cache_evictions = Counter('datastore_cache_evictions',
+                          'Cache entries evicted to stay within size')
+cache = TTLCache(int(os.getenv('DB_CACHE_SIZE', '10000')),
+                 float(os.getenv('DB_CACHE_TTL', '30')),
+                 on_evict=cache_evictions.inc)
+Gauge('datastore_cache_entries',
+      'Entries in the datastore cache').set_function(lambda: len(cache))
+
+# Concurrent cache misses for the same (objtype, objkey, projection)
+# share one backend read.  Writes detach the read in flight, so later
+# readers never share a read that began before the write completed.
+coalesced_reads = Counter('datastore_coalesced_reads',
+                          'Reads that shared an identical in-flight read')
+flights = AsyncSingleFlight(on_shared=coalesced_reads.inc)
+
+# Most accessed keys, counted with a Space-Saving sketch of
+# DB_HOTKEYS_CAPACITY keys per kind over DB_HOTKEYS_WINDOW-second
+# windows.  See `/stats/hotkeys`; the top HOTKEYS_EXPORTED keys are also
+# exported to Prometheus.
+HOTKEYS_EXPORTED = 10
+hotkeys = HotKeys(('read', 'write'), ('objtype', 'objkey'),
+                  int(os.getenv('DB_HOTKEYS_CAPACITY', '100')),
+                  float(os.getenv('DB_HOTKEYS_WINDOW', '60')))
+REGISTRY.register(HotKeysCollector(hotkeys, HOTKEYS_EXPORTED))
+
+# Upper bound on the number of items in one /batch_write or /batch_delete
+BATCH_REQUEST_LIMIT = 10000
+# A streaming /load reports progress after this many rows
+LOAD_PROGRESS_EVERY = 1000
+# Page sizes for /scan and /query
+SCAN_DEFAULT_LIMIT = 100
+SCAN_MAX_LIMIT = 1000
+# Upper bound on parallel segments in one `/scan?segments=N`
+SCAN_MAX_SEGMENTS = 16
+
+# Global secondary indexes of each objtype's table, as defined in
+# create_tables.py and the CloudFormation template:
+# index name -> (hash key, range key or None)
+INDEXES = {
+    'music': {'Artist-index': ('Artist', 'SongTitle')},
+    'user': {'email-index': ('email', None)},
+}
+
+# Map storage errors to HTTP statuses; anything else is a 500
+DRIVER_ERROR_STATUS = {
+    'ValidationException': 400,
+    'ResourceNotFoundException': 404,
+    'ConditionalCheckFailedException': 409,
+    # Refused by our rate limiter before reaching DynamoDB
+    'RateLimitedException': 429,
+    # Throttled by DynamoDB even after the SDK's retries
+    'ProvisionedThroughputExceededException': 503,
+    'ThrottlingException': 503,
+    'RequestLimitExceeded': 503,
+}
+
+# Routes that, as in app.py, are not tracked in the request metrics
+UNTRACKED = ('/health', '/readiness', '/metrics', '/stats/hotkeys')
+
+
+def table_names(objtype):
+    '''Return the (table name, key attribute) pair for an objtype'''
+    return objtype.capitalize()+"-ZZ-REG-ID", objtype + "_id"
+
+
+def invalidate(objtype, objkey):
+    '''Call after every write of an item, once the write has completed'''
+    cache.invalidate((objtype, objkey))
+    flights.forget((objtype, objkey))
+
+
+def json_response(obj, status=200):
+    '''Return `obj` as a JSON response, encoded by fastjson'''
+    return Response(fastjson.dumps(obj),
+                    status_code=status,
+                    media_type='application/json')
+
+
+async def get_json(request):
+    '''Parse the request body, with numbers as Decimal for DynamoDB and
+    {"$binary": <base64>} values as bytes, stored as Binary'''
+    return json.loads(await request.body(), use_decimal=True,
+                      object_hook=drivers.decode_binary)
+
+
+def query_arg(request, name):
+    value = request.query_params.get(name)
+    return urllib.parse.unquote_plus(value) if value is not None else None
+
+
+def query_list(request, name):
+    return [urllib.parse.unquote_plus(v)
+            for v in request.query_params.getlist(name)]
+
+
+def load_auth(headers):
+    '''Return True if caller authorized to do a `/load` '''
+    if 'Authorization' not in headers:
+        return False
+    # Auth string is 'Basic ' concatenated with base64 encoding of uname:passwd
+    auth_string = headers['Authorization'].split()[1]
+    name, pwd = base64.standard_b64decode(auth_string).decode().split(':')
+    return name == 'svc-loader' and pwd == loader_token
+
+
+async def driver_error(request, e):
+    status = DRIVER_ERROR_STATUS.get(e.code, 500)
+    response = json_response({"http_status_code": status, "reason": e.code},
+                             status)
+    if status in (429, 503):
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after or 1))
+    return response
+
+
+async def update(request):
+    '''Update one item atomically; see update() in app.py'''
+    content = await get_json(request)
+    objtype = query_arg(request, 'objtype')
+    objkey = query_arg(request, 'objkey')
+    hotkeys.add('write', (objtype, objkey))
+    ops = content.pop('$ops', [])
+    conditions = content.pop('$condition', [])
+    return_values = content.pop('$return', 'NONE')
+    table_name, table_id = table_names(objtype)
+    attributes = await driver.update(table_name, table_id, objkey, content,
+                                     ops=ops, conditions=conditions,
+                                     return_values=return_values)
+    invalidate(objtype, objkey)
+    return json_response({"Attributes": attributes} if attributes else {})
+
+
+async def fetch(objtype, objkey, fields):
+    '''Read an item from the backend, caching it if it is whole'''
+    table_name, table_id = table_names(objtype)
+    token = cache.token()
+    item = await driver.get(table_name, table_id, objkey, fields=fields)
+    if item is not None and not fields:
+        cache.put((objtype, objkey), item, token)
+    return item
+
+
+async def read(request):
+    '''Read one item by primary key; see read() in app.py'''
+    objtype = query_arg(request, 'objtype')
+    objkey = query_arg(request, 'objkey')
+    hotkeys.add('read', (objtype, objkey))
+    fields = [f for arg in request.query_params.getlist('fields')
+              for f in arg.split(',') if f]
+    consistent = request.query_params.get('consistent', '').lower() == 'true'
+    table_name, table_id = table_names(objtype)
+    hit, item = False, None
+    if not consistent:
+        hit, item = cache.get((objtype, objkey))
+    if hit:
+        cache_hits.inc()
+        if fields:
+            item = drivers.project(item, table_id, fields)
+    elif consistent:
+        item = await driver.get(table_name, table_id, objkey,
+                                fields=fields, consistent=True)
+    else:
+        cache_misses.inc()
+        item = await flights.do((objtype, objkey), frozenset(fields),
+                                lambda: fetch(objtype, objkey, fields))
+    items = [item] if item is not None else []
+    return json_response({"Count": len(items), "Items": items})
+
+
+async def batch_read(request):
+    '''Read many items of one objtype; see batch_read() in app.py'''
+    if request.method == 'POST':
+        content = await get_json(request)
+        objtype = content['objtype']
+        objkeys = content['objkeys']
+    else:
+        objtype = query_arg(request, 'objtype')
+        objkeys = query_list(request, 'objkeys')
+    table_name, table_id = table_names(objtype)
+    unique_keys = list(dict.fromkeys(objkeys))
+    items, unprocessed = await driver.batch_get(table_name, table_id,
+                                                unique_keys)
+    found = {item[table_id]: item for item in items}
+    pending = set(unprocessed)
+    result = {
+        "Items": [found[k] for k in objkeys if k in found],
+        "Missing": [k for k in unique_keys
+                    if k not in found and k not in pending]
+    }
+    result["Count"] = len(result["Items"])
+    if unprocessed:
+        result["Unprocessed"] = unprocessed
+    return json_response(result)
+
+
+async def write(request):
+    content = await get_json(request)
+    objtype = content.pop('objtype')
+    table_name, table_id = table_names(objtype)
+    payload = {table_id: str(uuid.uuid4())}
+    payload.update(content)
+    hotkeys.add('write', (objtype, payload[table_id]))
+    await driver.put(table_name, table_id, payload)
+    invalidate(objtype, payload[table_id])
+    return json_response({table_id: payload[table_id]})
+
+
+async def load(request):
+    '''Load a value, or an NDJSON stream of them; see load() in app.py'''
+    if not load_auth(request.headers):
+        return json_response({"http_status_code": 401,
+                              "reason": "Invalid authorization for /load"},
+                             401)
+    if request.headers.get('content-type', '').startswith(
+            'application/x-ndjson'):
+        return await load_stream(request)
+    content = await get_json(request)
+    if 'uuid' not in content:
+        return json_response({"http_status_code": 400,
+                              "reason": 'Missing uuid'})
+    objtype = content.pop('objtype')
+    table_name, table_id = table_names(objtype)
+    payload = {table_id: content.pop('uuid')}
+    payload.update(content)
+    await driver.put(table_name, table_id, payload)
+    invalidate(objtype, payload[table_id])
+    return json_response({table_id: payload[table_id]})
+
+
+async def ndjson_lines(request):
+    '''Yield the lines of a (possibly chunked) request body as it arrives'''
+    buffer = b''
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """A StreamingResponse whose body may still be reading the request
+    body.  StreamingResponse would also listen for the client's
+    disconnect, taking request body messages from the reader; the
+    reader sees a disconnect itself."""
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def load_stream(request):
+    '''
+    Bulk-load an NDJSON body as in load_stream() in app.py.
+
+    The body is consumed as it arrives, without being buffered, and
+    each report line is sent as soon as it is known, so neither side
+    holds more than a batch of rows.
+    '''
+    async def generate():
+        loaded = 0
+        errors = 0
+        try:
+            async with AsyncExitStack() as stack:
+                writers = {}
+                lineno = 0
+                async for raw in ndjson_lines(request):
+                    lineno += 1
+                    line = raw.strip()
+                    if not line:
+                        continue
+                    try:
+                        content = json.loads(line, use_decimal=True)
+                        objtype = content.pop('objtype')
+                        objkey = content.pop('uuid')
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        errors += 1
+                        yield json.dumps({
+                            "line": lineno,
+                            "reason": "Malformed row or missing "
+                                      "objtype/uuid"}) + '\n'
+                        continue
+                    table_name, table_id = table_names(objtype)
+                    writer = writers.get(objtype)
+                    if writer is None:
+                        writer = await stack.enter_async_context(
+                            driver.writer(table_name, table_id))
+                        writers[objtype] = writer
+                    content[table_id] = objkey
+                    await writer.put_item(Item=content)
+                    invalidate(objtype, objkey)
+                    loaded += 1
+                    if loaded % LOAD_PROGRESS_EVERY == 0:
+                        yield json.dumps({"loaded": loaded,
+                                          "errors": errors}) + '\n'
+        except drivers.DriverError as e:
+            yield json.dumps({"done": False,
+                              "loaded": loaded,
+                              "errors": errors,
+                              "reason": e.code}) + '\n'
+            return
+        yield json.dumps({"done": True,
+                          "loaded": loaded,
+                          "errors": errors}) + '\n'
+
+    return DuplexStreamingResponse(generate(),
+                                   media_type='application/x-ndjson')
+
+
+def batch_response(table_id, keys, outcome, duplicates=()):
+    '''Build the per-item report; see batch_response() in app.py'''
+    results = [{table_id: k,
+                "status": "duplicate" if i in duplicates else outcome[k]}
+               for i, k in enumerate(keys)]
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return json_response({"Count": ok,
+                          "Failed": len(results) - ok,
+                          "Results": results})
+
+
+async def batch_write(request):
+    '''Write many items of one objtype; see batch_write() in app.py'''
+    content = await get_json(request)
+    try:
+        objtype = content['objtype']
+        items = content['items']
+    except (KeyError, TypeError):
+        return json_response({"http_status_code": 400,
+                              "reason": "Missing objtype or items"}, 400)
+    if len(items) > BATCH_REQUEST_LIMIT:
+        return json_response({"http_status_code": 400,
+                              "reason": "Too many items"}, 400)
+    if (any('uuid' in item for item in items)
+            and not load_auth(request.headers)):
+        return json_response({"http_status_code": 401,
+                              "reason": "Invalid authorization for uuid"},
+                             401)
+    table_name, table_id = table_names(objtype)
+    keys = []
+    write_requests = []
+    duplicates = set()
+    seen = set()
+    for i, item in enumerate(items):
+        payload = dict(item)
+        payload[table_id] = payload.pop('uuid', None) or str(uuid.uuid4())
+        keys.append(payload[table_id])
+        if payload[table_id] in seen:
+            duplicates.add(i)
+            continue
+        seen.add(payload[table_id])
+        write_requests.append({'PutRequest': {'Item': payload}})
+    outcome = await driver.batch_write(table_name, table_id, write_requests)
+    for k in seen:
+        invalidate(objtype, k)
+    return batch_response(table_id, keys, outcome, duplicates)
+
+
+async def delete(request):
+    objtype = query_arg(request, 'objtype')
+    objkey = query_arg(request, 'objkey')
+    table_name, table_id = table_names(objtype)
+    await driver.delete(table_name, table_id, objkey)
+    invalidate(objtype, objkey)
+    return json_response({})
+
+
+async def batch_delete(request):
+    '''Delete many items of one objtype; see batch_delete() in app.py'''
+    body = await request.body()
+    if body:
+        content = json.loads(body)
+        objtype = content['objtype']
+        objkeys = content['objkeys']
+    else:
+        objtype = query_arg(request, 'objtype')
+        objkeys = query_list(request, 'objkeys')
+    if len(objkeys) > BATCH_REQUEST_LIMIT:
+        return json_response({"http_status_code": 400,
+                              "reason": "Too many items"}, 400)
+    table_name, table_id = table_names(objtype)
+    write_requests = [{'DeleteRequest': {'Key': {table_id: k}}}
+                      for k in dict.fromkeys(objkeys)]
+    outcome = await driver.batch_write(table_name, table_id, write_requests)
+    for k in objkeys:
+        invalidate(objtype, k)
+    return batch_response(table_id, objkeys, outcome)
+
+
+async def scan(request):
+    '''Enumerate every item of one objtype; see scan() in app.py'''
+    objtype = query_arg(request, 'objtype')
+    table_name, table_id = table_names(objtype)
+    segments = drivers.int_arg(request.query_params.get('segments'), 0, 0,
+                               SCAN_MAX_SEGMENTS)
+    if segments:
+        return StreamingResponse(
+            parallel_scan(table_name, table_id, segments),
+            media_type='application/x-ndjson')
+    limit = min(drivers.int_arg(request.query_params.get('limit'),
+                                SCAN_DEFAULT_LIMIT, 1), SCAN_MAX_LIMIT)
+    cursor = request.query_params.get('cursor')
+    items, last_key = await driver.scan(
+        table_name, table_id, limit=limit,
+        start_key=drivers.decode_cursor(cursor) if cursor else None)
+    result = {"Count": len(items), "Items": items}
+    if last_key:
+        result["Cursor"] = drivers.encode_cursor(last_key)
+    return json_response(result)
+
+
+def index_keys(objtype, index):
+    '''Return the (hash key, range key) attributes of an objtype's index'''
+    try:
+        return INDEXES[objtype][index]
+    except KeyError as e:
+        raise drivers.DriverError(
+            'ValidationException',
+            'No index {} on {}'.format(index, objtype)) from e
+
+
+async def query(request):
+    '''Find items by a global secondary index; see query() in app.py'''
+    if request.method == 'POST':
+        content = await get_json(request)
+    else:
+        content = {k: query_arg(request, k)
+                   for k in ('objtype', 'index', 'key', 'cursor')
+                   if k in request.query_params}
+        content['fields'] = [f for arg in query_list(request, 'fields')
+                             for f in arg.split(',') if f]
+        if 'limit' in request.query_params:
+            content['limit'] = request.query_params['limit']
+    try:
+        objtype = content['objtype']
+        hash_key, range_key = index_keys(objtype, content['index'])
+        key_conditions = [{'attr': hash_key, 'cmp': 'eq',
+                           'value': content['key']}]
+        if 'range' in content:
+            if range_key is None:
+                raise ValueError('Index has no range key')
+            key_conditions.append(dict(content['range'], attr=range_key))
+        limit = max(1, min(int(content.get('limit') or SCAN_DEFAULT_LIMIT),
+                           SCAN_MAX_LIMIT))
+    except (KeyError, TypeError, ValueError) as e:
+        raise drivers.DriverError('ValidationException', str(e)) from e
+    cursor = content.get('cursor')
+    table_name, table_id = table_names(objtype)
+    items, last_key = await driver.query(
+        table_name, table_id, content['index'], key_conditions,
+        filters=content.get('filter', ()), fields=content.get('fields'),
+        limit=limit,
+        start_key=drivers.decode_cursor(cursor) if cursor else None)
+    result = {"Count": len(items), "Items": items}
+    if last_key:
+        result["Cursor"] = drivers.encode_cursor(last_key)
+    return json_response(result)
+
+
+async def parallel_scan(table_name, table_id, segments):
+    '''
+    Generate NDJSON lines for a scan split into `segments` concurrent
+    segments, which feed a bounded queue as in app.py.
+    '''
+    out = asyncio.Queue(maxsize=SCAN_MAX_LIMIT)
+
+    async def run_segment(segment):
+        start_key = None
+        try:
+            while True:
+                items, start_key = await driver.scan(
+                    table_name, table_id, limit=SCAN_MAX_LIMIT,
+                    start_key=start_key, segment=segment,
+                    total_segments=segments)
+                for item in items:
+                    await out.put(('item', item))
+                if not start_key:
+                    break
+            await out.put(('done', None))
+        except drivers.DriverError as e:
+            await out.put(('error', e.code))
+
+    tasks = [asyncio.ensure_future(run_segment(s)) for s in range(segments)]
+    count = 0
+    finished = 0
+    try:
+        while finished < segments:
+            kind, value = await out.get()
+            if kind == 'item':
+                count += 1
+                yield fastjson.dumps({"Item": value}, newline=True)
+            elif kind == 'done':
+                finished += 1
+            else:
+                yield json.dumps({"done": False, "reason": value}) + '\n'
+                return
+        yield json.dumps({"done": True, "Count": count}) + '\n'
+    finally:
+        # Also reached when the client disconnects mid-stream
+        for t in tasks:
+            t.cancel()
+
+
+async def hot_keys(request):
+    '''Report the most accessed keys; see hot_keys() in app.py'''
+    n = drivers.int_arg(request.query_params.get('n'), 20, 0)
+    return json_response(hotkeys.report(n))
+
+
+async def health(request):
+    return Response("", status_code=200, media_type="application/json")
+
+
+async def readiness(request):
+    return Response("", status_code=200, media_type="application/json")
+
+
+async def metrics(request):
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware():
+    '''Record request count and latency, as prometheus_flask_exporter
+    does for app.py'''
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http'
+                or scope['path'].rstrip('/').endswith(UNTRACKED)):
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_duration.labels(
+                scope['method'], scope['path'], status[0]).observe(
+                    time.perf_counter() - start)
+            request_total.labels(scope['method'], status[0]).inc()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await driver.start()
+    yield
+    await driver.close()
+
+
+# All database calls will have this prefix.  Prometheus metric
+# calls will not---they will have route '/metrics'.  This is
+# the conventional organization.
+app = MetricsMiddleware(Starlette(
+    routes=[
+        Route('/metrics', metrics),
+        Mount('/api/v1/datastore', routes=[
+            Route('/update', update, methods=['PUT']),
+            Route('/read', read, methods=['GET']),
+            Route('/batch_read', batch_read, methods=['GET', 'POST']),
+            Route('/write', write, methods=['POST']),
+            Route('/load', load, methods=['POST']),
+            Route('/batch_write', batch_write, methods=['POST']),
+            Route('/delete', delete, methods=['DELETE']),
+            Route('/batch_delete', batch_delete,
+                  methods=['DELETE', 'POST']),
+            Route('/scan', scan, methods=['GET']),
+            Route('/query', query, methods=['GET', 'POST']),
+            Route('/stats/hotkeys', hot_keys, methods=['GET']),
+            Route('/health', health),
+            Route('/readiness', readiness),
+        ]),
+    ],
+    exception_handlers={drivers.DriverError: driver_error},
+    lifespan=lifespan))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        logging.error("missing port arg 1")
+        sys.exit(-1)
+
+    p = int(sys.argv[1])
+    uvicorn.run(app, host='0.0.0.0', port=p,
+                backlog=int(os.getenv('DB_BACKLOG', '4096')),
+                access_log=False)
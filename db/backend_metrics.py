@@ -0,0 +1,139 @@
+"""
+SFU CMPT 756
+Prometheus metrics for the database service's calls to its storage
+backend.
+
+The HTTP metrics only show a route's total time.  These separate the
+backend's share of it, per table and operation, and account for what
+the calls cost in DynamoDB capacity units.
+
+`instrument(events)` hooks a botocore event system, so every DynamoDB
+call made through that client is measured, whether it comes from a
+driver method, a `batch_writer` flush or the aioboto3 client.
+"""
+
+# Standard library modules
+import functools
+import time
+
+# Installed packages
+from prometheus_client import Counter
+from prometheus_client import Histogram
+
+BACKEND_LATENCY = Histogram(
+    'datastore_backend_latency_seconds',
+    'Time for one storage backend call, including SDK retries',
+    ['table', 'operation'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+             10))
+CONSUMED_RCU = Counter('datastore_consumed_read_capacity_units',
+                       'DynamoDB read capacity units consumed',
+                       ['table', 'operation'])
+CONSUMED_WCU = Counter('datastore_consumed_write_capacity_units',
+                       'DynamoDB write capacity units consumed',
+                       ['table', 'operation'])
+THROTTLES = Counter('datastore_backend_throttles',
+                    'Backend call attempts rejected for exceeding '
+                    'provisioned or account throughput',
+                    ['table', 'operation'])
+RETRIES = Counter('datastore_backend_retries',
+                  'Backend call attempts repeated, by the SDK or for '
+                  'unprocessed batch items',
+                  ['table', 'operation'])
+
+THROTTLE_CODES = frozenset((
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+))
+
+# Operations whose `CapacityUnits` are read units
+READ_OPERATIONS = frozenset((
+    'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'))
+
+# Key under which a call's labels and start time ride in the botocore
+# request context
+CONTEXT_KEY = 'datastore_call'
+
+
+def table_label(params):
+    '''Return the table name(s) a DynamoDB request addresses'''
+    if 'TableName' in params:
+        return params['TableName']
+    return ','.join(sorted(params.get('RequestItems', ())))
+
+
+def record_capacity(operation, consumed):
+    '''Add the ConsumedCapacity entries of one response to the counters'''
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    for c in consumed:
+        table = c.get('TableName', '')
+        rcu = c.get('ReadCapacityUnits')
+        wcu = c.get('WriteCapacityUnits')
+        if rcu is None and wcu is None:
+            if operation in READ_OPERATIONS:
+                rcu = c.get('CapacityUnits')
+            else:
+                wcu = c.get('CapacityUnits')
+        if rcu:
+            CONSUMED_RCU.labels(table, operation).inc(rcu)
+        if wcu:
+            CONSUMED_WCU.labels(table, operation).inc(wcu)
+
+
+def _start_call(params, model, context, **kwargs):
+    shape = model.input_shape
+    if shape is not None and 'ReturnConsumedCapacity' in shape.members:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    context[CONTEXT_KEY] = (table_label(params), model.name,
+                            time.perf_counter())
+
+
+def _end_call(context, parsed=None, **kwargs):
+    call = context.pop(CONTEXT_KEY, None)
+    if call is None:
+        return
+    table, operation, start = call
+    BACKEND_LATENCY.labels(table, operation).observe(
+        time.perf_counter() - start)
+    if parsed is None:
+        return
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        RETRIES.labels(table, operation).inc(retries)
+    if parsed.get('ConsumedCapacity'):
+        record_capacity(operation, parsed['ConsumedCapacity'])
+
+
+def _count_throttle(request_dict, operation, response=None, **kwargs):
+    if response is None:
+        return
+    if response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+        call = request_dict.get('context', {}).get(CONTEXT_KEY)
+        THROTTLES.labels(call[0] if call else '', operation.name).inc()
+
+
+def instrument(events):
+    '''Measure every DynamoDB call made through a botocore client, given
+    its `meta.events`'''
+    events.register('before-parameter-build.dynamodb', _start_call)
+    events.register('after-call.dynamodb', _end_call)
+    events.register('after-call-error.dynamodb', _end_call)
+    events.register('needs-retry.dynamodb', _count_throttle)
+
+
+def timed(operation):
+    '''Decorate a driver method taking the table name first so that its
+    calls are observed as `operation` on that table'''
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(self, table, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(self, table, *args, **kwargs)
+            finally:
+                BACKEND_LATENCY.labels(table, operation).observe(
+                    time.perf_counter() - start)
+        return wrapper
+    return decorate
@@ -0,0 +1,179 @@
+"""
+SFU CMPT 756
+Load benchmark for the database service.
+
+Drives `/read` calls the way the Gatling `ReadMusicSim` scenario does:
+each of `--users` virtual users reads a random song from
+`gatling/resources/music.csv`, pauses `--pause` seconds, and repeats.
+Point it at the threaded build (`app.py`) and then at the asyncio build
+(`asgi.py`) with the same arguments to compare them, e.g.
+
+    python benchmark.py --url http://localhost:30002 --users 500
+    python benchmark.py --url http://localhost:30002 --users 1000
+
+Only the standard library is needed, so it runs anywhere Python does.
+Each user holds one keep-alive connection, as a browser-like Gatling
+user does.
+"""
+
+# Standard library modules
+import argparse
+import asyncio
+import csv
+import os
+import random
+import time
+import urllib.parse
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'gatling', 'resources', 'music.csv')
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'benchmark',
+        description='Concurrent /read load against the database service')
+    argp.add_argument('--url', default='http://localhost:30002',
+                      help='Base URL of the database service')
+    argp.add_argument('--users', type=int, default=500,
+                      help='Concurrent virtual users')
+    argp.add_argument('--duration', type=float, default=60,
+                      help='Seconds to run after ramp-up')
+    argp.add_argument('--ramp', type=float, default=10,
+                      help='Seconds over which users start')
+    argp.add_argument('--pause', type=float, default=1,
+                      help='Seconds each user waits between requests')
+    argp.add_argument('--objtype', default='music')
+    argp.add_argument('--csv', default=DEFAULT_CSV,
+                      help='CSV file whose UUID column supplies keys')
+    return argp.parse_args()
+
+
+def read_keys(path):
+    with open(path, newline='') as f:
+        return [row['UUID'] for row in csv.DictReader(f)]
+
+
+class Stats():
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.measuring = False
+
+    def record(self, seconds, ok):
+        if not self.measuring:
+            return
+        if ok:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+    def percentile(self, p):
+        if not self.latencies:
+            return float('nan')
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+async def request(reader, writer, host, path):
+    '''
+    Send one GET on a keep-alive connection.  Return the status and
+    whether the server will keep the connection open.
+    '''
+    writer.write(('GET {} HTTP/1.1\r\nHost: {}\r\n'
+                  'Connection: keep-alive\r\n\r\n').format(
+                      path, host).encode())
+    await writer.drain()
+    version, status = (await reader.readline()).split()[:2]
+    keep_alive = version == b'HTTP/1.1'
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+        elif name == 'connection':
+            keep_alive = value.strip().lower() == 'keep-alive'
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        keep_alive = False
+    return int(status), keep_alive
+
+
+async def user(args, target, keys, stats, stop):
+    reader = writer = None
+    while not stop.is_set():
+        path = '{}/api/v1/datastore/read?{}'.format(
+            target.path.rstrip('/'),
+            urllib.parse.urlencode({'objtype': args.objtype,
+                                    'objkey': random.choice(keys)}))
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    target.hostname, target.port or 80)
+            status, keep_alive = await request(reader, writer,
+                                               target.netloc, path)
+            stats.record(time.perf_counter() - start, status == 200)
+            if not keep_alive:
+                # Flask's development server speaks HTTP/1.0
+                writer.close()
+                reader = writer = None
+        except (OSError, ValueError, IndexError,
+                asyncio.IncompleteReadError):
+            stats.record(time.perf_counter() - start, False)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+        await asyncio.sleep(args.pause)
+    if writer is not None:
+        writer.close()
+
+
+async def run(args):
+    target = urllib.parse.urlsplit(args.url)
+    keys = read_keys(args.csv)
+    stats = Stats()
+    stop = asyncio.Event()
+    tasks = []
+    for i in range(args.users):
+        tasks.append(asyncio.ensure_future(
+            user(args, target, keys, stats, stop)))
+        await asyncio.sleep(args.ramp / args.users)
+    stats.measuring = True
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.measuring = False
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*tasks)
+    return stats, elapsed
+
+
+def main():
+    args = parse_args()
+    stats, elapsed = asyncio.get_event_loop().run_until_complete(run(args))
+    done = len(stats.latencies)
+    print('users={} duration={:.0f}s'.format(args.users, elapsed))
+    print('ok={} errors={} throughput={:.1f} req/s'.format(
+        done, stats.errors, done / elapsed))
+    print('latency p50={:.1f}ms p95={:.1f}ms p99={:.1f}ms'.format(
+        *(1000 * stats.percentile(p) for p in (50, 95, 99))))
+
+
+if __name__ == '__main__':
+    main()
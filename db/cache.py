@@ -0,0 +1,93 @@
+"""
+SFU CMPT 756
+Bounded in-process LRU cache with per-entry time-to-live.
+"""
+
+# Standard library modules
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache():
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Readers that fill the cache from the backend call `token()` before
+    the backend read and pass the result to `put()`.  If the key was
+    invalidated in between, `put()` drops the value, so a slow reader
+    can never reinstate an item that a concurrent write replaced.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of entries. 0 disables the cache.
+    ttl: float
+        Seconds an entry stays valid after it is stored.
+    on_evict: callable
+        Called with no arguments each time an entry is evicted to
+        make room.
+    """
+    def __init__(self, maxsize, ttl, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Sequence number of the most recent invalidation of each key,
+        # bounded like the entries themselves.  `_floor` is the largest
+        # sequence number forgotten from `_invalidated`.
+        self._seq = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def token(self):
+        '''Return a token to pass to a later put()'''
+        with self._lock:
+            return self._seq
+
+    def get(self, key):
+        '''Return (True, value) on a hit and (False, None) on a miss'''
+        if not self.maxsize:
+            return False, None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires <= now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, token):
+        '''Store `value` unless `key` was invalidated after `token`'''
+        if not self.maxsize:
+            return
+        evicted = 0
+        with self._lock:
+            if max(self._floor, self._invalidated.get(key, 0)) > token:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if self._on_evict:
+            for _ in range(evicted):
+                self._on_evict()
+
+    def invalidate(self, key):
+        '''Drop `key` and refuse puts that started before this call'''
+        with self._lock:
+            self._seq += 1
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._seq
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.maxsize, 1):
+                _, seq = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, seq)
@@ -0,0 +1,980 @@
+"""
+SFU CMPT 756
+Storage drivers for the database service.
+
+The route handlers in `app.py` talk only to a `Driver`; each driver
+maps the same small set of operations onto one storage backend.
+`DynamoDBDriver` is the production backend; `SQLiteDriver` keeps every
+table in a single local SQLite file so the whole application can run
+without AWS or a DynamoDB Local JVM.
+
+Items are plain dicts.  Numbers are returned as `Decimal` and DynamoDB
+sets as Python sets, as boto3 does.  Backend failures are raised as
+`DriverError`, carrying a DynamoDB-style error code whichever backend
+produced them.  Every call is measured by `backend_metrics`.
+"""
+
+# Standard library modules
+import base64
+import operator
+import random
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+# Installed packages
+import boto3
+from botocore.exceptions import ClientError
+
+import simplejson as json
+
+# Local modules
+import backend_metrics
+from backend_metrics import RETRIES
+from backend_metrics import timed
+
+# BatchGetItem accepts at most 100 keys per call
+BATCH_READ_MAX_KEYS = 100
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_MAX_ITEMS = 25
+# Retry schedule for items DynamoDB returns as unprocessed
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE = 0.05
+BATCH_BACKOFF_CAP = 2.0
+
+
+class DriverError(Exception):
+    """A storage operation failed.
+
+    Parameters
+    ----------
+    code: string
+        DynamoDB-style error code, such as
+        'ConditionalCheckFailedException' or 'ValidationException'.
+    message: string
+        Human-readable detail.
+    retry_after: float
+        For a refusal because of load, the seconds after which the
+        caller may try again, if known.
+    """
+    def __init__(self, code, message='', retry_after=None):
+        super().__init__(message or code)
+        self.code = code
+        self.retry_after = retry_after
+
+
+def chunks(seq, size):
+    '''Yield successive `size`-element slices of `seq`'''
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def merge_batch_gets(results):
+    '''
+    Combine the (items, unprocessed keys, DriverError or None) of each
+    BatchGetItem chunk into (items, unprocessed keys).  The keys of a
+    chunk that failed count as unprocessed, unless every chunk failed
+    without finding anything, in which case the first error is raised.
+    '''
+    if results and all(error is not None and not found
+                       for found, _, error in results):
+        raise results[0][2]
+    items = []
+    unprocessed = []
+    for found, left, _ in results:
+        items.extend(found)
+        unprocessed.extend(left)
+    return items, unprocessed
+
+
+def backoff_delay(attempt):
+    '''Seconds to wait before retry number `attempt` (full-jitter
+    exponential)'''
+    delay = min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+def backoff(attempt):
+    '''Sleep before retry number `attempt`'''
+    time.sleep(backoff_delay(attempt))
+
+
+def write_request_key(req, key_name):
+    '''Return the primary key value of a BatchWriteItem request'''
+    if 'PutRequest' in req:
+        return req['PutRequest']['Item'][key_name]
+    return req['DeleteRequest']['Key'][key_name]
+
+
+@contextmanager
+def client_errors():
+    '''Re-raise botocore ClientErrors as DriverErrors'''
+    try:
+        yield
+    except ClientError as e:
+        raise DriverError(e.response['Error']['Code'],
+                          e.response['Error'].get('Message', '')) from e
+
+
+# Operators accepted in the `ops` list of Driver.update().  Each op is a
+# dict with an 'op' name, an 'attr' and, for some, an 'index' into a
+# list attribute:
+#   set                {attr, [index], value}  attr = value
+#   set_if_not_exists  {attr, value}           set only if attr absent
+#   append / prepend   {attr, values}          extend list (created empty)
+#   add                {attr, value}           add to a number
+#                      {attr, values}          add members to a set
+#   delete             {attr, values}          remove members from a set
+#   remove             {attr, [index]}         drop attr or list element
+UPDATE_OPS = ('set', 'set_if_not_exists', 'append', 'prepend',
+              'add', 'delete', 'remove')
+
+# Comparisons accepted in the `conditions` list of Driver.update().
+# Each is a dict {attr, [index], cmp, [value]}; all must hold.
+CONDITION_EXPRESSIONS = {
+    'exists': 'attribute_exists({p})',
+    'not_exists': 'attribute_not_exists({p})',
+    'eq': '{p} = {v}',
+    'ne': '{p} <> {v}',
+    'contains': 'contains({p}, {v})',
+    'not_contains': 'NOT contains({p}, {v})',
+    'lt': '{p} < {v}',
+    'le': '{p} <= {v}',
+    'gt': '{p} > {v}',
+    'ge': '{p} >= {v}',
+    'between': '{p} BETWEEN {v}',
+    'begins_with': 'begins_with({p}, {v})',
+}
+
+# Comparisons a Query may apply to an index's range key; its hash key
+# only takes 'eq'
+KEY_CONDITIONS = ('eq', 'lt', 'le', 'gt', 'ge', 'between', 'begins_with')
+
+RETURN_VALUES = ('NONE', 'ALL_OLD', 'ALL_NEW')
+
+
+def check_condition(c, allowed):
+    '''Raise ValueError unless `c` is a well-formed condition using one
+    of the `allowed` comparisons'''
+    if c['cmp'] not in allowed:
+        raise ValueError('Unknown condition ' + str(c['cmp']))
+    str(c['attr'])
+    if c['cmp'] == 'between':
+        low, high = c['value']
+    elif c['cmp'] not in ('exists', 'not_exists'):
+        c['value']
+
+
+def condition_expression(c, path, value):
+    '''Render condition `c`, given functions returning the placeholders
+    for an attribute path and for a value'''
+    if c['cmp'] == 'between':
+        low, high = c['value']
+        v = value(low) + ' AND ' + value(high)
+    else:
+        v = value(c['value']) if 'value' in c else ''
+    return CONDITION_EXPRESSIONS[c['cmp']].format(p=path(c), v=v)
+
+
+def check_update(values, ops, conditions, return_values):
+    '''Raise a ValidationException DriverError for a malformed update'''
+    try:
+        if not values and not ops:
+            raise ValueError('Nothing to update')
+        for op in ops:
+            if op['op'] not in UPDATE_OPS:
+                raise ValueError('Unknown update op ' + str(op['op']))
+            str(op['attr'])
+            if op['op'] in ('append', 'prepend', 'delete'):
+                list(op['values'])
+            elif op['op'] in ('set', 'set_if_not_exists'):
+                op['value']
+            elif op['op'] == 'add' and 'value' not in op:
+                list(op['values'])
+        for c in conditions:
+            check_condition(c, CONDITION_EXPRESSIONS)
+        if return_values not in RETURN_VALUES:
+            raise ValueError('Unsupported return values ' + return_values)
+    except (KeyError, TypeError, ValueError) as e:
+        raise DriverError('ValidationException', str(e)) from e
+
+
+def update_item_kwargs(key_name, key, values, ops, conditions,
+                       return_values):
+    '''Build the DynamoDB UpdateItem arguments for Driver.update()'''
+    check_update(values, ops, conditions, return_values)
+    names = {}
+    attrvals = {}
+
+    def value(v):
+        placeholder = ':val' + str(len(attrvals))
+        attrvals[placeholder] = v
+        return placeholder
+
+    def path(spec):
+        placeholder = '#n' + str(len(names))
+        names[placeholder] = spec['attr']
+        if 'index' in spec:
+            placeholder += '[{}]'.format(int(spec['index']))
+        return placeholder
+
+    clauses = {'SET': [], 'REMOVE': [], 'ADD': [], 'DELETE': []}
+    for k, v in values.items():
+        clauses['SET'].append(path({'attr': k}) + ' = ' + value(v))
+    for op in ops:
+        p = path(op)
+        kind = op['op']
+        if kind == 'set':
+            clauses['SET'].append(p + ' = ' + value(op['value']))
+        elif kind == 'set_if_not_exists':
+            clauses['SET'].append('{0} = if_not_exists({0}, {1})'.format(
+                p, value(op['value'])))
+        elif kind == 'append':
+            clauses['SET'].append(
+                '{0} = list_append(if_not_exists({0}, {1}), {2})'.format(
+                    p, value([]), value(list(op['values']))))
+        elif kind == 'prepend':
+            clauses['SET'].append(
+                '{0} = list_append({2}, if_not_exists({0}, {1}))'.format(
+                    p, value([]), value(list(op['values']))))
+        elif kind == 'add':
+            clauses['ADD'].append(p + ' ' + value(
+                op['value'] if 'value' in op else set(op['values'])))
+        elif kind == 'delete':
+            clauses['DELETE'].append(p + ' ' + value(set(op['values'])))
+        else:
+            clauses['REMOVE'].append(p)
+    kwargs = {
+        'Key': {key_name: key},
+        'UpdateExpression': ' '.join(
+            verb + ' ' + ', '.join(c)
+            for verb, c in clauses.items() if c),
+        'ReturnValues': return_values,
+    }
+    if conditions:
+        kwargs['ConditionExpression'] = ' AND '.join(
+            condition_expression(c, path, value) for c in conditions)
+    kwargs['ExpressionAttributeNames'] = names
+    if attrvals:
+        kwargs['ExpressionAttributeValues'] = attrvals
+    return kwargs
+
+
+def get_item_kwargs(key_name, key, fields, consistent):
+    '''Build the DynamoDB GetItem arguments for Driver.get()'''
+    kwargs = {'Key': {key_name: key}, 'ConsistentRead': consistent}
+    if fields:
+        # Always fetch the key so an existing item is never empty
+        names = {'#p' + str(x): f
+                 for x, f in enumerate([key_name] + list(fields))}
+        kwargs['ProjectionExpression'] = ', '.join(names)
+        kwargs['ExpressionAttributeNames'] = names
+    return kwargs
+
+
+def scan_kwargs(limit, start_key, segment, total_segments):
+    '''Build the DynamoDB Scan arguments for Driver.scan()'''
+    kwargs = {}
+    if limit:
+        kwargs['Limit'] = limit
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    if total_segments:
+        kwargs['Segment'] = segment
+        kwargs['TotalSegments'] = total_segments
+    return kwargs
+
+
+def check_query(key_conditions, filters):
+    '''Raise a ValidationException DriverError for a malformed query'''
+    try:
+        if not 1 <= len(key_conditions) <= 2:
+            raise ValueError('A query needs a hash key condition and at '
+                             'most one range key condition')
+        if key_conditions[0]['cmp'] != 'eq':
+            raise ValueError('The hash key condition must be eq')
+        for c in key_conditions:
+            check_condition(c, KEY_CONDITIONS)
+        for c in filters:
+            check_condition(c, CONDITION_EXPRESSIONS)
+    except (KeyError, TypeError, ValueError) as e:
+        raise DriverError('ValidationException', str(e)) from e
+
+
+def query_kwargs(key_name, index, key_conditions, filters, fields, limit,
+                 start_key):
+    '''Build the DynamoDB Query arguments for Driver.query()'''
+    check_query(key_conditions, filters)
+    names = {}
+    attrvals = {}
+
+    def value(v):
+        placeholder = ':val' + str(len(attrvals))
+        attrvals[placeholder] = v
+        return placeholder
+
+    def path(spec):
+        placeholder = '#n' + str(len(names))
+        names[placeholder] = spec['attr']
+        if 'index' in spec:
+            placeholder += '[{}]'.format(int(spec['index']))
+        return placeholder
+
+    kwargs = {
+        'IndexName': index,
+        'KeyConditionExpression': ' AND '.join(
+            condition_expression(c, path, value) for c in key_conditions),
+    }
+    if filters:
+        kwargs['FilterExpression'] = ' AND '.join(
+            condition_expression(c, path, value) for c in filters)
+    if fields:
+        kwargs['ProjectionExpression'] = ', '.join(
+            path({'attr': f}) for f in [key_name] + list(fields))
+    if limit:
+        kwargs['Limit'] = limit
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    kwargs['ExpressionAttributeNames'] = names
+    kwargs['ExpressionAttributeValues'] = attrvals
+    return kwargs
+
+
+def project(item, key_name, fields):
+    '''Return the key attribute and `fields` of `item`'''
+    return {k: item[k] for k in [key_name] + list(fields) if k in item}
+
+
+def encode_cursor(last_key):
+    '''Turn a scan's last-evaluated key into an opaque cursor'''
+    return base64.urlsafe_b64encode(json.dumps(last_key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    '''Reverse encode_cursor()'''
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()),
+                          use_decimal=True)
+    except ValueError as e:
+        raise DriverError('ValidationException', 'Invalid cursor') from e
+
+
+def int_arg(value, default, low, high=None):
+    '''Return the integer query parameter `value`, or `default` if it
+    is absent (None).  Raise DriverError('ValidationException') unless
+    it is an integer of at least `low` and, if given, at most `high`.'''
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError as e:
+        raise DriverError('ValidationException', 'Invalid integer') from e
+    if number < low or (high is not None and number > high):
+        raise DriverError('ValidationException',
+                          'Integer out of range: {}'.format(number))
+    return number
+
+
+class Driver():
+    """Operations every storage backend provides.
+
+    Every method takes the physical table name and the name of its
+    hash-key attribute.  Batch writes use DynamoDB's request format,
+    a list of `{'PutRequest': {'Item': item}}` and
+    `{'DeleteRequest': {'Key': {key_name: key}}}` dicts.
+    """
+    def get(self, table, key_name, key, fields=None, consistent=False):
+        """Return the item with this key, or None.
+
+        If `fields` is non-empty, return only those attributes plus
+        the key.  `consistent` asks for a strongly consistent read.
+        """
+        raise NotImplementedError
+
+    def query(self, table, key_name, index, key_conditions, filters=(),
+              fields=None, limit=None, start_key=None):
+        """Return one page of a global secondary index as
+        (items, last_key).
+
+        `key_conditions` select the items: an 'eq' condition on the
+        index's hash key, optionally followed by a condition on its
+        range key (see KEY_CONDITIONS).  Each of `filters` (see
+        CONDITION_EXPRESSIONS) must then also hold for an item to be
+        returned.  As in DynamoDB, `limit` bounds the items examined
+        before filtering, so a page may hold fewer items even though
+        more remain.  `fields` and `start_key` are as for get() and
+        scan().
+        """
+        raise NotImplementedError
+
+    def put(self, table, key_name, item):
+        """Create or replace `item`."""
+        raise NotImplementedError
+
+    def update(self, table, key_name, key, values, ops=(), conditions=(),
+               return_values='NONE'):
+        """Update the item atomically, creating it if necessary.
+
+        Each attribute in dict `values` is set; then each op in `ops`
+        (see UPDATE_OPS) is applied.  If any of `conditions` (see
+        CONDITION_EXPRESSIONS) fails, nothing changes and a
+        'ConditionalCheckFailedException' DriverError is raised.
+
+        Returns the whole item before ('ALL_OLD') or after ('ALL_NEW')
+        the update, or {} for 'NONE'.
+        """
+        raise NotImplementedError
+
+    def delete(self, table, key_name, key):
+        """Delete the item if it exists."""
+        raise NotImplementedError
+
+    def batch_get(self, table, key_name, keys):
+        """Fetch the items for a list of distinct keys.
+
+        Returns a pair (items, unprocessed): the items found, in no
+        particular order, and the keys the backend did not serve.
+        """
+        raise NotImplementedError
+
+    def batch_write(self, table, key_name, write_requests):
+        """Apply a list of put/delete requests on distinct keys.
+
+        Returns a dict mapping each key to "ok", "unprocessed" or
+        an error code.
+        """
+        raise NotImplementedError
+
+    def scan(self, table, key_name, limit=None, start_key=None,
+             segment=None, total_segments=None):
+        """Return one page of the table as (items, last_key).
+
+        `last_key` is a dict of key attributes, or None when the table
+        is exhausted; passing it back as `start_key` continues the scan.
+        If `total_segments` is given, only segment number `segment`
+        (0-based) of a parallel scan is read.
+        """
+        raise NotImplementedError
+
+    def writer(self, table, key_name):
+        """Return a context manager with a `put_item(Item=...)` method
+        that buffers puts and writes them in batches."""
+        raise NotImplementedError
+
+
+class DynamoDBDriver(Driver):
+    """Driver for Amazon DynamoDB (or DynamoDB Local).
+
+    Parameters
+    ----------
+    region, access_key, secret_access_key: string
+        AWS connection parameters.
+    endpoint_url: string
+        If non-empty, the URL of a DynamoDB Local instance.
+    workers: int
+        Size of the thread pool that runs batch chunks in parallel.
+    hooks: sequence of callables
+        Each is called with the botocore event system of the client,
+        to register handlers on it.
+    """
+    def __init__(self, region, access_key, secret_access_key,
+                 endpoint_url='', workers=16, hooks=()):
+        kwargs = {}
+        if endpoint_url:
+            # See
+            # https://stackoverflow.com/questions/31948742/localhost-endpoint-to-dynamodb-local-with-boto3
+            kwargs['endpoint_url'] = endpoint_url
+        self._dynamodb = boto3.resource(
+            'dynamodb',
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_access_key,
+            **kwargs)
+        # Hooks first, so the latency metrics exclude time they spend
+        for hook in hooks:
+            hook(self._dynamodb.meta.client.meta.events)
+        backend_metrics.instrument(self._dynamodb.meta.client.meta.events)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def get(self, table, key_name, key, fields=None, consistent=False):
+        kwargs = get_item_kwargs(key_name, key, fields, consistent)
+        with client_errors():
+            response = self._dynamodb.Table(table).get_item(**kwargs)
+        return response.get('Item')
+
+    def query(self, table, key_name, index, key_conditions, filters=(),
+              fields=None, limit=None, start_key=None):
+        kwargs = query_kwargs(key_name, index, key_conditions, filters,
+                              fields, limit, start_key)
+        with client_errors():
+            response = self._dynamodb.Table(table).query(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    def put(self, table, key_name, item):
+        with client_errors():
+            self._dynamodb.Table(table).put_item(Item=item)
+
+    def update(self, table, key_name, key, values, ops=(), conditions=(),
+               return_values='NONE'):
+        kwargs = update_item_kwargs(key_name, key, values, ops, conditions,
+                                    return_values)
+        with client_errors():
+            response = self._dynamodb.Table(table).update_item(**kwargs)
+        return response.get('Attributes', {})
+
+    def delete(self, table, key_name, key):
+        with client_errors():
+            self._dynamodb.Table(table).delete_item(Key={key_name: key})
+
+    def _batch_get_chunk(self, table, key_name, keys):
+        '''
+        Fetch up to BATCH_READ_MAX_KEYS items in a single BatchGetItem,
+        retrying any UnprocessedKeys with backoff.  Return (items,
+        unprocessed keys, the DriverError that stopped it or None).
+        '''
+        request_items = {table: {'Keys': [{key_name: k} for k in keys]}}
+        items = []
+        attempt = 0
+        while True:
+            try:
+                with client_errors():
+                    response = self._dynamodb.batch_get_item(
+                        RequestItems=request_items)
+            except DriverError as e:
+                return items, [k[key_name]
+                               for k in request_items[table]['Keys']], e
+            items.extend(response['Responses'].get(table, []))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                return items, [], None
+            if attempt >= BATCH_MAX_RETRIES:
+                return items, [k[key_name]
+                               for k in request_items[table]['Keys']], None
+            RETRIES.labels(table, 'BatchGetItem').inc()
+            backoff(attempt)
+            attempt += 1
+
+    def batch_get(self, table, key_name, keys):
+        futures = [self._pool.submit(self._batch_get_chunk,
+                                     table, key_name, c)
+                   for c in chunks(keys, BATCH_READ_MAX_KEYS)]
+        return merge_batch_gets([f.result() for f in futures])
+
+    def _batch_write_chunk(self, table, key_name, write_requests):
+        '''
+        Send up to BATCH_WRITE_MAX_ITEMS put/delete requests in a single
+        BatchWriteItem, retrying any UnprocessedItems with backoff.
+        '''
+        outcome = {write_request_key(r, key_name): "ok"
+                   for r in write_requests}
+        request_items = {table: write_requests}
+        attempt = 0
+        while True:
+            try:
+                with client_errors():
+                    response = self._dynamodb.batch_write_item(
+                        RequestItems=request_items)
+            except DriverError as e:
+                # Also a refusal by the rate limiter; the other chunks
+                # may already be written, so report it per item
+                reason = e.code
+                for r in request_items[table]:
+                    outcome[write_request_key(r, key_name)] = reason
+                return outcome
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return outcome
+            if attempt >= BATCH_MAX_RETRIES:
+                for r in request_items[table]:
+                    outcome[write_request_key(r, key_name)] = "unprocessed"
+                return outcome
+            RETRIES.labels(table, 'BatchWriteItem').inc()
+            backoff(attempt)
+            attempt += 1
+
+    def batch_write(self, table, key_name, write_requests):
+        futures = [self._pool.submit(self._batch_write_chunk,
+                                     table, key_name, c)
+                   for c in chunks(write_requests, BATCH_WRITE_MAX_ITEMS)]
+        outcome = {}
+        for f in futures:
+            outcome.update(f.result())
+        return outcome
+
+    def scan(self, table, key_name, limit=None, start_key=None,
+             segment=None, total_segments=None):
+        kwargs = scan_kwargs(limit, start_key, segment, total_segments)
+        with client_errors():
+            response = self._dynamodb.Table(table).scan(**kwargs)
+        return response['Items'], response.get('LastEvaluatedKey')
+
+    @contextmanager
+    def writer(self, table, key_name):
+        with client_errors():
+            with self._dynamodb.Table(table).batch_writer(
+                    overwrite_by_pkeys=[key_name]) as w:
+                yield w
+
+
+# SQLite identifiers are interpolated into SQL, so restrict table
+# names to the characters DynamoDB allows
+TABLE_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{3,255}$')
+# ... and the attribute names that SQLite indexes
+ATTR_NAME_RE = re.compile(r'^[A-Za-z0-9_.-]{1,255}$')
+
+# Ordered comparisons of condition_holds(); a type mismatch is false, as
+# in DynamoDB
+ORDERINGS = {
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+    'between': lambda v, bounds: bounds[0] <= v <= bounds[1],
+    'begins_with': lambda v, prefix: (isinstance(v, str) and
+                                      v.startswith(prefix)),
+}
+
+
+def encode_types(o):
+    '''JSON `default` hook storing a set as {"$set": [...]} and binary
+    data as {"$binary": <base64>}'''
+    if isinstance(o, (set, frozenset)):
+        return {'$set': sorted(o)}
+    if isinstance(o, (bytes, bytearray)):
+        return {'$binary': base64.b64encode(o).decode()}
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
+def decode_types(d):
+    '''JSON `object_hook` reversing encode_types()'''
+    if len(d) == 1 and '$set' in d:
+        return set(d['$set'])
+    return decode_binary(d)
+
+
+def decode_binary(d):
+    '''JSON `object_hook` turning {"$binary": <base64>} into bytes,
+    which DynamoDB stores as a Binary attribute'''
+    if len(d) == 1 and '$binary' in d:
+        return base64.b64decode(d['$binary'])
+    return d
+
+
+def lookup(item, spec):
+    '''Return (True, value) for the attribute or list element named by
+    `spec`, or (False, None) if it does not exist'''
+    if spec['attr'] not in item:
+        return False, None
+    v = item[spec['attr']]
+    if 'index' not in spec:
+        return True, v
+    index = int(spec['index'])
+    if isinstance(v, list) and 0 <= index < len(v):
+        return True, v[index]
+    return False, None
+
+
+def condition_holds(item, c):
+    '''Evaluate one update condition against `item`'''
+    found, v = lookup(item, c)
+    cmp = c['cmp']
+    if cmp == 'exists':
+        return found
+    if cmp == 'not_exists':
+        return not found
+    if cmp == 'eq':
+        return found and v == c['value']
+    if cmp == 'ne':
+        return not found or v != c['value']
+    if cmp in ORDERINGS:
+        try:
+            return found and ORDERINGS[cmp](v, c['value'])
+        except TypeError:
+            return False
+    has = found and isinstance(v, (str, list, set)) and c['value'] in v
+    return has if cmp == 'contains' else not has
+
+
+def apply_op(item, op):
+    '''Apply one update op to `item` in place, as DynamoDB would'''
+    attr = op['attr']
+    kind = op['op']
+    current = item.get(attr)
+    if kind == 'set':
+        if 'index' in op:
+            found, _ = lookup(item, op)
+            if not found:
+                raise DriverError('ValidationException',
+                                  'List index out of range')
+            current[int(op['index'])] = op['value']
+        else:
+            item[attr] = op['value']
+    elif kind == 'set_if_not_exists':
+        item.setdefault(attr, op['value'])
+    elif kind == 'append':
+        item[attr] = (current or []) + list(op['values'])
+    elif kind == 'prepend':
+        item[attr] = list(op['values']) + (current or [])
+    elif kind == 'add' and 'value' in op:
+        item[attr] = (current or 0) + op['value']
+    elif kind == 'add':
+        item[attr] = set(current or ()) | set(op['values'])
+    elif kind == 'delete':
+        remaining = set(current or ()) - set(op['values'])
+        # DynamoDB has no empty sets; the attribute disappears
+        if remaining:
+            item[attr] = remaining
+        else:
+            item.pop(attr, None)
+    elif 'index' in op:
+        if lookup(item, op)[0]:
+            del current[int(op['index'])]
+    else:
+        item.pop(attr, None)
+
+
+class SQLiteWriter():
+    '''Buffer puts and commit them `batch_size` at a time'''
+    def __init__(self, driver, table, key_name, batch_size):
+        self._driver = driver
+        self._table = table
+        self._key_name = key_name
+        self._batch_size = batch_size
+        self._items = []
+
+    def put_item(self, Item):
+        self._items.append(Item)
+        if len(self._items) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._items:
+            self._driver.put_many(self._table, self._key_name, self._items)
+            self._items = []
+
+
+class SQLiteDriver(Driver):
+    """Driver that stores every table in one local SQLite file.
+
+    Each table is an SQLite table of (pk, doc) rows, where `doc` is
+    the item encoded as JSON.  Tables are created on first use.  The
+    database runs in WAL mode so readers never block the writer, and
+    each thread keeps its own connection.
+
+    Parameters
+    ----------
+    path: string
+        Path of the database file.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._tables = set()
+        self._indexes = set()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=30,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _table(self, conn, table):
+        '''Return the quoted table name, creating the table if needed'''
+        if not TABLE_NAME_RE.match(table):
+            raise DriverError('ValidationException',
+                              'Invalid table name ' + table)
+        quoted = '"' + table + '"'
+        if table not in self._tables:
+            conn.execute('CREATE TABLE IF NOT EXISTS ' + quoted +
+                         ' (pk TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            self._tables.add(table)
+        return quoted
+
+    def _attr_index(self, conn, table, attr):
+        '''Return the SQL expression for top-level attribute `attr` of a
+        doc, creating an index on it if needed'''
+        if not ATTR_NAME_RE.match(attr):
+            raise DriverError('ValidationException',
+                              'Invalid attribute name ' + attr)
+        expr = "json_extract(doc, '$.\"" + attr + "\"')"
+        if (table, attr) not in self._indexes:
+            conn.execute('CREATE INDEX IF NOT EXISTS "' + table + '.' +
+                         attr + '" ON "' + table + '" (' + expr + ')')
+            self._indexes.add((table, attr))
+        return expr
+
+    @staticmethod
+    def _dumps(item):
+        # encoding=None hands bytes to encode_types() rather than
+        # decoding them as UTF-8 text
+        return json.dumps(item, default=encode_types, encoding=None)
+
+    @staticmethod
+    def _loads(doc):
+        return json.loads(doc, use_decimal=True, object_hook=decode_types)
+
+    @timed('GetItem')
+    def get(self, table, key_name, key, fields=None, consistent=False):
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT doc FROM ' + self._table(conn, table) + ' WHERE pk = ?',
+            (key,)).fetchone()
+        if not row:
+            return None
+        item = self._loads(row[0])
+        return project(item, key_name, fields) if fields else item
+
+    @timed('Query')
+    def query(self, table, key_name, index, key_conditions, filters=(),
+              fields=None, limit=None, start_key=None):
+        # Every index is emulated by an SQLite index on its hash key;
+        # matches come back in primary key order
+        check_query(key_conditions, filters)
+        conn = self._conn()
+        name = self._table(conn, table)
+        hash_key = key_conditions[0]
+        value = hash_key['value']
+        sql = ('SELECT pk, doc FROM ' + name + ' WHERE ' +
+               self._attr_index(conn, table, hash_key['attr']) + ' = ?')
+        params = [float(value) if isinstance(value, Decimal) else value]
+        if start_key:
+            sql += ' AND pk > ?'
+            params.append(start_key[key_name])
+        sql += ' ORDER BY pk'
+        items = []
+        examined = []
+        last = None
+        for pk, doc in conn.execute(sql, params):
+            item = self._loads(doc)
+            if not all(condition_holds(item, c) for c in key_conditions[1:]):
+                continue
+            if limit and len(examined) == limit:
+                last = {key_name: examined[-1]}
+                break
+            examined.append(pk)
+            if all(condition_holds(item, c) for c in filters):
+                items.append(project(item, key_name, fields) if fields
+                             else item)
+        return items, last
+
+    @timed('PutItem')
+    def put(self, table, key_name, item):
+        self._put_many(table, key_name, [item])
+
+    @timed('BatchWriteItem')
+    def put_many(self, table, key_name, items):
+        '''Insert or replace `items` in a single transaction'''
+        self._put_many(table, key_name, items)
+
+    def _put_many(self, table, key_name, items):
+        conn = self._conn()
+        name = self._table(conn, table)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR REPLACE INTO ' + name + ' (pk, doc) VALUES (?, ?)',
+                [(item[key_name], self._dumps(item)) for item in items])
+
+    @timed('UpdateItem')
+    def update(self, table, key_name, key, values, ops=(), conditions=(),
+               return_values='NONE'):
+        check_update(values, ops, conditions, return_values)
+        conn = self._conn()
+        name = self._table(conn, table)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT doc FROM ' + name + ' WHERE pk = ?',
+                               (key,)).fetchone()
+            old = self._loads(row[0]) if row else {}
+            if not all(condition_holds(old, c) for c in conditions):
+                raise DriverError('ConditionalCheckFailedException')
+            item = self._loads(row[0]) if row else {key_name: key}
+            item.update(values)
+            for op in ops:
+                apply_op(item, op)
+            conn.execute(
+                'INSERT OR REPLACE INTO ' + name + ' (pk, doc) VALUES (?, ?)',
+                (key, self._dumps(item)))
+        if return_values == 'ALL_NEW':
+            return item
+        if return_values == 'ALL_OLD':
+            return old
+        return {}
+
+    @timed('DeleteItem')
+    def delete(self, table, key_name, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM ' + self._table(conn, table) +
+                         ' WHERE pk = ?', (key,))
+
+    @timed('BatchGetItem')
+    def batch_get(self, table, key_name, keys):
+        conn = self._conn()
+        name = self._table(conn, table)
+        items = []
+        # Stay well under SQLite's limit on bound parameters
+        for chunk in chunks(keys, 500):
+            rows = conn.execute(
+                'SELECT doc FROM ' + name + ' WHERE pk IN (' +
+                ','.join('?' * len(chunk)) + ')', chunk).fetchall()
+            items.extend(self._loads(r[0]) for r in rows)
+        return items, []
+
+    @timed('BatchWriteItem')
+    def batch_write(self, table, key_name, write_requests):
+        conn = self._conn()
+        name = self._table(conn, table)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for r in write_requests:
+                if 'PutRequest' in r:
+                    item = r['PutRequest']['Item']
+                    conn.execute('INSERT OR REPLACE INTO ' + name +
+                                 ' (pk, doc) VALUES (?, ?)',
+                                 (item[key_name], self._dumps(item)))
+                else:
+                    conn.execute('DELETE FROM ' + name + ' WHERE pk = ?',
+                                 (r['DeleteRequest']['Key'][key_name],))
+        return {write_request_key(r, key_name): "ok" for r in write_requests}
+
+    @timed('Scan')
+    def scan(self, table, key_name, limit=None, start_key=None,
+             segment=None, total_segments=None):
+        conn = self._conn()
+        sql = 'SELECT pk, doc FROM ' + self._table(conn, table)
+        where = []
+        params = []
+        if start_key:
+            where.append('pk > ?')
+            params.append(start_key[key_name])
+        if total_segments:
+            where.append('rowid % ? = ?')
+            params.extend([total_segments, segment])
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY pk'
+        if limit:
+            # Fetch one extra row to learn whether the scan is complete
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        rows = conn.execute(sql, params).fetchall()
+        last = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = {key_name: rows[-1][0]}
+        return [self._loads(r[1]) for r in rows], last
+
+    @contextmanager
+    def writer(self, table, key_name):
+        w = SQLiteWriter(self, table, key_name, BATCH_WRITE_MAX_ITEMS * 40)
+        yield w
+        w.flush()
@@ -0,0 +1,223 @@
+"""
+SFU CMPT 756
+Streaming detection of the most frequently accessed keys.
+
+`SpaceSaving` is the Space-Saving heavy-hitters algorithm over the
+Stream-Summary structure of Metwally et al.: with `capacity` counters,
+every key accessed more than 1/capacity of the time is kept, and each
+access costs O(1).  `HotKeys` keeps one per kind of access over
+rotating time windows and exports the top keys to Prometheus.
+"""
+
+# Standard library modules
+import threading
+import time
+
+# Installed packages
+from prometheus_client.core import GaugeMetricFamily
+
+
+class _Bucket():
+    '''The keys whose count is `count`, in a list ordered by count'''
+    __slots__ = ('count', 'keys', 'prev', 'next')
+
+    def __init__(self, count):
+        self.count = count
+        # Insertion-ordered set of keys
+        self.keys = {}
+        self.prev = None
+        self.next = None
+
+
+class SpaceSaving():
+    """Approximate counts of the most frequent keys in a stream.
+
+    A key's estimated count exceeds its true count by at most its
+    `error`, and every key with a true count above `total / capacity`
+    is present.  Not thread-safe; `HotKeys` holds the lock.
+
+    Parameters
+    ----------
+    capacity: int
+        Number of keys tracked.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        # key -> [bucket, error]
+        self._counters = {}
+        # Lowest-count bucket; buckets link upwards through `next`
+        self._min = None
+        self._max = None
+
+    def __len__(self):
+        return len(self._counters)
+
+    def _link_after(self, bucket, prev):
+        '''Insert `bucket` after `prev` (at the bottom if None)'''
+        bucket.prev = prev
+        bucket.next = prev.next if prev else self._min
+        if bucket.next:
+            bucket.next.prev = bucket
+        else:
+            self._max = bucket
+        if prev:
+            prev.next = bucket
+        else:
+            self._min = bucket
+
+    def _unlink(self, bucket):
+        if bucket.prev:
+            bucket.prev.next = bucket.next
+        else:
+            self._min = bucket.next
+        if bucket.next:
+            bucket.next.prev = bucket.prev
+        else:
+            self._max = bucket.prev
+
+    def _move_up(self, key, bucket):
+        '''Move `key` from `bucket` to the bucket one count higher'''
+        target = bucket.next
+        if target is None or target.count != bucket.count + 1:
+            target = _Bucket(bucket.count + 1)
+            self._link_after(target, bucket)
+        del bucket.keys[key]
+        target.keys[key] = None
+        if not bucket.keys:
+            self._unlink(bucket)
+        return target
+
+    def add(self, key):
+        '''Count one occurrence of `key`'''
+        self.total += 1
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter[0] = self._move_up(key, counter[0])
+            return
+        if len(self._counters) < self.capacity:
+            if self._min is None or self._min.count != 1:
+                bucket = _Bucket(1)
+                self._link_after(bucket, None)
+            bucket = self._min
+            bucket.keys[key] = None
+            self._counters[key] = [bucket, 0]
+            return
+        # Replace the oldest key with the lowest count; the newcomer
+        # inherits that count as its error
+        bucket = self._min
+        evicted = next(iter(bucket.keys))
+        del self._counters[evicted]
+        bucket.keys[key] = None
+        error = bucket.count
+        del bucket.keys[evicted]
+        self._counters[key] = [self._move_up(key, bucket), error]
+
+    def top(self, n):
+        '''Return up to `n` (key, count, error), most frequent first'''
+        result = []
+        bucket = self._max
+        while bucket is not None and len(result) < n:
+            for key in bucket.keys:
+                result.append((key, bucket.count, self._counters[key][1]))
+                if len(result) == n:
+                    break
+            bucket = bucket.prev
+        return result
+
+
+class HotKeys():
+    """Top keys per kind of access, over rotating windows.
+
+    Counts restart every `window` seconds so that the report follows
+    the current workload.  The last complete window is kept for
+    reporting alongside the one in progress.
+
+    Parameters
+    ----------
+    kinds: sequence of string
+        Kinds of access tracked separately, such as 'read' and 'write'.
+    key_names: sequence of string
+        Names of the parts of each key tuple, used in reports and as
+        Prometheus labels.
+    capacity: int
+        Keys tracked per kind.  0 disables tracking.
+    window: float
+        Seconds per window.
+    """
+    def __init__(self, kinds, key_names, capacity, window):
+        self.kinds = tuple(kinds)
+        self.key_names = tuple(key_names)
+        self.capacity = capacity
+        self.window = window
+        self._lock = threading.Lock()
+        self._current = self._sketches()
+        self._previous = None
+        self._window_end = time.monotonic() + window
+
+    def _sketches(self):
+        return {k: SpaceSaving(self.capacity) for k in self.kinds}
+
+    def _advance(self, now):
+        '''Start a new window if the current one has ended'''
+        if now < self._window_end:
+            return
+        if now < self._window_end + self.window:
+            self._previous = self._current
+        else:
+            # A whole window passed with no accesses
+            self._previous = self._sketches()
+        self._current = self._sketches()
+        self._window_end = now + self.window
+
+    def add(self, kind, key):
+        '''Count one access of `kind` to `key`'''
+        if not self.capacity:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            self._current[kind].add(key)
+
+    def report(self, n):
+        '''Return the top `n` keys of each kind for the current and
+        previous windows'''
+        def summary(sketches):
+            if sketches is None:
+                return None
+            return {kind: {"Total": s.total,
+                           "Keys": [dict(zip(self.key_names, key),
+                                         count=count, error=error)
+                                    for key, count, error in s.top(n)]}
+                    for kind, s in sketches.items()}
+        with self._lock:
+            self._advance(time.monotonic())
+            return {"window_seconds": self.window,
+                    "current": summary(self._current),
+                    "previous": summary(self._previous)}
+
+
+class HotKeysCollector():
+    """Prometheus collector exposing the top keys of a `HotKeys`.
+
+    Series are generated at scrape time from the last complete window,
+    so keys that cool off disappear instead of leaving stale series.
+    """
+    def __init__(self, hotkeys, n):
+        self._hotkeys = hotkeys
+        self._n = n
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            'datastore_hotkey_requests',
+            'Estimated requests for the most accessed keys in the last '
+            'complete window',
+            labels=('kind',) + self._hotkeys.key_names)
+        report = self._hotkeys.report(self._n)
+        windows = report["previous"] or report["current"]
+        for kind, summary in windows.items():
+            for entry in summary["Keys"]:
+                gauge.add_metric(
+                    [kind] + [entry[k] for k in self._hotkeys.key_names],
+                    entry["count"])
+        yield gauge
@@ -0,0 +1,107 @@
+"""
+SFU CMPT 756
+Micro-benchmark of the database service's JSON encoding.
+
+Times the encoding of realistic responses two ways:
+
+- `simplejson`: the previous path, `simplejson.dumps` with a `default`
+  hook for sets, as the Flask encoder and `json_response` used it,
+  then encoded to bytes for the response body.
+- `fastjson`: `fastjson.dumps`, which returns the bytes directly.
+
+The payloads are built from `gatling/resources/music.csv`: a `/read`
+of one song, a `/scan` page of music items with a Decimal play count, a
+playlist item with a long `music_id_list`, and a page of playlists.
+Run it from this directory:
+
+    python json_benchmark.py --number 2000
+"""
+
+# Standard library modules
+import argparse
+import csv
+import os
+import timeit
+import uuid
+from decimal import Decimal
+
+# Installed packages
+import simplejson
+
+# Local modules
+import fastjson
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'gatling', 'resources', 'music.csv')
+
+
+def parse_args():
+    argp = argparse.ArgumentParser(
+        'json_benchmark',
+        description='Compare JSON encoders on datastore responses')
+    argp.add_argument('--number', type=int, default=2000,
+                      help='Encodings timed per payload and encoder')
+    argp.add_argument('--repeat', type=int, default=5,
+                      help='Timing runs; the fastest is reported')
+    argp.add_argument('--csv', default=DEFAULT_CSV,
+                      help='Music CSV with Artist, SongTitle and UUID')
+    return argp.parse_args()
+
+
+def json_default(o):
+    '''The set hook of the previous path'''
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    raise TypeError(repr(o) + ' is not JSON serializable')
+
+
+def simplejson_dumps(obj):
+    return simplejson.dumps(obj, default=json_default,
+                            separators=(',', ':')).encode()
+
+
+def payloads(path):
+    with open(path, newline='') as f:
+        songs = [{'music_id': row['UUID'], 'Artist': row['Artist'],
+                  'SongTitle': row['SongTitle']}
+                 for row in csv.DictReader(f)]
+    music = [dict(songs[i % len(songs)],
+                  music_id=str(uuid.UUID(int=i)),
+                  plays=Decimal(i * 37),
+                  rating=Decimal('4.5'))
+             for i in range(100)]
+    playlist = {'playlist_id': str(uuid.uuid4()),
+                'playlist_name': 'Road trip',
+                'music_id_list': [str(uuid.uuid4()) for _ in range(200)],
+                'tags': {'driving', 'summer', 'rock'}}
+    playlists = [dict(playlist, playlist_id=str(uuid.uuid4()))
+                 for _ in range(20)]
+    return [
+        ('read music', {'Count': 1, 'Items': [songs[0]]}),
+        ('scan music x100', {'Count': len(music), 'Items': music}),
+        ('read playlist', {'Count': 1, 'Items': [playlist]}),
+        ('scan playlist x20', {'Count': len(playlists),
+                               'Items': playlists}),
+    ]
+
+
+def main():
+    args = parse_args()
+    encoders = [('simplejson', simplejson_dumps),
+                ('fastjson', fastjson.dumps)]
+    print('{:<20} {:>8} {:>14} {:>14} {:>8}'.format(
+        'payload', 'bytes', 'simplejson us', 'fastjson us', 'speedup'))
+    for name, obj in payloads(args.csv):
+        assert (simplejson.loads(fastjson.dumps(obj), use_decimal=True) ==
+                simplejson.loads(simplejson_dumps(obj), use_decimal=True))
+        times = [1e6 * min(timeit.repeat(lambda: fn(obj),
+                                         number=args.number,
+                                         repeat=args.repeat)) / args.number
+                 for _, fn in encoders]
+        print('{:<20} {:>8} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+            name, len(fastjson.dumps(obj)), times[0], times[1],
+            times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+SFU CMPT 756
+Single-flight coalescing of identical concurrent calls.
+
+When several requests want the same thing at the same time, the first
+makes the backend call and the others wait for its result instead of
+making their own.  `SingleFlight` is for threads (`app.py`) and
+`AsyncSingleFlight` for coroutines (`asgi.py`).
+"""
+
+# Standard library modules
+import asyncio
+import threading
+
+
+class _Call():
+    '''One in-flight call and, once it completes, its outcome'''
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """Coalesce concurrent calls that share a key.
+
+    A call is identified by a `key` plus a `variant`, such as an item
+    key plus the projection asked for.  `forget(key)` detaches every
+    in-flight call for the key: callers that are already waiting still
+    get its result, but later callers start a fresh call.  Writers call
+    it once their write has completed, so no caller that arrives after
+    a write can be handed a value read before it.
+
+    Parameters
+    ----------
+    on_shared: callable
+        Called with no arguments each time a caller joins a call that
+        is already in flight.
+    """
+    def __init__(self, on_shared=None):
+        self._on_shared = on_shared
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, variant, fn):
+        '''Return fn(), or the result of an identical call in flight'''
+        with self._lock:
+            variants = self._calls.setdefault(key, {})
+            call = variants.get(variant)
+            leader = call is None
+            if leader:
+                call = variants[variant] = _Call()
+        if not leader:
+            if self._on_shared:
+                self._on_shared()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                variants = self._calls.get(key)
+                if variants is not None and variants.get(variant) is call:
+                    del variants[variant]
+                    if not variants:
+                        del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self, key):
+        '''Start a fresh call for the next caller of any variant of `key`'''
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+class AsyncSingleFlight():
+    """`SingleFlight` for coroutines on one event loop.
+
+    The shared call runs as its own task, so a caller that is cancelled
+    (for example, because its client disconnected) does not cancel the
+    call for the others.
+    """
+    def __init__(self, on_shared=None):
+        self._on_shared = on_shared
+        self._calls = {}
+
+    async def do(self, key, variant, fn):
+        '''Return await fn(), or the result of an identical call in flight'''
+        variants = self._calls.setdefault(key, {})
+        task = variants.get(variant)
+        if task is not None:
+            if self._on_shared:
+                self._on_shared()
+        else:
+            task = variants[variant] = asyncio.ensure_future(fn())
+            task.add_done_callback(
+                lambda t: self._finished(key, variant, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key, variant, task):
+        variants = self._calls.get(key)
+        if variants is not None and variants.get(variant) is task:
+            del variants[variant]
+            if not variants:
+                del self._calls[key]
+
+    def forget(self, key):
+        '''Start a fresh call for the next caller of any variant of `key`'''
+        self._calls.pop(key, None)
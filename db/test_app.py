@@ -0,0 +1,188 @@
+"""
+Test the database service's routes end to end.
+
+The app is loaded from app-tpl.py, with its table names left as
+'<Objtype>-ZZ-REG-ID', and runs on the SQLite driver in a temporary
+directory, so these tests need neither AWS nor a build of the
+templates.  Run them with `pytest` in this directory.
+"""
+
+# Standard libraries
+import base64
+import importlib.util
+import os
+import tempfile
+
+# Installed packages
+import pytest
+import simplejson as json
+
+LOADER_TOKEN = 'test-token'
+os.environ['DB_DRIVER'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(),
+                                            'datastore.sqlite3')
+os.environ['SVC_LOADER_TOKEN'] = LOADER_TOKEN
+os.environ.pop('WEB_CONCURRENCY', None)
+
+spec = importlib.util.spec_from_file_location(
+    'app', os.path.join(os.path.dirname(__file__), 'app-tpl.py'))
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+PREFIX = '/api/v1/datastore/'
+LOADER_AUTH = {'Authorization': 'Basic ' + base64.b64encode(
+    ('svc-loader:' + LOADER_TOKEN).encode()).decode()}
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def batch_write(client, objtype, items):
+    response = client.post(PREFIX + 'batch_write', headers=LOADER_AUTH,
+                           json={'objtype': objtype, 'items': items})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_batch_read_in_request_order(client):
+    batch_write(client, 'music', [{'uuid': k, 'Artist': k}
+                                  for k in ('b1', 'b2', 'b3')])
+    response = client.post(PREFIX + 'batch_read', json={
+        'objtype': 'music', 'objkeys': ['b3', 'nope', 'b1', 'b3', 'b2']})
+    body = response.get_json()
+    assert [item['music_id'] for item in body['Items']] == [
+        'b3', 'b1', 'b3', 'b2']
+    assert body['Count'] == 4 and body['Missing'] == ['nope']
+    response = client.get(PREFIX + 'batch_read?objtype=music'
+                          '&objkeys=b2&objkeys=b1')
+    assert [item['music_id'] for item in response.get_json()['Items']] == [
+        'b2', 'b1']
+
+
+def test_batch_write_reports_each_item(client):
+    body = batch_write(client, 'music', [
+        {'uuid': 'w1', 'Artist': 'A', 'Plays': 1.5},
+        {'uuid': 'w2', 'Artist': 'B'},
+        {'uuid': 'w1', 'Artist': 'C'}])
+    assert body == {'Count': 2, 'Failed': 1, 'Results': [
+        {'music_id': 'w1', 'status': 'ok'},
+        {'music_id': 'w2', 'status': 'ok'},
+        {'music_id': 'w1', 'status': 'duplicate'}]}
+    response = client.get(PREFIX + 'read?objtype=music&objkey=w1')
+    assert response.get_json()['Items'] == [
+        {'music_id': 'w1', 'Artist': 'A', 'Plays': 1.5}]
+    # Without a uuid each item gets a fresh one, and needs no auth
+    response = client.post(PREFIX + 'batch_write', json={
+        'objtype': 'music', 'items': [{'Artist': 'D'}] * 2})
+    assert [r['status'] for r in response.get_json()['Results']] == [
+        'ok', 'ok']
+    response = client.post(PREFIX + 'batch_write', json={
+        'objtype': 'music', 'items': [{'uuid': 'w3'}]})
+    assert response.status_code == 401
+
+
+def test_batch_delete(client):
+    batch_write(client, 'music', [{'uuid': 'd1'}, {'uuid': 'd2'}])
+    response = client.post(PREFIX + 'batch_delete', json={
+        'objtype': 'music', 'objkeys': ['d1', 'd2', 'd1', 'nope']})
+    assert response.get_json()['Count'] == 4
+    response = client.post(PREFIX + 'batch_read', json={
+        'objtype': 'music', 'objkeys': ['d1', 'd2']})
+    assert response.get_json()['Missing'] == ['d1', 'd2']
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data().splitlines()]
+
+
+def test_load_stream(client, monkeypatch):
+    monkeypatch.setattr(app, 'LOAD_PROGRESS_EVERY', 2)
+    rows = [json.dumps({'objtype': 'music', 'uuid': 'l' + str(i),
+                        'Artist': 'A', 'Length': 200.5})
+            for i in range(3)]
+    rows[1:1] = ['not json', '', json.dumps({'objtype': 'music'})]
+    body = '\n'.join(rows) + '\n'
+    response = client.post(PREFIX + 'load', data=body,
+                           content_type='application/x-ndjson')
+    assert response.status_code == 401
+    response = client.post(PREFIX + 'load', data=body, headers=LOADER_AUTH,
+                           content_type='application/x-ndjson')
+    assert ndjson(response) == [
+        {'line': 2, 'reason': 'Malformed row or missing objtype/uuid'},
+        {'line': 4, 'reason': 'Malformed row or missing objtype/uuid'},
+        {'loaded': 2, 'errors': 2},
+        {'done': True, 'loaded': 3, 'errors': 2}]
+    response = client.get(PREFIX + 'read?objtype=music&objkey=l2')
+    assert response.get_json()['Items'] == [
+        {'music_id': 'l2', 'Artist': 'A', 'Length': 200.5}]
+
+
+def test_read_fields(client):
+    batch_write(client, 'music', [{'uuid': 'r1', 'Artist': 'A',
+                                   'SongTitle': 'S', 'OrigArtist': 'O'}])
+    for query in ('', '&consistent=true'):
+        response = client.get(PREFIX + 'read?objtype=music&objkey=r1'
+                              '&fields=OrigArtist,SongTitle' + query)
+        assert response.get_json() == {'Count': 1, 'Items': [
+            {'music_id': 'r1', 'SongTitle': 'S', 'OrigArtist': 'O'}]}
+    # A projection of a cached item is cut from it
+    response = client.get(PREFIX + 'read?objtype=music&objkey=r1')
+    assert response.get_json()['Items'][0]['Artist'] == 'A'
+    response = client.get(PREFIX + 'read?objtype=music&objkey=r1'
+                          '&fields=Artist')
+    assert response.get_json()['Items'] == [{'music_id': 'r1',
+                                             'Artist': 'A'}]
+    response = client.get(PREFIX + 'read?objtype=music&objkey=nope')
+    assert response.get_json() == {'Count': 0, 'Items': []}
+
+
+def test_scan(client):
+    keys = sorted('s' + str(i) for i in range(7))
+    batch_write(client, 'album', [{'uuid': k} for k in keys])
+    seen = []
+    url = PREFIX + 'scan?objtype=album&limit=3'
+    while url:
+        body = client.get(url).get_json()
+        seen.extend(item['album_id'] for item in body['Items'])
+        url = (PREFIX + 'scan?objtype=album&limit=3&cursor=' +
+               body['Cursor'] if 'Cursor' in body else None)
+    assert seen == keys
+    lines = ndjson(client.get(PREFIX + 'scan?objtype=album&segments=4'))
+    assert lines[-1] == {'done': True, 'Count': 7}
+    assert sorted(line['Item']['album_id'] for line in lines[:-1]) == keys
+    for query in ('segments=17', 'segments=x', 'limit=0', 'cursor=x'):
+        response = client.get(PREFIX + 'scan?objtype=album&' + query)
+        assert response.status_code == 400
+
+
+def test_stats_hotkeys(client, monkeypatch):
+    # Not counting the accesses of the other tests
+    monkeypatch.setattr(app, 'hotkeys', app.HotKeys(
+        ('read', 'write'), ('objtype', 'objkey'), 10, 60))
+    for _ in range(3):
+        client.get(PREFIX + 'read?objtype=genre&objkey=hot')
+    client.put(PREFIX + 'update?objtype=genre&objkey=hot', json={'n': 1})
+    report = client.get(PREFIX + 'stats/hotkeys?n=1').get_json()
+    assert report['current']['read']['Keys'] == [
+        {'objtype': 'genre', 'objkey': 'hot', 'count': 3, 'error': 0}]
+    assert report['current']['write']['Keys'][0]['objkey'] == 'hot'
+    assert client.get(PREFIX + 'stats/hotkeys?n=x').status_code == 400
+
+
+def test_query(client):
+    batch_write(client, 'user', [
+        {'uuid': 'q1', 'email': 'a@example.com', 'fname': 'A'},
+        {'uuid': 'q2', 'email': 'b@example.com', 'fname': 'B'}])
+    response = client.get(PREFIX + 'query?objtype=user&index=email-index'
+                          '&key=b%40example.com&fields=fname')
+    assert response.get_json() == {'Count': 1, 'Items': [
+        {'user_id': 'q2', 'fname': 'B'}]}
+    response = client.post(PREFIX + 'query', json={
+        'objtype': 'user', 'index': 'email-index', 'key': 'a@example.com',
+        'range': {'cmp': 'eq', 'value': 'x'}})
+    assert response.status_code == 400
+    response = client.get(PREFIX + 'query?objtype=user&index=nope&key=x')
+    assert response.get_json() == {'http_status_code': 400,
+                                   'reason': 'ValidationException'}
@@ -0,0 +1,89 @@
+"""
+Test the metrics of calls to the storage backend.
+
+DynamoDB is stubbed out with botocore's Stubber; run these tests with
+`pytest` in this directory.
+"""
+
+# Standard libraries
+from types import SimpleNamespace
+
+# Installed packages
+from prometheus_client import REGISTRY
+
+# Local modules
+import backend_metrics
+import drivers
+from test_drivers import refuse_calls
+from test_drivers import stubbed_driver
+
+
+def sample(name, table, operation):
+    return REGISTRY.get_sample_value(
+        name, {'table': table, 'operation': operation}) or 0
+
+
+def test_capacity_requested_and_counted():
+    driver, stubber = stubbed_driver(refuse_calls('GetItem', ()))
+    sent = []
+    # After instrument(), so the params include what it adds
+    driver._dynamodb.meta.client.meta.events.register(
+        'before-parameter-build.dynamodb',
+        lambda params, **kwargs: sent.append(dict(params)))
+    rcu = sample('datastore_consumed_read_capacity_units_total',
+                 'Metrics', 'GetItem')
+    wcu = sample('datastore_consumed_write_capacity_units_total',
+                 'Metrics', 'BatchWriteItem')
+    calls = sample('datastore_backend_latency_seconds_count',
+                   'Metrics', 'GetItem')
+    stubber.add_response('get_item', {
+        'Item': {'music_id': {'S': 'a'}},
+        'ConsumedCapacity': {'TableName': 'Metrics', 'CapacityUnits': 0.5}})
+    stubber.add_response('batch_write_item', {
+        'ConsumedCapacity': [{'TableName': 'Metrics',
+                              'CapacityUnits': 2.0}]})
+    driver.get('Metrics', 'music_id', 'a')
+    driver.batch_write('Metrics', 'music_id', [
+        {'PutRequest': {'Item': {'music_id': 'a'}}}])
+    assert [p['ReturnConsumedCapacity'] for p in sent] == ['TOTAL'] * 2
+    assert sample('datastore_consumed_read_capacity_units_total',
+                  'Metrics', 'GetItem') == rcu + 0.5
+    assert sample('datastore_consumed_write_capacity_units_total',
+                  'Metrics', 'BatchWriteItem') == wcu + 2.0
+    assert sample('datastore_backend_latency_seconds_count',
+                  'Metrics', 'GetItem') == calls + 1
+
+
+def test_record_capacity():
+    before = sample('datastore_consumed_read_capacity_units_total',
+                    'Capacity', 'TransactWriteItems')
+    backend_metrics.record_capacity('TransactWriteItems', [
+        {'TableName': 'Capacity', 'CapacityUnits': 3.0,
+         'ReadCapacityUnits': 1.0, 'WriteCapacityUnits': 2.0}])
+    assert sample('datastore_consumed_read_capacity_units_total',
+                  'Capacity', 'TransactWriteItems') == before + 1.0
+
+
+def test_throttles_counted():
+    before = sample('datastore_backend_throttles_total', 'Throttled',
+                    'UpdateItem')
+    request_dict = {'context': {backend_metrics.CONTEXT_KEY: (
+        'Throttled', 'UpdateItem', 0)}}
+    operation = SimpleNamespace(name='UpdateItem')
+    for code in ('ProvisionedThroughputExceededException',
+                 'ConditionalCheckFailedException'):
+        backend_metrics._count_throttle(
+            request_dict, operation,
+            response=(None, {'Error': {'Code': code}}))
+    backend_metrics._count_throttle(request_dict, operation)
+    assert sample('datastore_backend_throttles_total', 'Throttled',
+                  'UpdateItem') == before + 1
+
+
+def test_sqlite_calls_timed(tmp_path):
+    driver = drivers.SQLiteDriver(str(tmp_path / 'datastore.sqlite3'))
+    before = sample('datastore_backend_latency_seconds_count',
+                    'Music-timed', 'PutItem')
+    driver.put('Music-timed', 'music_id', {'music_id': 'a'})
+    assert sample('datastore_backend_latency_seconds_count',
+                  'Music-timed', 'PutItem') == before + 1
@@ -0,0 +1,63 @@
+"""
+Test the invalidation of the read cache.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+import time
+
+# Installed packages
+
+# Local modules
+from cache import TTLCache
+
+
+def test_invalidate_drops_entry():
+    cache = TTLCache(10, 30)
+    cache.put('a', 1, cache.token())
+    assert cache.get('a') == (True, 1)
+    cache.invalidate('a')
+    assert cache.get('a') == (False, None)
+
+
+def test_read_in_flight_not_reinstated():
+    cache = TTLCache(10, 30)
+    # A read starts, a write of the key completes, then the read ends
+    token = cache.token()
+    cache.invalidate('a')
+    cache.put('a', 'old', token)
+    assert cache.get('a') == (False, None)
+    # Other keys and later reads are unaffected
+    cache.put('b', 'b', token)
+    assert cache.get('b') == (True, 'b')
+    cache.put('a', 'new', cache.token())
+    assert cache.get('a') == (True, 'new')
+
+
+def test_forgotten_invalidations_still_refuse():
+    cache = TTLCache(2, 30)
+    token = cache.token()
+    for key in 'abcd':
+        cache.invalidate(key)
+    # Only the two most recent are remembered by key; the older ones
+    # still refuse reads that began before them
+    cache.put('a', 'old', token)
+    assert cache.get('a') == (False, None)
+
+
+def test_expiry_and_eviction():
+    evictions = []
+    cache = TTLCache(2, 0.05, on_evict=lambda: evictions.append(1))
+    for key in 'abc':
+        cache.put(key, key, cache.token())
+    assert cache.get('a') == (False, None) and len(evictions) == 1
+    time.sleep(0.06)
+    assert cache.get('b') == (False, None)
+
+
+def test_disabled():
+    cache = TTLCache(0, 30)
+    cache.put('a', 1, cache.token())
+    assert cache.get('a') == (False, None)
+    cache.invalidate('a')
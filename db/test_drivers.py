@@ -0,0 +1,295 @@
+"""
+Test how the DynamoDB driver splits batches and reports their items.
+
+These tests stub DynamoDB out with botocore's Stubber; run them with
+`pytest` in this directory.
+"""
+
+# Standard libraries
+import itertools
+
+# Installed packages
+from botocore.stub import Stubber
+import pytest
+
+# Local modules
+import drivers
+from drivers import DriverError
+
+
+def refuse_calls(operation, refused):
+    '''Return a driver hook that refuses, as the rate limiter does,
+    the calls of `operation` whose numbers (from 1) are in `refused`'''
+    count = itertools.count(1)
+
+    def hook(events):
+        def before(model, **kwargs):
+            if model.name == operation and next(count) in refused:
+                raise DriverError('RateLimitedException', 'Refused',
+                                  retry_after=1.0)
+        # Ahead of the Stubber, which checks for a queued response on
+        # before-parameter-build
+        events.register('provide-client-params.dynamodb', before)
+    return hook
+
+
+def stubbed_driver(hook):
+    # One worker runs the chunks in order
+    driver = drivers.DynamoDBDriver('us-west-2', 'key', 'secret',
+                                    workers=1, hooks=[hook])
+    stubber = Stubber(driver._dynamodb.meta.client)
+    stubber.activate()
+    return driver, stubber
+
+
+def music(n):
+    return [{'PutRequest': {'Item': {'music_id': str(i)}}}
+            for i in range(n)]
+
+
+def test_batch_write_refused_chunk():
+    driver, stubber = stubbed_driver(refuse_calls('BatchWriteItem', {2}))
+    stubber.add_response('batch_write_item', {})
+    stubber.add_response('batch_write_item', {})
+    # 60 items go in chunks of 25, 25 and 10
+    outcome = driver.batch_write('Music', 'music_id', music(60))
+    stubber.assert_no_pending_responses()
+    assert [outcome[str(i)] for i in range(60)] == (
+        ['ok'] * 25 + ['RateLimitedException'] * 25 + ['ok'] * 10)
+
+
+def test_batch_write_failed_chunk():
+    driver, stubber = stubbed_driver(refuse_calls('BatchWriteItem', ()))
+    stubber.add_client_error('batch_write_item', 'ValidationException')
+    stubber.add_response('batch_write_item', {})
+    outcome = driver.batch_write('Music', 'music_id', music(30))
+    assert [outcome[str(i)] for i in range(30)] == (
+        ['ValidationException'] * 25 + ['ok'] * 5)
+
+
+def test_batch_get_refused_chunk():
+    driver, stubber = stubbed_driver(refuse_calls('BatchGetItem', {2}))
+    for first in (0, 200):
+        stubber.add_response('batch_get_item', {'Responses': {'Music': [
+            {'music_id': {'S': str(i)}} for i in range(first, first + 10)]}})
+    keys = [str(i) for i in range(250)]
+    items, unprocessed = driver.batch_get('Music', 'music_id', keys)
+    assert [item['music_id'] for item in items] == (
+        keys[0:10] + keys[200:210])
+    assert unprocessed == keys[100:200]
+
+
+def test_batch_get_all_refused():
+    driver, stubber = stubbed_driver(refuse_calls('BatchGetItem', {1, 2}))
+    with pytest.raises(DriverError) as e:
+        driver.batch_get('Music', 'music_id',
+                         [str(i) for i in range(150)])
+    assert e.value.code == 'RateLimitedException'
+    assert e.value.retry_after == 1.0
+
+
+def test_int_arg():
+    assert drivers.int_arg(None, 20, 1) == 20
+    assert drivers.int_arg('5', 20, 1, 10) == 5
+    for value in ('x', '1.5', '0', '11'):
+        with pytest.raises(DriverError) as e:
+            drivers.int_arg(value, 20, 1, 10)
+        assert e.value.code == 'ValidationException'
+
+
+def keys_param(keys):
+    return {'Keys': [{'music_id': k} for k in keys]}
+
+
+def found(keys):
+    return [{'music_id': {'S': k}} for k in keys]
+
+
+def unprocessed_keys(keys):
+    return {'Music': {'Keys': found(keys)}}
+
+
+def test_batch_get_chunks_and_retries(monkeypatch):
+    delays = []
+    monkeypatch.setattr(drivers, 'backoff', delays.append)
+    driver, stubber = stubbed_driver(refuse_calls('BatchGetItem', ()))
+    keys = [str(i) for i in range(150)]
+    # The first chunk of 100 keys leaves 40 unprocessed twice
+    stubber.add_response(
+        'batch_get_item',
+        {'Responses': {'Music': found(keys[:60])},
+         'UnprocessedKeys': unprocessed_keys(keys[60:100])},
+        expected_params={'RequestItems': {'Music': keys_param(keys[:100])}})
+    stubber.add_response(
+        'batch_get_item',
+        {'Responses': {'Music': found(keys[60:80])},
+         'UnprocessedKeys': unprocessed_keys(keys[80:100])},
+        expected_params={'RequestItems': {
+            'Music': keys_param(keys[60:100])}})
+    stubber.add_response(
+        'batch_get_item', {'Responses': {'Music': found(keys[80:100])}},
+        expected_params={'RequestItems': {
+            'Music': keys_param(keys[80:100])}})
+    stubber.add_response(
+        'batch_get_item', {'Responses': {'Music': found(keys[100:])}},
+        expected_params={'RequestItems': {'Music': keys_param(keys[100:])}})
+    items, unprocessed = driver.batch_get('Music', 'music_id', keys)
+    stubber.assert_no_pending_responses()
+    assert sorted(item['music_id'] for item in items) == sorted(keys)
+    assert unprocessed == []
+    assert delays == [0, 1]
+
+
+def test_batch_get_gives_up(monkeypatch):
+    monkeypatch.setattr(drivers, 'backoff', lambda attempt: None)
+    driver, stubber = stubbed_driver(refuse_calls('BatchGetItem', ()))
+    for _ in range(drivers.BATCH_MAX_RETRIES + 1):
+        stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'Music': []},
+             'UnprocessedKeys': unprocessed_keys(['a'])})
+    assert driver.batch_get('Music', 'music_id', ['a']) == ([], ['a'])
+    stubber.assert_no_pending_responses()
+
+
+def test_backoff_delay():
+    for attempt in range(12):
+        delay = drivers.backoff_delay(attempt)
+        assert 0 <= delay <= min(drivers.BATCH_BACKOFF_CAP,
+                                 drivers.BATCH_BACKOFF_BASE * 2 ** attempt)
+
+
+def unprocessed_items(first, last):
+    return {'Music': [{'PutRequest': {'Item': {'music_id': {'S': str(i)}}}}
+                      for i in range(first, last)]}
+
+
+def test_batch_write_retries_unprocessed(monkeypatch):
+    delays = []
+    monkeypatch.setattr(drivers, 'backoff', delays.append)
+    driver, stubber = stubbed_driver(refuse_calls('BatchWriteItem', ()))
+    items = music(30)
+    stubber.add_response(
+        'batch_write_item', {'UnprocessedItems': unprocessed_items(20, 25)},
+        expected_params={'RequestItems': {'Music': items[:25]}})
+    stubber.add_response(
+        'batch_write_item', {},
+        expected_params={'RequestItems': {'Music': items[20:25]}})
+    stubber.add_response(
+        'batch_write_item', {},
+        expected_params={'RequestItems': {'Music': items[25:]}})
+    outcome = driver.batch_write('Music', 'music_id', items)
+    stubber.assert_no_pending_responses()
+    assert outcome == {str(i): 'ok' for i in range(30)}
+    assert delays == [0]
+
+
+def test_batch_write_gives_up(monkeypatch):
+    monkeypatch.setattr(drivers, 'backoff', lambda attempt: None)
+    driver, stubber = stubbed_driver(refuse_calls('BatchWriteItem', ()))
+    stubber.add_response('batch_write_item',
+                         {'UnprocessedItems': unprocessed_items(1, 3)})
+    for _ in range(drivers.BATCH_MAX_RETRIES):
+        stubber.add_response('batch_write_item',
+                             {'UnprocessedItems': unprocessed_items(2, 3)})
+    outcome = driver.batch_write('Music', 'music_id', music(3))
+    stubber.assert_no_pending_responses()
+    assert outcome == {'0': 'ok', '1': 'ok', '2': 'unprocessed'}
+
+
+def test_get_projection_and_consistency():
+    driver, stubber = stubbed_driver(refuse_calls('GetItem', ()))
+    stubber.add_response(
+        'get_item', {'Item': {'music_id': {'S': 'a'},
+                              'OrigArtist': {'S': 'A'}}},
+        expected_params={
+            'TableName': 'Music', 'Key': {'music_id': 'a'},
+            'ConsistentRead': True,
+            # The key is always fetched, so a found item is never empty
+            'ProjectionExpression': '#p0, #p1',
+            'ExpressionAttributeNames': {'#p0': 'music_id',
+                                         '#p1': 'OrigArtist'}})
+    stubber.add_response(
+        'get_item', {},
+        expected_params={'TableName': 'Music', 'Key': {'music_id': 'b'},
+                         'ConsistentRead': False})
+    assert driver.get('Music', 'music_id', 'a', fields=['OrigArtist'],
+                      consistent=True) == {'music_id': 'a',
+                                           'OrigArtist': 'A'}
+    assert driver.get('Music', 'music_id', 'b') is None
+    stubber.assert_no_pending_responses()
+
+
+def test_update_item_kwargs():
+    kwargs = drivers.update_item_kwargs(
+        'playlist_id', 'p', {'Name': 'N'},
+        [{'op': 'append', 'attr': 'music_id_list', 'values': ['m']},
+         {'op': 'add', 'attr': 'plays', 'value': 1},
+         {'op': 'delete', 'attr': 'tags', 'values': ['x']},
+         {'op': 'remove', 'attr': 'music_id_list', 'index': 0}],
+        [{'attr': 'music_id_list', 'cmp': 'not_contains', 'value': 'm'}],
+        'ALL_NEW')
+    assert kwargs == {
+        'Key': {'playlist_id': 'p'},
+        'UpdateExpression':
+            'SET #n0 = :val0, '
+            '#n1 = list_append(if_not_exists(#n1, :val1), :val2) '
+            'REMOVE #n4[0] ADD #n2 :val3 DELETE #n3 :val4',
+        'ConditionExpression': 'NOT contains(#n5, :val5)',
+        'ReturnValues': 'ALL_NEW',
+        'ExpressionAttributeNames': {
+            '#n0': 'Name', '#n1': 'music_id_list', '#n2': 'plays',
+            '#n3': 'tags', '#n4': 'music_id_list', '#n5': 'music_id_list'},
+        'ExpressionAttributeValues': {
+            ':val0': 'N', ':val1': [], ':val2': ['m'], ':val3': 1,
+            ':val4': {'x'}, ':val5': 'm'},
+    }
+
+
+def test_update_validation():
+    for ops in ([], [{'op': 'pop', 'attr': 'a'}], [{'op': 'append'}],
+                [{'op': 'set', 'attr': 'a'}]):
+        with pytest.raises(DriverError) as e:
+            drivers.update_item_kwargs('k', 'v', {}, ops, [], 'NONE')
+        assert e.value.code == 'ValidationException'
+    with pytest.raises(DriverError):
+        drivers.update_item_kwargs('k', 'v', {'a': 1}, [],
+                                   [{'attr': 'a', 'cmp': 'like'}], 'NONE')
+
+
+def test_cursor():
+    last_key = {'music_id': 'a/b+c', 'Artist': 'A'}
+    cursor = drivers.encode_cursor(last_key)
+    assert drivers.decode_cursor(cursor) == last_key
+    with pytest.raises(DriverError) as e:
+        drivers.decode_cursor('not a cursor')
+    assert e.value.code == 'ValidationException'
+
+
+def test_query_kwargs():
+    kwargs = drivers.query_kwargs(
+        'music_id', 'Artist-index',
+        [{'attr': 'Artist', 'cmp': 'eq', 'value': 'A'},
+         {'attr': 'SongTitle', 'cmp': 'begins_with', 'value': 'The'}],
+        [{'attr': 'Year', 'cmp': 'between', 'value': [1990, 1999]}],
+        ['SongTitle'], 10, {'music_id': 'm'})
+    assert kwargs == {
+        'IndexName': 'Artist-index',
+        'KeyConditionExpression':
+            '#n0 = :val0 AND begins_with(#n1, :val1)',
+        'FilterExpression': '#n2 BETWEEN :val2 AND :val3',
+        'ProjectionExpression': '#n3, #n4',
+        'Limit': 10,
+        'ExclusiveStartKey': {'music_id': 'm'},
+        'ExpressionAttributeNames': {
+            '#n0': 'Artist', '#n1': 'SongTitle', '#n2': 'Year',
+            '#n3': 'music_id', '#n4': 'SongTitle'},
+        'ExpressionAttributeValues': {
+            ':val0': 'A', ':val1': 'The', ':val2': 1990, ':val3': 1999},
+    }
+    for key_conditions in ([], [{'attr': 'Artist', 'cmp': 'lt',
+                                 'value': 'A'}]):
+        with pytest.raises(DriverError) as e:
+            drivers.query_kwargs('music_id', 'Artist-index',
+                                 key_conditions, [], None, None, None)
+        assert e.value.code == 'ValidationException'
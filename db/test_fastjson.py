@@ -0,0 +1,46 @@
+"""
+Test the encoding of DynamoDB items by fastjson.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+from boto3.dynamodb.types import Binary
+import pytest
+import simplejson
+
+# Local modules
+import fastjson
+
+
+def test_dynamodb_types():
+    item = {'n': Decimal('3'), 'f': Decimal('200.5'),
+            'neg': Decimal('-12'), 'tags': {'b', 'a'},
+            'raw': b'\x00\xff', 'bin': Binary(b'hi'), 'list': [Decimal(1)]}
+    assert fastjson.dumps(item) == (
+        b'{"n":3,"f":200.5,"neg":-12,"tags":["a","b"],"raw":"AP8=",'
+        b'"bin":"aGk=","list":[1]}')
+
+
+@pytest.mark.parametrize('number', [
+    '12345678901234567890', '0.12345678901234567', '1E+400'])
+def test_exact_numbers(number):
+    # Beyond an int64 or a float: no digit is lost
+    item = {'n': Decimal(number), 'tags': {'a'}, 'bin': Binary(b'hi')}
+    data = fastjson.dumps(item)
+    assert simplejson.loads(data, use_decimal=True) == {
+        'n': Decimal(number), 'tags': ['a'], 'bin': 'aGk='}
+
+
+def test_newline():
+    assert fastjson.dumps({'a': 1}, newline=True) == b'{"a":1}\n'
+    assert fastjson.dumps({'n': Decimal('1E+400')}, newline=True) == (
+        b'{"n":1E+400}\n')
+
+
+def test_unknown_type():
+    with pytest.raises(TypeError):
+        fastjson.dumps({'o': object()})
@@ -0,0 +1,76 @@
+"""
+Test the hot-key sketch and its rotating windows.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+import collections
+import random
+
+# Installed packages
+
+# Local modules
+import hotkeys
+from hotkeys import HotKeys
+from hotkeys import HotKeysCollector
+from hotkeys import SpaceSaving
+
+
+def test_exact_under_capacity():
+    sketch = SpaceSaving(3)
+    for key in 'abacab':
+        sketch.add(key)
+    assert sketch.top(5) == [('a', 3, 0), ('b', 2, 0), ('c', 1, 0)]
+    assert sketch.top(1) == [('a', 3, 0)] and sketch.total == 6
+
+
+def test_heavy_hitters_kept():
+    rng = random.Random(756)
+    stream = ['hot1'] * 300 + ['hot2'] * 200 + [
+        'cold' + str(rng.randrange(500)) for _ in range(1500)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(20)
+    for key in stream:
+        sketch.add(key)
+    counts = collections.Counter(stream)
+    assert len(sketch) == 20 and sketch.total == len(stream)
+    top = sketch.top(20)
+    assert [key for key, _, _ in top[:2]] == ['hot1', 'hot2']
+    for key, count, error in top:
+        assert count - error <= counts[key] <= count
+    # Every key above total / capacity is tracked
+    tracked = {key for key, _, _ in top}
+    assert all(key in tracked for key, n in counts.items()
+               if n > len(stream) / 20)
+
+
+def test_windows(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(hotkeys.time, 'monotonic', lambda: now[0])
+    keys = HotKeys(('read', 'write'), ('objtype', 'objkey'), 10, 60)
+    keys.add('read', ('music', 'a'))
+    keys.add('read', ('music', 'a'))
+    keys.add('write', ('music', 'b'))
+    report = keys.report(5)
+    assert report['previous'] is None
+    assert report['current']['read'] == {'Total': 2, 'Keys': [
+        {'objtype': 'music', 'objkey': 'a', 'count': 2, 'error': 0}]}
+    now[0] += 61
+    keys.add('read', ('music', 'c'))
+    report = keys.report(5)
+    assert report['previous']['read']['Total'] == 2
+    assert report['current']['read']['Keys'][0]['objkey'] == 'c'
+    gauge, = HotKeysCollector(keys, 5).collect()
+    assert sorted((s.labels['kind'], s.labels['objkey'], s.value)
+                  for s in gauge.samples) == [
+        ('read', 'a', 2), ('write', 'b', 1)]
+    # After a whole idle window, the previous window is empty
+    now[0] += 121
+    assert keys.report(5)['previous']['read'] == {'Total': 0, 'Keys': []}
+
+
+def test_disabled():
+    keys = HotKeys(('read',), ('objtype', 'objkey'), 0, 60)
+    keys.add('read', ('music', 'a'))
+    assert keys.report(5)['current']['read'] == {'Total': 0, 'Keys': []}
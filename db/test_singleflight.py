@@ -0,0 +1,134 @@
+"""
+Test the coalescing of identical concurrent calls.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Installed packages
+import pytest
+
+# Local modules
+from singleflight import AsyncSingleFlight
+from singleflight import SingleFlight
+
+
+class Backend():
+    '''Counts calls, each of which blocks until `release` is set'''
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def read(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return self.calls
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one():
+    shared = []
+    flights = SingleFlight(on_shared=lambda: shared.append(1))
+    backend = Backend()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flights.do, 'k', 'all', backend.read)
+        backend.started.wait(5)
+        followers = [pool.submit(flights.do, 'k', 'all', backend.read)
+                     for _ in range(3)]
+        wait_for(lambda: len(shared) == 3)
+        backend.release.set()
+        results = [f.result() for f in [leader] + followers]
+    assert results == [1] * 4 and backend.calls == 1
+    # The call is over, so the next one is fresh
+    assert flights.do('k', 'all', backend.read) == 2
+
+
+def test_variants_not_shared():
+    flights = SingleFlight()
+    backend = Backend()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(flights.do, 'k', 'all', backend.read)
+        backend.started.wait(5)
+        second = pool.submit(flights.do, 'k', 'Artist', backend.read)
+        wait_for(lambda: backend.calls == 2)
+        backend.release.set()
+        first.result()
+        second.result()
+    assert backend.calls == 2
+
+
+def test_forget_starts_fresh_call():
+    flights = SingleFlight()
+    backend = Backend()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        before = pool.submit(flights.do, 'k', 'all', backend.read)
+        backend.started.wait(5)
+        # A write completes while the read is in flight
+        flights.forget('k')
+        after = pool.submit(flights.do, 'k', 'all', backend.read)
+        wait_for(lambda: backend.calls == 2)
+        backend.release.set()
+        before.result()
+        after.result()
+    assert backend.calls == 2
+
+
+def test_error_shared():
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        assert release.wait(5)
+        raise ValueError('backend failed')
+    shared = threading.Event()
+    flights = SingleFlight(on_shared=shared.set)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flights.do, 'k', 'all', fail)
+        started.wait(5)
+        follower = pool.submit(flights.do, 'k', 'all', fail)
+        assert shared.wait(5)
+        release.set()
+        for f in (leader, follower):
+            with pytest.raises(ValueError):
+                f.result()
+    # A failed call is not kept either
+    assert flights.do('k', 'all', lambda: 'ok') == 'ok'
+
+
+def test_async_calls_share_one():
+    shared = []
+    flights = AsyncSingleFlight(on_shared=lambda: shared.append(1))
+    calls = []
+
+    async def read():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        first = asyncio.ensure_future(flights.do('k', 'all', read))
+        await asyncio.sleep(0)
+        # A cancelled caller does not cancel the call for the others
+        cancelled = asyncio.ensure_future(flights.do('k', 'all', read))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        results = await asyncio.gather(
+            first, *[flights.do('k', 'all', read) for _ in range(3)])
+        flights.forget('k')
+        return results + [await flights.do('k', 'all', read)]
+    assert asyncio.run(main()) == [1, 1, 1, 1, 2]
+    assert len(shared) == 4
@@ -0,0 +1,153 @@
+"""
+Test that the SQLite driver stores items as the DynamoDB driver does.
+
+Each test gets a fresh database file; run them with `pytest` in this
+directory.
+"""
+
+# Standard libraries
+from decimal import Decimal
+
+# Installed packages
+import pytest
+
+# Local modules
+import drivers
+from drivers import DriverError
+
+TABLE = 'Music-test'
+KEY = 'music_id'
+
+
+@pytest.fixture
+def driver(tmp_path):
+    return drivers.SQLiteDriver(str(tmp_path / 'datastore.sqlite3'))
+
+
+def test_put_get_delete(driver):
+    item = {KEY: 'a', 'Artist': 'A', 'Length': Decimal('200.5'),
+            'Tags': {'x', 'y'}, 'Art': b'\x00\xff'}
+    driver.put(TABLE, KEY, item)
+    assert driver.get(TABLE, KEY, 'a') == item
+    driver.put(TABLE, KEY, {KEY: 'a'})
+    assert driver.get(TABLE, KEY, 'a') == {KEY: 'a'}
+    driver.delete(TABLE, KEY, 'a')
+    assert driver.get(TABLE, KEY, 'a') is None
+    driver.delete(TABLE, KEY, 'a')
+
+
+def test_batches(driver):
+    outcome = driver.batch_write(TABLE, KEY, [
+        {'PutRequest': {'Item': {KEY: str(i)}}} for i in range(3)])
+    assert outcome == {'0': 'ok', '1': 'ok', '2': 'ok'}
+    driver.batch_write(TABLE, KEY, [{'DeleteRequest': {'Key': {KEY: '1'}}}])
+    items, unprocessed = driver.batch_get(TABLE, KEY, ['0', '1', '2'])
+    assert sorted(item[KEY] for item in items) == ['0', '2']
+    assert unprocessed == []
+
+
+def test_writer_flushes_on_exit(driver):
+    with driver.writer(TABLE, KEY) as w:
+        for i in range(5):
+            w.put_item(Item={KEY: str(i)})
+    items, _ = driver.batch_get(TABLE, KEY, [str(i) for i in range(5)])
+    assert len(items) == 5
+
+
+def test_invalid_table_name(driver):
+    with pytest.raises(DriverError) as e:
+        driver.get('x"; DROP TABLE y', KEY, 'a')
+    assert e.value.code == 'ValidationException'
+
+
+def test_update_ops(driver):
+    assert driver.update(TABLE, KEY, 'p', {'Name': 'N'}, ops=[
+        {'op': 'append', 'attr': 'songs', 'values': ['a', 'b']},
+        {'op': 'prepend', 'attr': 'songs', 'values': ['z']},
+        {'op': 'add', 'attr': 'plays', 'value': Decimal(2)},
+        {'op': 'add', 'attr': 'tags', 'values': ['x', 'y']},
+        {'op': 'set_if_not_exists', 'attr': 'owner', 'value': 'o'},
+    ], return_values='ALL_NEW') == {
+        KEY: 'p', 'Name': 'N', 'songs': ['z', 'a', 'b'], 'plays': 2,
+        'tags': {'x', 'y'}, 'owner': 'o'}
+    old = driver.update(TABLE, KEY, 'p', {}, ops=[
+        {'op': 'remove', 'attr': 'songs', 'index': 0},
+        {'op': 'set', 'attr': 'songs', 'index': 0, 'value': 'c'},
+        {'op': 'add', 'attr': 'plays', 'value': Decimal(1)},
+        {'op': 'delete', 'attr': 'tags', 'values': ['x', 'y']},
+        {'op': 'set_if_not_exists', 'attr': 'owner', 'value': 'q'},
+        {'op': 'remove', 'attr': 'Name'},
+    ], return_values='ALL_OLD')
+    assert old['songs'] == ['z', 'a', 'b']
+    # An empty set disappears, as DynamoDB has none
+    assert driver.get(TABLE, KEY, 'p') == {
+        KEY: 'p', 'songs': ['c', 'b'], 'plays': 3, 'owner': 'o'}
+    with pytest.raises(DriverError) as e:
+        driver.update(TABLE, KEY, 'p', {}, ops=[
+            {'op': 'set', 'attr': 'songs', 'index': 5, 'value': 'd'}])
+    assert e.value.code == 'ValidationException'
+
+
+def test_update_conditions(driver):
+    driver.put(TABLE, KEY, {KEY: 'p', 'songs': ['a'], 'version': 1})
+    for conditions in (
+            [{'attr': 'songs', 'cmp': 'not_contains', 'value': 'a'}],
+            [{'attr': 'version', 'cmp': 'eq', 'value': 2}],
+            [{'attr': 'songs', 'index': 1, 'cmp': 'exists'}],
+            [{'attr': 'version', 'cmp': 'gt', 'value': 'x'}]):
+        with pytest.raises(DriverError) as e:
+            driver.update(TABLE, KEY, 'p', {'version': 3},
+                          conditions=conditions)
+        assert e.value.code == 'ConditionalCheckFailedException'
+    assert driver.get(TABLE, KEY, 'p')['version'] == 1
+    driver.update(TABLE, KEY, 'p', {'version': 2}, conditions=[
+        {'attr': 'songs', 'index': 0, 'cmp': 'eq', 'value': 'a'},
+        {'attr': 'version', 'cmp': 'between', 'value': [1, 1]},
+        {'attr': 'owner', 'cmp': 'not_exists'}])
+    assert driver.get(TABLE, KEY, 'p')['version'] == 2
+
+
+def test_scan_pages_and_segments(driver):
+    keys = sorted(str(i) for i in range(25))
+    driver.batch_write(TABLE, KEY, [{'PutRequest': {'Item': {KEY: k}}}
+                                    for k in keys])
+    pages = []
+    start_key = None
+    while True:
+        items, start_key = driver.scan(TABLE, KEY, limit=10,
+                                       start_key=start_key)
+        pages.append([item[KEY] for item in items])
+        if not start_key:
+            break
+    assert pages == [keys[:10], keys[10:20], keys[20:]]
+    segments = [driver.scan(TABLE, KEY, segment=s, total_segments=3)
+                for s in range(3)]
+    assert all(items and last is None for items, last in segments)
+    assert sorted(item[KEY] for items, _ in segments
+                  for item in items) == keys
+
+
+def test_query(driver):
+    songs = [('1', 'A', 'The One', 1995), ('2', 'A', 'Two', 1996),
+             ('3', 'A', 'The Three', 2001), ('4', 'B', 'The Four', 1995),
+             ('5', 'A', 'The Five', 1999)]
+    for key, artist, title, year in songs:
+        driver.put(TABLE, KEY, {KEY: key, 'Artist': artist,
+                                'SongTitle': title, 'Year': Decimal(year)})
+    key_conditions = [
+        {'attr': 'Artist', 'cmp': 'eq', 'value': 'A'},
+        {'attr': 'SongTitle', 'cmp': 'begins_with', 'value': 'The'}]
+    items, last = driver.query(TABLE, KEY, 'Artist-index', key_conditions,
+                               fields=['SongTitle'])
+    assert items == [{KEY: '1', 'SongTitle': 'The One'},
+                     {KEY: '3', 'SongTitle': 'The Three'},
+                     {KEY: '5', 'SongTitle': 'The Five'}]
+    assert last is None
+    # The limit counts items before the filter, so a page may be short
+    filters = [{'attr': 'Year', 'cmp': 'lt', 'value': Decimal(2000)}]
+    items, last = driver.query(TABLE, KEY, 'Artist-index', key_conditions,
+                               filters=filters, limit=2)
+    assert [item[KEY] for item in items] == ['1'] and last == {KEY: '3'}
+    items, last = driver.query(TABLE, KEY, 'Artist-index', key_conditions,
+                               filters=filters, limit=2, start_key=last)
+    assert [item[KEY] for item in items] == ['5'] and last is None
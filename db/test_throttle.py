@@ -0,0 +1,102 @@
+"""
+Test the client-side rate limiter.
+
+These tests need no DynamoDB; run them with `pytest` in this
+directory.
+"""
+
+# Standard libraries
+from types import SimpleNamespace
+
+# Installed packages
+import pytest
+
+# Local modules
+from drivers import DriverError
+import throttle
+
+BATCH_GET = SimpleNamespace(name='BatchGetItem')
+BATCH_WRITE = SimpleNamespace(name='BatchWriteItem')
+GET = SimpleNamespace(name='GetItem')
+
+
+@pytest.fixture
+def limiter(request):
+    # The service's defaults
+    return throttle.AIMDLimiter(initial_rate=100, min_rate=1,
+                                max_rate=5000, max_wait=0.5)
+
+
+def batch_get(table, n):
+    return {'RequestItems': {table: {'Keys': [{'id': str(i)}
+                                              for i in range(n)]}}}
+
+
+def batch_write(table, n):
+    return {'RequestItems': {table: [{'PutRequest': {'Item': {}}}] * n}}
+
+
+def test_call_costs():
+    assert throttle.call_costs({'TableName': 'Music'}, GET) == [
+        ('Music', 'read', 1)]
+    assert throttle.call_costs(batch_get('Music', 100), BATCH_GET) == [
+        ('Music', 'read', 100)]
+    assert throttle.call_costs(batch_write('Music', 25), BATCH_WRITE) == [
+        ('Music', 'write', 25)]
+    assert throttle.call_costs(batch_get('Music', 0), BATCH_GET) == [
+        ('Music', 'read', 1)]
+
+
+def test_cold_limiter_accepts_full_batch(limiter):
+    # A 3000-key /batch_read and a 1000-item /batch_write, in the
+    # chunks the driver sends them
+    for _ in range(30):
+        costs = throttle.call_costs(batch_get('Music', 100), BATCH_GET)
+        assert limiter.reserve(costs) == 0
+        limiter.on_success(costs)
+    for _ in range(40):
+        costs = throttle.call_costs(batch_write('Music', 25), BATCH_WRITE)
+        assert limiter.reserve(costs) == 0
+        limiter.on_success(costs)
+
+
+def test_throttle_starts_limiting(limiter):
+    costs = throttle.call_costs(batch_get('Music', 100), BATCH_GET)
+    limiter.on_throttle(costs)
+    # 100 keys at 100 calls per second take a second of the bucket
+    assert limiter.reserve(costs) == 0
+    with pytest.raises(DriverError) as e:
+        limiter.reserve(costs)
+    assert e.value.code == 'RateLimitedException'
+    assert e.value.retry_after > limiter.max_wait
+    # Other tables and kinds stay unlimited
+    other = throttle.call_costs(batch_get('User', 100), BATCH_GET)
+    assert limiter.reserve(other) == 0
+    writes = throttle.call_costs(batch_write('Music', 25), BATCH_WRITE)
+    assert limiter.reserve(writes) == 0
+
+
+def test_throttle_decreases_once_per_interval(limiter):
+    costs = [('Music', 'read', 1)]
+    limiter.on_throttle(costs)
+    limiter.on_throttle(costs)
+    assert limiter._bucket(('Music', 'read')).rate == 100
+    limiter._bucket(('Music', 'read')).last_decrease -= 1
+    limiter.on_throttle(costs)
+    assert limiter._bucket(('Music', 'read')).rate == 50
+    limiter._bucket(('Music', 'read')).last_decrease -= 1
+    limiter.min_rate = 40
+    limiter.on_throttle(costs)
+    assert limiter._bucket(('Music', 'read')).rate == 40
+
+
+def test_recovery_stops_limiting(limiter):
+    costs = [('Music', 'read', 1)]
+    limiter.max_rate = 101
+    limiter.on_throttle(costs)
+    limiter.on_success([('Music', 'read', 50)])
+    assert limiter._bucket(('Music', 'read')).rate == 100.5
+    limiter.on_success([('Music', 'read', 100)])
+    assert limiter._bucket(('Music', 'read')).rate is None
+    for _ in range(100):
+        assert limiter.reserve([('Music', 'read', 100)]) == 0
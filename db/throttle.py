@@ -0,0 +1,217 @@
+"""
+SFU CMPT 756
+Client-side adaptive rate limiting of DynamoDB calls.
+
+Each table's reads and writes pass through a token bucket whose rate
+adapts AIMD-style: every successful call raises it a little, and a
+throttle from DynamoDB halves it.  A call that would have to wait
+longer than `max_wait` for its turn is refused with a
+'RateLimitedException' DriverError carrying a `retry_after`, which the
+service returns as a 429, rather than being sent to a table that is
+already throttling.
+
+A bucket only limits once its table has throttled.  Until then, and
+again once its rate has climbed back to `max_rate`, every call passes
+at once.  A batch costs a token per key or item, so a rate guessed
+before DynamoDB has said anything would refuse large batches, which
+split into many calls, on an idle table.
+
+`AIMDLimiter.install` and `AIMDLimiter.install_async` hook the limiter
+into the botocore event system of a boto3 or aioboto3 client; pass
+them to the driver in its `hooks`.
+"""
+
+# Standard library modules
+import asyncio
+import threading
+import time
+
+# Installed packages
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+# Local modules
+from backend_metrics import READ_OPERATIONS
+from backend_metrics import THROTTLE_CODES
+from backend_metrics import table_label
+from drivers import DriverError
+
+# With several worker processes, each has its own limiter; their rates
+# add up
+LIMIT_RATE = Gauge('datastore_rate_limit',
+                   'Calls per second currently allowed to DynamoDB',
+                   ['table', 'kind'],
+                   multiprocess_mode='livesum')
+LIMITED_CALLS = Counter('datastore_rate_limited_calls',
+                        'DynamoDB calls refused by the rate limiter',
+                        ['table', 'kind'])
+
+# Key under which a call's limiter keys ride in the botocore request
+# context
+CONTEXT_KEY = 'datastore_limit'
+
+
+class _Bucket():
+    '''Rate and schedule of one (table, kind).  A rate of None means
+    the bucket does not limit.'''
+    def __init__(self, rate=None):
+        self.rate = rate
+        # Time at which the bucket is next empty (GCRA's theoretical
+        # arrival time)
+        self.tat = 0.0
+        self.last_decrease = 0.0
+
+
+def call_costs(params, model):
+    '''Return [(table, kind, cost)] for a DynamoDB request: a batch call
+    costs one unit per key or item it names'''
+    kind = 'read' if model.name in READ_OPERATIONS else 'write'
+    if 'RequestItems' in params:
+        costs = []
+        for table, request in params['RequestItems'].items():
+            n = len(request['Keys']) if 'Keys' in request else len(request)
+            costs.append((table, kind, max(1, n)))
+        return costs
+    return [(table_label(params), kind, 1)]
+
+
+class AIMDLimiter():
+    """Per-table token buckets with additive-increase,
+    multiplicative-decrease rates.
+
+    Parameters
+    ----------
+    initial_rate, min_rate, max_rate: float
+        Rate a bucket starts limiting at, on its first throttle, and
+        stays between, in calls per second.  A batch call counts as
+        one call per key or item.
+    increase: float
+        Calls per second added per second of successful calls.
+    decrease: float
+        Factor applied to the rate on a throttle.
+    burst: int
+        Calls a bucket may send back to back.
+    max_wait: float
+        Longest a call may queue for its turn before it is refused.
+    decrease_interval: float
+        Minimum seconds between two decreases of one bucket, so that a
+        burst of throttles from calls already in flight counts once.
+    """
+    def __init__(self, initial_rate=100, min_rate=1, max_rate=5000,
+                 increase=1, decrease=0.5, burst=10, max_wait=0.5,
+                 decrease_interval=1.0):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.max_wait = max_wait
+        self.decrease_interval = decrease_interval
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    def _set_rate(self, key, bucket, rate):
+        '''Change the rate of a limiting bucket, which stops limiting
+        once it reaches `max_rate`'''
+        if rate >= self.max_rate:
+            bucket.rate = None
+            LIMIT_RATE.labels(*key).set(0)
+        else:
+            bucket.rate = rate
+            LIMIT_RATE.labels(*key).set(rate)
+
+    def reserve(self, costs):
+        '''
+        Reserve a turn for a call of `costs` (see call_costs()).
+        Return the seconds to wait before sending it, or raise a
+        'RateLimitedException' DriverError if that would exceed
+        `max_wait`.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            plans = []
+            for table, kind, cost in costs:
+                bucket = self._bucket((table, kind))
+                if bucket.rate is None:
+                    continue
+                interval = 1 / bucket.rate
+                tat = max(bucket.tat, now)
+                wait = max(0.0, tat - (self.burst - 1) * interval - now)
+                if wait > self.max_wait:
+                    LIMITED_CALLS.labels(table, kind).inc()
+                    raise DriverError(
+                        'RateLimitedException',
+                        'Too many calls to ' + table,
+                        retry_after=wait)
+                plans.append((bucket, tat + cost * interval, wait))
+            for bucket, tat, _ in plans:
+                bucket.tat = tat
+        return max((wait for _, _, wait in plans), default=0.0)
+
+    def on_success(self, costs):
+        with self._lock:
+            for table, kind, cost in costs:
+                bucket = self._bucket((table, kind))
+                if bucket.rate is not None:
+                    self._set_rate((table, kind), bucket,
+                                   bucket.rate + self.increase * cost /
+                                   bucket.rate)
+
+    def on_throttle(self, costs):
+        now = time.monotonic()
+        with self._lock:
+            for table, kind, _ in costs:
+                bucket = self._bucket((table, kind))
+                if now - bucket.last_decrease < self.decrease_interval:
+                    continue
+                bucket.last_decrease = now
+                if bucket.rate is None:
+                    rate = self.initial_rate
+                    bucket.tat = now
+                else:
+                    rate = max(self.min_rate, bucket.rate * self.decrease)
+                self._set_rate((table, kind), bucket, rate)
+
+    def _after_call(self, context, http_response, **kwargs):
+        costs = context.get(CONTEXT_KEY)
+        if costs and http_response.status_code < 300:
+            self.on_success(costs)
+
+    def _needs_retry(self, request_dict, response=None, **kwargs):
+        costs = request_dict.get('context', {}).get(CONTEXT_KEY)
+        if (costs and response is not None and
+                response[1].get('Error', {}).get('Code') in THROTTLE_CODES):
+            self.on_throttle(costs)
+
+    def _register(self, events, before):
+        events.register('before-parameter-build.dynamodb', before)
+        events.register('after-call.dynamodb', self._after_call)
+        events.register('needs-retry.dynamodb', self._needs_retry)
+
+    def install(self, events):
+        '''Limit the calls of a boto3 client, given its `meta.events`'''
+        def before(params, model, context, **kwargs):
+            costs = call_costs(params, model)
+            wait = self.reserve(costs)
+            context[CONTEXT_KEY] = costs
+            if wait:
+                time.sleep(wait)
+        self._register(events, before)
+
+    def install_async(self, events):
+        '''Limit the calls of an aioboto3 client, given its
+        `meta.events`'''
+        async def before(params, model, context, **kwargs):
+            costs = call_costs(params, model)
+            wait = self.reserve(costs)
+            context[CONTEXT_KEY] = costs
+            if wait:
+                await asyncio.sleep(wait)
+        self._register(events, before)
@@ -219,6 +219,27 @@ object ReadPutPutPutReadPlaylist {
   }
 }
 
+// ReadPutPutPutReadPlaylist with the add and remove as one PATCH
+object ReadPatchPutReadPlaylist {
+  val p_feeder = csv("playlist.csv").eager.circular
+  val readPatchPutReadPlaylist = forever("i") {
+    feed(p_feeder)
+    .exec(http("Read Playlist ${i}")
+      .get("/api/v1/playlist/${UUID}"))
+    .pause(1)
+    .exec(http("Edit songs ${i}")
+      .patch("/api/v1/playlist/${UUID}")
+      .body(StringBody("""{ "ops": [
+        { "op": "add", "music_id": "7dd81e75-1249-4b2f-a213-887aab899c2a" },
+        { "op": "remove", "music_id": "7dd81e75-1249-4b2f-a213-887aab899c2a" }] }""")))
+    .pause(1)
+    .exec(http("Rename Playlist ${i}")
+      .put("/api/v1/playlist/playlist-name/${UUID}")
+      .body(StringBody("""{ "playlist_name": "${UUID}" }""")))
+    .pause(1)
+  }
+}
+
 // Get Cluster IP from CLUSTER_IP environment variable or default to 127.0.0.1 (Minikube)
 class ReadTablesSim extends Simulation {
   val httpProtocol = http
@@ -320,6 +341,15 @@ class ReadPutPutPutReadPlaylistSim extends ReadTablesSim {
   ).protocols(httpProtocol)
 }
 
+class ReadPatchPutReadPlaylistSim extends ReadTablesSim {
+  val scnReadPatchPutReadPlaylist = scenario("ReadPatchPutReadPlaylist")
+    .exec(ReadPatchPutReadPlaylist.readPatchPutReadPlaylist)
+
+  setUp(
+    scnReadPatchPutReadPlaylist.inject(atOnceUsers(Utility.envVarToInt("USERS", 1)))
+  ).protocols(httpProtocol)
+}
+
 /*
   This doesn't work---it just reads the Music table.
   We left it in here as possible inspiration for other work
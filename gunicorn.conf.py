@@ -0,0 +1,138 @@
+"""
+SFU CMPT 756
+Production launcher: Gunicorn settings for the Python services.
+
+    gunicorn --config gunicorn.conf.py --bind 0.0.0.0:<port> app:app
+
+Each image is built from its service's directory, so this one copy is
+copied into those directories by `make -f k8s-tpl.mak templates` and
+before each image build (see GUNICORN_CONFS in k8s-tpl.mak).  Edit it
+here; git ignores the copies.
+
+`app.run()` serves every request from one process, so the GIL keeps a
+pod to a single core.  Here Gunicorn pre-forks worker processes, one
+per CPU of the container's quota, each running request threads.  The
+app is imported once before forking.  On SIGTERM, workers finish the
+requests they have in flight, for up to GUNICORN_GRACEFUL_TIMEOUT
+seconds, before exiting.
+
+Each worker keeps its Prometheus metrics in files under
+PROMETHEUS_MULTIPROC_DIR, so `/metrics`, whichever worker serves it,
+reports the totals of every worker, including the process_* metrics
+that `WorkerProcessMetrics` publishes.
+
+Environment variables:
+- WEB_CONCURRENCY: worker processes (default: the CPU quota, rounded up).
+  The db and s2 v1.1 images set 1: their in-memory caches must see
+  every write, so they scale by threads and replicas instead.
+- GUNICORN_THREADS: request threads per worker (default 8).
+- GUNICORN_GRACEFUL_TIMEOUT: seconds allowed to finish on shutdown
+  (default 25, within Kubernetes' 30-second termination grace).
+- PROMETHEUS_MULTIPROC_DIR: directory for the metric files (default: a
+  fresh temporary directory).
+"""
+
+# Standard library modules
+import math
+import os
+import tempfile
+import time
+
+
+def cpu_quota():
+    '''Return the CPUs this container may use: its cgroup CPU quota if
+    it has one, else the CPUs it may be scheduled on'''
+    try:
+        # cgroup v2: "<quota> <period>", or "max <period>" if unlimited
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: a quota of -1 means unlimited
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+# prometheus_client picks its storage when it is first imported, so
+# this must be set before the app is loaded.  prometheus-flask-exporter
+# 0.18 only reads the older, lower-case name.
+multiproc_dir = (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or
+                 tempfile.mkdtemp(prefix='prometheus-'))
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = multiproc_dir
+os.environ['prometheus_multiproc_dir'] = multiproc_dir
+# Discard metric files left by an earlier run in the same directory
+for name in os.listdir(multiproc_dir):
+    os.remove(os.path.join(multiproc_dir, name))
+
+workers = int(os.getenv('WEB_CONCURRENCY',
+                        str(max(1, math.ceil(cpu_quota())))))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# The app can read these, e.g. to size per-process caches and pools
+os.environ['WEB_CONCURRENCY'] = str(workers)
+os.environ['GUNICORN_THREADS'] = str(threads)
+preload_app = True
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '25'))
+
+
+class WorkerProcessMetrics():
+    """The process_* metrics the dashboards use, which multiprocess
+    mode lacks.  Each worker publishes its own, at most once a second,
+    as it starts a request; `/metrics` adds them up."""
+    def __init__(self):
+        from prometheus_client import Gauge
+        # Only the metric files are read; the default registry already
+        # has a process collector by these names.  'sum' keeps the CPU
+        # time of workers that have exited, so the total only grows.
+        self._cpu = Gauge('process_cpu_seconds_total',
+                          'Total user and system CPU time spent in seconds.',
+                          multiprocess_mode='sum', registry=None)
+        self._rss = Gauge('process_resident_memory_bytes',
+                          'Resident memory size in bytes.',
+                          multiprocess_mode='livesum', registry=None)
+        self._fds = Gauge('process_open_fds',
+                          'Number of open file descriptors.',
+                          multiprocess_mode='livesum', registry=None)
+        self._next_update = 0.0
+
+    def update(self):
+        now = time.monotonic()
+        if now < self._next_update:
+            return
+        self._next_update = now + 1
+        try:
+            with open('/proc/self/stat') as f:
+                # Fields from the state on, after the command name
+                fields = f.read().rpartition(')')[2].split()
+            fds = len(os.listdir('/proc/self/fd'))
+        except OSError:
+            return
+        # utime, stime and rss are fields 14, 15 and 24 of stat
+        self._cpu.set((int(fields[11]) + int(fields[12])) /
+                      os.sysconf('SC_CLK_TCK'))
+        self._rss.set(int(fields[21]) * os.sysconf('SC_PAGE_SIZE'))
+        self._fds.set(fds)
+
+
+def post_fork(server, worker):
+    worker.process_metrics = WorkerProcessMetrics()
+
+
+def pre_request(worker, req):
+    worker.process_metrics.update()
+
+
+def child_exit(server, worker):
+    # Stop reporting the live gauges of a worker that has exited
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
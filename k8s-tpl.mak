@@ -315,17 +315,30 @@ db: $(LOG_DIR)/db.repo.log cluster/awscred.yaml cluster/dynamodb-service-entry.y
 	$(KC) -n $(APP_NS) apply -f cluster/db-sm.yaml | tee -a $(LOG_DIR)/db.log
 	$(KC) -n $(APP_NS) apply -f cluster/db-vs.yaml | tee -a $(LOG_DIR)/db.log
 
+# Each Python service's image is built from its own directory, so it
+# gets a copy of the shared Gunicorn settings
+GUNICORN_CONFS=s1/gunicorn.conf.py s2/v1/gunicorn.conf.py s2/v1.1/gunicorn.conf.py s2/v2/gunicorn.conf.py s3/gunicorn.conf.py db/gunicorn.conf.py
+
+$(GUNICORN_CONFS): gunicorn.conf.py
+	cp $< $@
+
+# and the services that call the database service get the shared client
+DATASTORE_COPIES=s1/datastore.py s2/v1.1/datastore.py s3/datastore.py
+
+$(DATASTORE_COPIES): datastore.py
+	cp $< $@
+
 # Build & push the images up to the CR
 cri: $(LOG_DIR)/s1.repo.log $(LOG_DIR)/s2-$(S2_VER).repo.log $(LOG_DIR)/s3.repo.log $(LOG_DIR)/db.repo.log
 
 # Build the s1 service
-$(LOG_DIR)/s1.repo.log: s1/Dockerfile s1/app.py s1/requirements.txt
+$(LOG_DIR)/s1.repo.log: s1/Dockerfile s1/app.py s1/datastore.py s1/gunicorn.conf.py s1/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s1:$(APP_VER_TAG) s1 | tee $(LOG_DIR)/s1.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756s1:$(APP_VER_TAG) | tee $(LOG_DIR)/s1.repo.log
 
 # Build the s2 service
-$(LOG_DIR)/s2-$(S2_VER).repo.log: s2/$(S2_VER)/Dockerfile s2/$(S2_VER)/app.py s2/$(S2_VER)/requirements.txt
+$(LOG_DIR)/s2-$(S2_VER).repo.log: s2/$(S2_VER)/Dockerfile s2/$(S2_VER)/app.py $(wildcard s2/$(S2_VER)/cache.py) $(filter s2/$(S2_VER)/datastore.py,$(DATASTORE_COPIES)) s2/$(S2_VER)/gunicorn.conf.py s2/$(S2_VER)/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s2:$(S2_VER) s2/$(S2_VER) | tee $(LOG_DIR)/s2-$(S2_VER).img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756s2:$(S2_VER) | tee $(LOG_DIR)/s2-$(S2_VER).repo.log
@@ -335,17 +348,26 @@ $(LOG_DIR)/s2-$(S2_VER).repo.log: s2/$(S2_VER)/Dockerfile s2/$(S2_VER)/app.py s2
 # 	make -f k8s.mak --no-print-directory registry-login
 # 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s3:$(S3_VER) s3/$(S3_VER) | tee $(LOG_DIR)/s3-$(S3_VER).img.log
 # 	$(DK) push $(CREG)/$(REGID)/cmpt756s3:$(S3_VER) | tee $(LOG_DIR)/s3-$(S3_VER).repo.log	
-$(LOG_DIR)/s3.repo.log: s1/Dockerfile s3/app.py s3/requirements.txt
+$(LOG_DIR)/s3.repo.log: s1/Dockerfile s3/app.py s3/chunks.py s3/datastore.py s3/gunicorn.conf.py s3/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756s3:$(S3_VER) s3 | tee $(LOG_DIR)/s3.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756s3:$(S3_VER) | tee $(LOG_DIR)/s3.repo.log
 
 # Build the db service
-$(LOG_DIR)/db.repo.log: db/Dockerfile db/app.py db/requirements.txt
+$(LOG_DIR)/db.repo.log: db/Dockerfile db/app.py db/backend_metrics.py db/cache.py db/drivers.py db/fastjson.py db/gunicorn.conf.py db/hotkeys.py db/singleflight.py db/throttle.py db/requirements.txt
 	make -f k8s.mak --no-print-directory registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756db:$(APP_VER_TAG) db | tee $(LOG_DIR)/db.img.log
 	$(DK) push $(CREG)/$(REGID)/cmpt756db:$(APP_VER_TAG) | tee $(LOG_DIR)/db.repo.log
 
+# Build the asyncio (ASGI) variant of the db service, tagged `asgi`.
+# To deploy it, change the image tag in cluster/db.yaml to `cmpt756db:asgi`.
+db-asgi: $(LOG_DIR)/db-asgi.repo.log
+
+$(LOG_DIR)/db-asgi.repo.log: db/Dockerfile.asgi db/asgi.py db/aio_drivers.py db/backend_metrics.py db/cache.py db/drivers.py db/fastjson.py db/hotkeys.py db/singleflight.py db/throttle.py db/asgi-requirements.txt
+	make -f k8s.mak --no-print-directory registry-login
+	$(DK) build $(ARCH) -f db/Dockerfile.asgi -t $(CREG)/$(REGID)/cmpt756db:asgi db | tee $(LOG_DIR)/db-asgi.img.log
+	$(DK) push $(CREG)/$(REGID)/cmpt756db:asgi | tee $(LOG_DIR)/db-asgi.repo.log
+
 # Build the loader
 $(LOG_DIR)/loader.repo.log: loader/app.py loader/requirements.txt loader/Dockerfile registry-login
 	$(DK) build $(ARCH) -t $(CREG)/$(REGID)/cmpt756loader:$(LOADER_VER) loader  | tee $(LOG_DIR)/loader.img.log
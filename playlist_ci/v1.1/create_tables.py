@@ -55,6 +55,9 @@ def create_tables(url, region, access_key_id,
     ProvisionedThroughput is meaningless for local DynamoDB instances but
     required by the API.
 
+    The global secondary indexes let the database service's /query
+    route find songs by artist and users by email without a scan.
+
     These create_table() calls are asynchronous and so will run in parallel.
     """
     pt = dynamodb.create_table(
@@ -67,17 +70,34 @@ def create_tables(url, region, access_key_id,
     )
     mt = dynamodb.create_table(
         TableName=music,
-        AttributeDefinitions=[{
-            "AttributeName": "music_id", "AttributeType": "S"}],
+        AttributeDefinitions=[
+            {"AttributeName": "music_id", "AttributeType": "S"},
+            {"AttributeName": "Artist", "AttributeType": "S"},
+            {"AttributeName": "SongTitle", "AttributeType": "S"}],
         KeySchema=[{"AttributeName": "music_id", "KeyType": "HASH"}],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "Artist-index",
+            "KeySchema": [
+                {"AttributeName": "Artist", "KeyType": "HASH"},
+                {"AttributeName": "SongTitle", "KeyType": "RANGE"}],
+            "Projection": {"ProjectionType": "ALL"},
+            "ProvisionedThroughput": {
+                "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}}],
         ProvisionedThroughput={
             "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
     )
     ut = dynamodb.create_table(
         TableName=user,
-        AttributeDefinitions=[{
-            "AttributeName": "user_id", "AttributeType": "S"}],
+        AttributeDefinitions=[
+            {"AttributeName": "user_id", "AttributeType": "S"},
+            {"AttributeName": "email", "AttributeType": "S"}],
         KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}],
+        GlobalSecondaryIndexes=[{
+            "IndexName": "email-index",
+            "KeySchema": [{"AttributeName": "email", "KeyType": "HASH"}],
+            "Projection": {"ProjectionType": "ALL"},
+            "ProvisionedThroughput": {
+                "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}}],
         ProvisionedThroughput={
             "ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
     )
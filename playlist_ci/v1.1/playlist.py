@@ -59,6 +59,54 @@ class Playlist():
             # return r.status_code, item['playlist_name'], item["music_id_list"], item['music_list']
             return r.status_code, item['playlist_name'], item['music_id_list']
 
+    def read_range(self, playlist_id, offset, limit):
+        """Read `limit` songs of a playlist from index `offset` on.
+
+        Returns:
+            (int, list, int): status code, the songs, and the total
+            number of songs in the playlist
+        """
+        r = requests.get(
+            self._url + playlist_id,
+            params={'offset': offset, 'limit': limit},
+            headers={'Authorization': self._auth}
+            )
+        if r.status_code != 200:
+            return r.status_code, None, None
+        item = r.json()['Items'][0]
+        return r.status_code, item['music_id_list'], item['music_count']
+
+    def read_music(self, playlist_id):
+        """Read a playlist with `?expand=music`.
+
+        Returns:
+            (int, list): status code, and the playlist's songs in order,
+            each a music item or `{"music_id", "missing": True}`
+        """
+        r = requests.get(
+            self._url + playlist_id,
+            params={'expand': 'music'},
+            headers={'Authorization': self._auth}
+            )
+        if r.status_code != 200:
+            return r.status_code, None
+        return r.status_code, r.json()['Items'][0]['music_list']
+
+    def edit(self, playlist_id, ops):
+        """Apply a batch of add/remove/move ops with one PATCH.
+
+        Returns:
+            (int, list): status code, and the resulting music_id_list
+        """
+        r = requests.patch(
+            self._url + playlist_id,
+            json={'ops': ops},
+            headers={'Authorization': self._auth}
+            )
+        if r.status_code != 200:
+            return r.status_code, None
+        return r.status_code, r.json()['music_id_list']
+
     def delete(self, playlist_id):
         requests.delete(
             self._url + playlist_id,
@@ -163,6 +163,66 @@ def test_add_song_to_empty_playlist(mserv, playlist8):
     assert (trc == 200
         and playlist_name == playlist8[0]
         and music_id_list == ["0894ddc7-0c84-4f13-a037-ddcaa1134ec8"])
-         
-    
-    
\ No newline at end of file
+
+
+@pytest.fixture
+def playlist9(request):
+    dangling = str(uuid.uuid4())
+    return ('expanded', [dangling, str(uuid.uuid4()), dangling])
+
+def test_get_playlist_expand_music_dangling(mserv, playlist9):
+    trc, p_id = mserv.create(playlist9[0], playlist9[1])
+    assert trc == 200
+    trc, music_list = mserv.read_music(p_id)
+    assert (trc == 200
+            and [m['music_id'] for m in music_list] == playlist9[1]
+            and all(m['missing'] for m in music_list))
+    mserv.delete(p_id)
+    trc, music_list = mserv.read_music(p_id)
+    assert trc == 404
+
+
+@pytest.fixture
+def playlist10(request):
+    return ('edited', [str(uuid.uuid4()) for _ in range(3)])
+
+def test_edit_playlist(mserv, playlist10):
+    trc, p_id = mserv.create(playlist10[0], playlist10[1])
+    assert trc == 200
+    a, b, c = playlist10[1]
+    d = str(uuid.uuid4())
+    trc, music_id_list = mserv.edit(p_id, [
+        {'op': 'add', 'music_id': d, 'position': 1},
+        {'op': 'add', 'music_id': a},
+        {'op': 'remove', 'music_id': b},
+        {'op': 'move', 'music_id': c, 'position': 0}])
+    assert trc == 200 and music_id_list == [c, a, d]
+    trc, playlist_name, music_id_list = mserv.read(p_id)
+    assert trc == 200 and music_id_list == [c, a, d]
+    mserv.delete(p_id)
+
+
+@pytest.fixture
+def playlist11(request):
+    # More songs than one item holds by default, so stored in chunks
+    return ('chunked', [str(uuid.uuid4()) for _ in range(2500)])
+
+def test_chunked_playlist(mserv, playlist11):
+    trc, p_id = mserv.create(playlist11[0], playlist11[1])
+    assert trc == 200
+    trc, playlist_name, music_id_list = mserv.read(p_id)
+    assert trc == 200 and music_id_list == playlist11[1]
+    trc, music_id_list, count = mserv.read_range(p_id, 990, 20)
+    assert (trc == 200 and music_id_list == playlist11[1][990:1010]
+            and count == 2500)
+    song = str(uuid.uuid4())
+    trc, music_id_list = mserv.edit(p_id, [
+        {'op': 'add', 'music_id': song, 'position': 1000},
+        {'op': 'remove', 'music_id': playlist11[1][0]}])
+    assert trc == 200
+    expected = playlist11[1][1:1000] + [song] + playlist11[1][1000:]
+    trc, playlist_name, music_id_list = mserv.read(p_id)
+    assert trc == 200 and music_id_list == expected
+    mserv.delete(p_id)
+    trc, playlist_name, music_id_list = mserv.read(p_id)
+    assert trc == 404
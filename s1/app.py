@@ -5,6 +5,7 @@ Sample application---user service.
 
 # Standard library modules
 import logging
+import os
 import sys
 import time
 
@@ -17,29 +18,28 @@ from flask import Response
 import jwt
 
 from prometheus_flask_exporter import PrometheusMetrics
-
-import requests
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import simplejson as json
 
+# Local modules
+import datastore
+
 # The application
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'User process')
 
 bp = Blueprint('app', __name__)
 
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "update"
-    ]
-}
+db = datastore.DatastoreClient(miss_objtypes=['user'])
 
 
 @bp.route('/', methods=['GET'])
@@ -76,12 +76,9 @@ def update_user(user_id):
         lname = content['lname']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params={"objtype": "user", "objkey": user_id},
-        json={"email": email, "fname": fname, "lname": lname})
-    return (response.json())
+    response = db.update("user", user_id,
+                         {"email": email, "fname": fname, "lname": lname})
+    return datastore.relay(response)
 
 
 @bp.route('/', methods=['POST'])
@@ -98,13 +95,8 @@ def create_user():
         fname = content['fname']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][1]
-    response = requests.post(
-        url,
-        json={"objtype": "user",
-              "lname": lname,
-              "email": email,
-              "fname": fname})
+    response = db.write("user",
+                        {"lname": lname, "email": email, "fname": fname})
     return (response.json())
 
 
@@ -116,11 +108,8 @@ def delete_user(user_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    url = db['name'] + '/' + db['endpoint'][2]
-
-    response = requests.delete(url,
-                               params={"objtype": "user", "objkey": user_id})
-    return (response.json())
+    response = db.delete("user", user_id)
+    return datastore.relay(response)
 
 
 @bp.route('/<user_id>', methods=['GET'])
@@ -132,26 +121,32 @@ def get_user(user_id):
             json.dumps({"error": "missing auth"}),
             status=401,
             mimetype='application/json')
-    payload = {"objtype": "user", "objkey": user_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(url, params=payload)
-    return (response.json())
+    response = db.read("user", user_id)
+    return datastore.relay(response)
 
 
 @bp.route('/login', methods=['PUT'])
 def login():
     try:
         content = request.get_json()
-        uid = content['uid']
+        # Log in by user ID or by email
+        uid = content['uid'] if 'email' not in content else None
+        email = content.get('email')
     except Exception:
         return json.dumps({"message": "error reading parameters"})
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(url, params={"objtype": "user", "objkey": uid})
+    if email is not None:
+        response = db.query("user", "email-index", email)
+    else:
+        response = db.read("user", uid)
     data = response.json()
-    if len(data['Items']) > 0:
-        encoded = jwt.encode({'user_id': uid, 'time': time.time()},
-                             'secret',
-                             algorithm='HS256')
+    if not data.get('Items'):
+        return Response(json.dumps({"error": "User not found"}),
+                        status=404,
+                        mimetype='application/json')
+    uid = data['Items'][0]['user_id']
+    encoded = jwt.encode({'user_id': uid, 'time': time.time()},
+                         'secret',
+                         algorithm='HS256')
     return encoded
 
 
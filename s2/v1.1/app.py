@@ -5,6 +5,7 @@ Sample application---music service.
 
 # Standard library modules
 import logging
+import os
 import sys
 
 # Installed packages
@@ -13,33 +14,104 @@ from flask import Flask
 from flask import request
 from flask import Response
 
-from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_client import Counter
+from prometheus_client import Gauge
 
-import requests
+from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import simplejson as json
 
 # Local modules
+import datastore
+from cache import SizedTTLCache
 
 # The application
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'Music process')
 
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "update"
-    ]
-}
+db = datastore.DatastoreClient(miss_objtypes=['music'])
+
+# Worker processes started by gunicorn.conf.py
+web_concurrency = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# Music items read from the database service, keyed by music_id, as
+# (body, content type, item).  delete_song and write_orig_artist
+# invalidate the songs they change, but only in this process: other
+# Gunicorn workers and replicas see the change once their entry
+# expires.  A client whose next read goes to another worker would not
+# see its own write, so with several workers the cache is off unless
+# MUSIC_CACHE_BYTES asks for it.  Hit ratio: hits / (hits + misses).
+cache_hits = Counter('music_cache_hits', 'Music reads served from the cache')
+cache_misses = Counter('music_cache_misses',
+                       'Music reads that went to the database service')
+cache_evictions = Counter('music_cache_evictions',
+                          'Music items evicted to make room in the cache')
+cache_entries = Gauge('music_cache_entries', 'Music items in the cache',
+                      multiprocess_mode='livesum')
+cache_bytes = Gauge('music_cache_bytes',
+                    'Encoded size of the music items in the cache',
+                    multiprocess_mode='livesum')
+cache = SizedTTLCache(
+    int(os.getenv('MUSIC_CACHE_BYTES',
+                  str(16 * 1024 * 1024) if web_concurrency == 1 else '0')),
+    float(os.getenv('MUSIC_CACHE_TTL', '30')),
+    on_evict=cache_evictions.inc)
+if web_concurrency > 1 and not cache.maxbytes:
+    logging.warning(
+        '%d workers: the music cache is off; setting MUSIC_CACHE_BYTES '
+        'turns it on, but a worker may then serve a song up to '
+        'MUSIC_CACHE_TTL seconds old after a write through another',
+        web_concurrency)
+
 bp = Blueprint('app', __name__)
 
 
+def cache_changed():
+    cache_entries.set(len(cache))
+    cache_bytes.set(cache.nbytes)
+
+
+def read_song(music_id, auth):
+    '''
+    Return (entry, None), where entry is the song's cache entry (body,
+    content type, item), reading it from the database service on a
+    miss.  If the database service did not return the song, return
+    (None, response) instead.
+    '''
+    hit, entry = cache.get(music_id)
+    if hit:
+        cache_hits.inc()
+        return entry, None
+    cache_misses.inc()
+    token = cache.token()
+    response = db.read("music", music_id, auth=auth)
+    if response.status_code != 200:
+        return None, response
+    items = response.json()['Items']
+    if not items:
+        return None, response
+    body = response.content
+    entry = (body, response.headers.get('Content-Type'), items[0])
+    cache.put(music_id, entry, len(body), token)
+    cache_changed()
+    return entry, None
+
+
+def invalidate(music_id):
+    '''Call after every change to a song, once it has completed'''
+    cache.invalidate(music_id)
+    cache_changed()
+
+
 @bp.route('/health')
 @metrics.do_not_track()
 def health():
@@ -60,8 +132,30 @@ def list_all():
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    # list all songs here
-    return {}
+    # One page of the catalog; pass the returned Cursor back
+    # as `cursor` to get the next page
+    response = db.scan("music",
+                       limit=request.args.get('limit'),
+                       cursor=request.args.get('cursor'),
+                       auth=headers['Authorization'])
+    return datastore.relay(response)
+
+
+@bp.route('/artist/<artist>', methods=['GET'])
+def list_artist(artist):
+    headers = request.headers
+    # check header here
+    if 'Authorization' not in headers:
+        return Response(json.dumps({"error": "missing auth"}),
+                        status=401,
+                        mimetype='application/json')
+    # The artist's songs, by title, from the Artist-index; pages
+    # work as for list_all()
+    response = db.query("music", "Artist-index", artist,
+                        limit=request.args.get('limit'),
+                        cursor=request.args.get('cursor'),
+                        auth=headers['Authorization'])
+    return datastore.relay(response)
 
 
 @bp.route('/<music_id>', methods=['GET'])
@@ -72,13 +166,11 @@ def get_song(music_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    payload = {"objtype": "music", "objkey": music_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    entry, response = read_song(music_id, headers['Authorization'])
+    if entry is None:
+        return datastore.relay(response)
+    body, content_type, _ = entry
+    return Response(body, status=200, content_type=content_type)
 
 
 @bp.route('/', methods=['POST'])
@@ -96,14 +188,10 @@ def create_song():
         OrigArtist = content['OrigArtist'] if 'OrigArtist' in content else None
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][1]
-    payload = {"objtype": "music", "Artist": Artist, "SongTitle": SongTitle}
+    payload = {"Artist": Artist, "SongTitle": SongTitle}
     if OrigArtist is not None:
         payload["OrigArtist"] = OrigArtist
-    response = requests.post(
-        url,
-        json=payload,
-        headers={'Authorization': headers['Authorization']})
+    response = db.write("music", payload, auth=headers['Authorization'])
     return (response.json())
 
 
@@ -115,12 +203,9 @@ def delete_song(music_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    url = db['name'] + '/' + db['endpoint'][2]
-    response = requests.delete(
-        url,
-        params={"objtype": "music", "objkey": music_id},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db.delete("music", music_id, auth=headers['Authorization'])
+    invalidate(music_id)
+    return datastore.relay(response)
 
 
 @bp.route('/read_orig_artist/<music_id>', methods=['GET'])
@@ -131,19 +216,15 @@ def read_orig_artist(music_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    payload = {"objtype": "music", "objkey": music_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    if response.status_code != 200:
+    # The whole item is read, and cached, for get_song to share
+    entry, _ = read_song(music_id, headers['Authorization'])
+    if entry is None:
         response = {
             "Count": 0,
             "Items": []
         }
         return app.make_response((response, 404))
-    item = response.json()['Items'][0]
+    item = entry[2]
     oa = (item['OrigArtist'] if 'OrigArtist' in item
           else None)
     return {'OrigArtist': oa}
@@ -162,14 +243,10 @@ def write_orig_artist(music_id):
         OrigArtist = content['OrigArtist']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    payload = {"objtype": "music", "objkey": music_id}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params=payload,
-        json={"OrigArtist": OrigArtist},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db.update("music", music_id, {"OrigArtist": OrigArtist},
+                         auth=headers['Authorization'])
+    invalidate(music_id)
+    return datastore.relay(response)
 
 
 # All database calls will have this prefix.  Prometheus metric
@@ -0,0 +1,115 @@
+"""
+SFU CMPT 756
+Bounded in-process LRU cache with per-entry time-to-live, limited by
+the total size of its values.
+"""
+
+# Standard library modules
+import threading
+import time
+from collections import OrderedDict
+
+
+class SizedTTLCache():
+    """Thread-safe LRU cache whose entries also expire after `ttl`
+    seconds, holding values of at most `maxbytes` in all.
+
+    The caller gives the size of each value it stores, such as the
+    length of its encoding.  Readers that fill the cache from the
+    backend call `token()` before the backend read and pass the result
+    to `put()`.  If the key was invalidated in between, `put()` drops
+    the value, so a slow reader can never reinstate an item that a
+    concurrent write replaced.
+
+    Parameters
+    ----------
+    maxbytes: int
+        Maximum total size of the values. 0 disables the cache.
+    ttl: float
+        Seconds an entry stays valid after it is stored.
+    on_evict: callable
+        Called with no arguments each time an entry is evicted to
+        make room.
+    max_invalidated: int
+        Invalidations remembered individually; older ones are merged.
+    """
+    def __init__(self, maxbytes, ttl, on_evict=None, max_invalidated=1024):
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._max_invalidated = max_invalidated
+        self._lock = threading.Lock()
+        # key -> (expiry, size, value)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Sequence number of the most recent invalidation of each key.
+        # `_floor` is the largest sequence number forgotten from
+        # `_invalidated`.
+        self._seq = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        '''Total size of the values held'''
+        return self._bytes
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def token(self):
+        '''Return a token to pass to a later put()'''
+        with self._lock:
+            return self._seq
+
+    def get(self, key):
+        '''Return (True, value) on a hit and (False, None) on a miss'''
+        if not self.maxbytes:
+            return False, None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, _, value = entry
+            if expires <= now:
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, size, token):
+        '''Store `value`, of `size` bytes, unless `key` was invalidated
+        after `token` or the value alone exceeds the limit'''
+        if size > self.maxbytes:
+            return
+        evicted = 0
+        with self._lock:
+            if max(self._floor, self._invalidated.get(key, 0)) > token:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        if self._on_evict:
+            for _ in range(evicted):
+                self._on_evict()
+
+    def invalidate(self, key):
+        '''Drop `key` and refuse puts that started before this call'''
+        with self._lock:
+            self._seq += 1
+            if key in self._entries:
+                self._remove(key)
+            self._invalidated[key] = self._seq
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self._max_invalidated:
+                _, seq = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, seq)
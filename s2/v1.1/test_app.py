@@ -0,0 +1,139 @@
+"""
+Test that a song written through one Gunicorn worker reads back
+through another.
+
+As under gunicorn.conf.py, the app is imported once and forked into
+two worker processes, each with its own music cache.  The database
+service is stood in for by a dict that the workers share.  Run these
+tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+import multiprocessing
+import os
+
+# Installed packages
+import pytest
+import requests
+import simplejson as json
+
+os.environ['WEB_CONCURRENCY'] = '2'
+os.environ.pop('MUSIC_CACHE_BYTES', None)
+
+# Local modules
+import app  # noqa: E402
+import datastore  # noqa: E402
+from cache import SizedTTLCache  # noqa: E402
+
+AUTH = {'Authorization': 'Bearer A'}
+MUSIC_ID = '6ecfafd0-8a35-4af6-a9e2-cbd79b3abeea'
+SONG = {'music_id': MUSIC_ID, 'Artist': 'Taylor Swift',
+        'SongTitle': 'The Last Great American Dynasty',
+        'OrigArtist': 'Taylor Swift'}
+
+
+def answer(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body).encode()
+    return response
+
+
+class SharedDatastore():
+    '''Stands in for the database service's client, keeping the songs
+    in a dict shared between processes'''
+    def __init__(self, songs):
+        self.songs = songs
+
+    def read(self, objtype, objkey, auth=None, **kwargs):
+        item = self.songs.get(objkey)
+        return answer(200, {'Count': 1, 'Items': [item]} if item
+                      else {'Count': 0, 'Items': []})
+
+    def update(self, objtype, objkey, attrs, auth=None, **kwargs):
+        self.songs[objkey] = dict(self.songs.get(objkey, {}), **attrs)
+        return answer(200, {})
+
+
+def serve(conn):
+    '''Run one worker: answer each (method, path, body) from `conn`'''
+    client = app.app.test_client()
+    for method, path, body in iter(conn.recv, None):
+        response = client.open('/api/v1/music/' + path, method=method,
+                               json=body, headers=AUTH)
+        conn.send((response.status_code, response.get_json()))
+
+
+@pytest.fixture
+def workers(request, monkeypatch):
+    '''Return a function that forks the workers, after the test has set
+    up the app, and sends a request to one of them'''
+    context = multiprocessing.get_context('fork')
+    manager = context.Manager()
+    monkeypatch.setattr(app, 'db',
+                        SharedDatastore(manager.dict({MUSIC_ID: SONG})))
+    conns = []
+    processes = []
+
+    def call(worker, method, path, body=None):
+        while len(conns) < 2:
+            parent, child = context.Pipe()
+            process = context.Process(target=serve, args=(child,))
+            process.start()
+            conns.append(parent)
+            processes.append(process)
+        conns[worker].send((method, path, body))
+        return conns[worker].recv()
+    yield call
+    for conn, process in zip(conns, processes):
+        conn.send(None)
+        process.join()
+    manager.shutdown()
+
+
+def read_write_read(call):
+    path = 'read_orig_artist/' + MUSIC_ID
+    assert call(0, 'GET', path) == (200, {'OrigArtist': 'Taylor Swift'})
+    status, _ = call(1, 'PUT', 'write_orig_artist/' + MUSIC_ID,
+                     {'OrigArtist': 'Backxwash'})
+    assert status == 200
+    return call(0, 'GET', path)
+
+
+def test_cache_off_with_several_workers():
+    assert app.cache.maxbytes == 0
+
+
+def test_read_after_write_through_second_worker(workers):
+    assert read_write_read(workers) == (200, {'OrigArtist': 'Backxwash'})
+
+
+def test_cache_on_reads_stale(workers, monkeypatch):
+    # What MUSIC_CACHE_BYTES trades away with several workers
+    monkeypatch.setattr(app, 'cache', SizedTTLCache(1024 * 1024, 30))
+    assert read_write_read(workers) == (200, {'OrigArtist': 'Taylor Swift'})
+
+
+def test_missing_song(monkeypatch):
+    # The database service answers a miss with 200 {"Count": 0, ...}.
+    # The service answers 404 with the same body, once from the
+    # database service and then from the negative cache, so callers
+    # that look for an empty `Items` still find one.
+    calls = []
+
+    def request(method, url, **kwargs):
+        calls.append(url)
+        return answer(200, {'Count': 0, 'Items': []})
+    db = datastore.DatastoreClient(url='http://db',
+                                   misses=datastore.MissCache(10, 30),
+                                   miss_objtypes=['music'])
+    monkeypatch.setattr(db.session, 'request', request)
+    monkeypatch.setattr(app, 'db', db)
+    client = app.app.test_client()
+    missing = '00000000-0000-4000-8000-000000000000'
+    for path in (missing, 'read_orig_artist/' + missing) * 2:
+        response = client.get('/api/v1/music/' + path, headers=AUTH)
+        assert response.status_code == 404
+        assert response.get_json() == {'Count': 0, 'Items': []}
+    assert len(calls) == 1
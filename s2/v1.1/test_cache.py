@@ -0,0 +1,45 @@
+"""
+Test the invalidation of the music cache.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+
+# Installed packages
+
+# Local modules
+from cache import SizedTTLCache
+
+
+def test_invalidate_drops_entry():
+    cache = SizedTTLCache(100, 30)
+    cache.put('a', b'song', 4, cache.token())
+    assert cache.get('a') == (True, b'song') and cache.nbytes == 4
+    cache.invalidate('a')
+    assert cache.get('a') == (False, None) and cache.nbytes == 0
+
+
+def test_read_in_flight_not_reinstated():
+    cache = SizedTTLCache(100, 30, max_invalidated=1)
+    token = cache.token()
+    cache.invalidate('a')
+    cache.invalidate('b')
+    # 'a' is no longer remembered by key, but still refuses the read
+    # that began before its invalidation
+    cache.put('a', b'old', 3, token)
+    cache.put('b', b'old', 3, token)
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (False, None)
+    cache.put('a', b'new', 3, cache.token())
+    assert cache.get('a') == (True, b'new')
+
+
+def test_size_limit():
+    evictions = []
+    cache = SizedTTLCache(10, 30, on_evict=lambda: evictions.append(1))
+    cache.put('a', b'aaaaaa', 6, cache.token())
+    cache.put('b', b'bbbbbb', 6, cache.token())
+    assert cache.get('a') == (False, None) and len(evictions) == 1
+    cache.put('c', b'c' * 11, 11, cache.token())
+    assert cache.get('c') == (False, None) and cache.nbytes == 6
@@ -16,6 +16,8 @@ from flask import Response
 import urllib.parse
 
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import requests
 
@@ -25,7 +27,11 @@ import simplejson as json
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'Music process')
 
 db = {
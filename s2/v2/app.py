@@ -5,6 +5,7 @@ Sample application---music service.
 
 # Standard library modules
 import logging
+import os
 import random
 import sys
 
@@ -15,6 +16,8 @@ from flask import request
 from flask import Response
 
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import requests
 
@@ -28,7 +31,11 @@ PERCENT_ERROR = 50
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'Music process')
 
 db = {
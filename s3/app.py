@@ -4,9 +4,16 @@ Sample application---playlist service.
 """
 
 # Standard library modules
+import base64
 import logging
+import os
 import random
 import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Installed packages
 from flask import Blueprint
@@ -15,33 +22,113 @@ from flask import request
 from flask import Response
 
 from prometheus_flask_exporter import PrometheusMetrics
-
-import requests
+from prometheus_flask_exporter.multiprocess import (
+    GunicornInternalPrometheusMetrics)
 
 import simplejson as json
 
 # Local modules
+import chunks
+import datastore
+from chunks import ChunkedList
 
 # Integer value 0 <= v < 100, denoting proportion of
 # calls to `get_song` to return 500 from
 PERCENT_ERROR = 50
 
+# Attempts at a conditional remove before giving up on a playlist
+# that keeps changing underneath us
+REMOVE_RETRIES = 3
+
+# Operations of a PATCH, and the most one request may hold
+EDIT_OPS = ('add', 'remove', 'move')
+EDIT_MAX_OPS = 1000
+# Attempts at a PATCH's conditional write, with jittered backoff of up
+# to EDIT_BACKOFF_BASE * 2**attempt seconds between them
+EDIT_RETRIES = 8
+EDIT_BACKOFF_BASE = 0.01
+
+# Songs fetched per batch read by `?expand=music`, and batch reads in
+# flight at once across the process
+EXPAND_BATCH_SIZE = 500
+EXPAND_CONCURRENCY = int(os.getenv('PLAYLIST_EXPAND_CONCURRENCY', '4'))
+
+# Each playlist item also holds a hydrated view of its songs,
+# `music_list`, one entry per `music_id_list` entry in the same order,
+# holding these attributes of the song.  Every change to
+# `music_id_list` changes `music_list` in the same update and adds one
+# to `music_version`; `music_list_at` is when the songs were last read.
+# A chunk item holds the view of its own songs in the same way.
+# Changes to the songs themselves do not reach the view, which is only
+# as fresh as its age allows.
+VIEW_FIELDS = ('Artist', 'SongTitle')
+VERSION_BUMP = {"op": "add", "attr": "music_version", "value": 1}
+# Seconds after which a read of the view refreshes it from the music
+# table in the background, picking up changed and deleted songs
+VIEW_REFRESH_AGE = float(os.getenv('PLAYLIST_VIEW_REFRESH_AGE', '20'))
+# Seconds after which the view is too old to serve: a read instead
+# reads the songs from the music table before answering.  This bounds
+# how long a deleted song shows in expanded reads.
+VIEW_MAX_AGE = float(os.getenv('PLAYLIST_VIEW_MAX_AGE', '60'))
+# What a plain read of a playlist returns, and whether it is chunked
+PLAYLIST_FIELDS = ['playlist_name', 'music_id_list', 'music_ids_packed',
+                   'chunks']
+
+# How playlist and chunk items store their `music_id_list`
+# (PLAYLIST_MUSIC_ID_FORMAT):
+# - 'list': a list of the ID strings, as before.
+# - 'packed': `music_ids_packed`, a Binary attribute of the IDs' 16-byte
+#   UUIDs, concatenated: 2.25 times smaller than the list.
+# - 'packed-zlib': the same, compressed with zlib when that makes it
+#   smaller.  Random (version 4) UUIDs hardly compress; IDs sharing
+#   bytes, such as time-based ones, do.
+# The first byte of a packed value says whether it is compressed.
+# Items are read in whichever format they have, and each write uses
+# the configured one.  A list holding an ID that is not a UUID in its
+# canonical form is stored as a list.  Songs are added and removed by
+# a read and a conditional write when packed, since a Binary attribute
+# cannot be appended to server-side.
+MUSIC_ID_FORMAT = os.getenv('PLAYLIST_MUSIC_ID_FORMAT', 'list')
+PACKED_RAW = 0
+PACKED_ZLIB = 1
+
+# A playlist of more than CHUNK_SIZE songs keeps them in chunk items of
+# at most CHUNK_SIZE songs each (see chunks.py), under the keys
+# "<playlist_id>#<chunk key>".  Its head lists them, in order, in
+# `chunks`, as {"chunk": key, "count": songs, "bloom": filter}, in place
+# of `music_id_list`; each chunk holds the `music_id_list` and
+# `music_list` of its songs.  The Bloom filter (chunks.bloom()), a
+# Binary attribute of about a byte per song, lets add_song read only
+# the chunks that may already hold the song.  Smaller playlists keep their songs in the
+# one item, as before.  A playlist stays chunked once it has been.
+CHUNK_SIZE = int(os.getenv('PLAYLIST_CHUNK_SIZE', '1000'))
+# Attempts at reading a chunked playlist whose chunks keep being
+# replaced by edits
+CHUNK_READ_RETRIES = 3
+
 # The application
 
 app = Flask(__name__)
 
-metrics = PrometheusMetrics(app)
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    # Started by gunicorn.conf.py: `/metrics` reports all the workers
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 metrics.info('app_info', 'Playlist process')
 
-db = {
-    "name": "http://cmpt756db:30002/api/v1/datastore",
-    "endpoint": [
-        "read",
-        "write",
-        "delete",
-        "update"
-    ]
-}
+# Songs are created by the music service, whose writes could not end
+# this process's entries for them, so only playlist misses are cached
+db = datastore.DatastoreClient(miss_objtypes=['playlist'])
+
+# Threads are only started once batch reads are submitted, so this is
+# safe to create before Gunicorn forks
+expand_pool = ThreadPoolExecutor(max_workers=EXPAND_CONCURRENCY)
+# Background view refreshes, one at a time.  They use expand_pool
+# themselves, so they must not run on it.
+refresh_pool = ThreadPoolExecutor(max_workers=1)
+refreshing = set()
+refreshing_lock = threading.Lock()
 
 bp = Blueprint('app', __name__)
 
@@ -65,13 +152,438 @@ def get_playlist(playlist_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    payload = {"objtype": "playlist", "objkey": playlist_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    expand = request.args.get('expand') == 'music'
+    # `?offset=&limit=` reads a range of the songs, adding their total
+    # as `music_count`
+    ranged = 'offset' in request.args or 'limit' in request.args
+    try:
+        offset, limit = page_args(request.args)
+    except ValueError as e:
+        return Response(json.dumps({"error": str(e)}),
+                        status=400,
+                        mimetype='application/json')
+    fields = None if expand else PLAYLIST_FIELDS
+    response = db.read("playlist", playlist_id, fields=fields,
+                       auth=headers['Authorization'])
+    if response.status_code != 200:
+        return datastore.relay(response)
+    # A plain read of a whole unchunked playlist is relayed as it is.
+    # Quotes inside JSON strings are escaped, so this only matches the
+    # attribute name.
+    if not (expand or ranged or b'"chunks":' in response.content or
+            b'"music_ids_packed":' in response.content):
+        return datastore.relay(response)
+    result = response.json()
+    unpack(result['Items'][0])
+    if 'chunks' in result['Items'][0]:
+        return read_chunked(playlist_id, result, fields, offset, limit,
+                            expand, headers['Authorization'])
+    if not expand:
+        return page(result, offset, limit) if ranged else result
+    # One read serves the whole page while the view is sound
+    playlist = result['Items'][0]
+    version = playlist.pop('music_version', None)
+    read_at = playlist.pop('music_list_at', 0)
+    music_id_list = playlist.get('music_id_list', [])
+    age = time.time() - read_at
+    if view_matches(playlist) and age <= VIEW_MAX_AGE:
+        if age > VIEW_REFRESH_AGE:
+            schedule_refresh(playlist_id, version, music_id_list, None,
+                             headers['Authorization'])
+        return page(result, offset, limit) if ranged else result
+    # No view yet, as for a playlist created before views, or one too
+    # old to serve: build one
+    music_list = expand_music(music_id_list, headers['Authorization'])
+    if music_list is None:
+        return Response(json.dumps({"error": "Failed to retrieve music"}),
+                        status=502,
+                        mimetype='application/json')
+    playlist['music_list'] = music_list
+    schedule_refresh(playlist_id, version, music_id_list, music_list,
+                     headers['Authorization'])
+    return page(result, offset, limit) if ranged else result
+
+def pack_ids(music_ids):
+    '''Return `music_ids` packed as MUSIC_ID_FORMAT says, or None if
+    one of them is not a UUID in canonical form'''
+    packed = bytearray([PACKED_RAW])
+    for music_id in music_ids:
+        try:
+            value = uuid.UUID(music_id)
+        except (AttributeError, TypeError, ValueError):
+            return None
+        if str(value) != music_id:
+            return None
+        packed += value.bytes
+    if MUSIC_ID_FORMAT == 'packed-zlib':
+        compressed = zlib.compress(bytes(packed[1:]))
+        if len(compressed) + 1 < len(packed):
+            return bytes([PACKED_ZLIB]) + compressed
+    return bytes(packed)
+
+def unpack_ids(encoded):
+    '''Return the music IDs of a packed value, as read: in base64'''
+    packed = base64.b64decode(encoded)
+    if packed[0] == PACKED_ZLIB:
+        ids = zlib.decompress(packed[1:])
+    else:
+        ids = packed[1:]
+    return [str(uuid.UUID(bytes=ids[i:i + 16]))
+            for i in range(0, len(ids), 16)]
+
+def id_attrs(music_id_list):
+    '''Return the attributes that store `music_id_list` in the
+    configured format, and the update ops dropping the other format'''
+    packed = pack_ids(music_id_list) if MUSIC_ID_FORMAT != 'list' else None
+    if packed is None:
+        return ({"music_id_list": music_id_list},
+                [{"op": "remove", "attr": "music_ids_packed"}])
+    return ({"music_ids_packed": datastore.binary(packed)},
+            [{"op": "remove", "attr": "music_id_list"}])
+
+def unpack(item):
+    '''Give a playlist or chunk item read from the database its
+    `music_id_list`, in place of any `music_ids_packed`'''
+    if 'music_ids_packed' in item:
+        item['music_id_list'] = unpack_ids(item.pop('music_ids_packed'))
+    return item
+
+def page_args(args):
+    '''Return the `offset` and `limit` query parameters of a read; a
+    limit of None means all the songs from the offset on'''
+    offset = int(args.get('offset', 0))
+    limit = args.get('limit')
+    limit = None if limit is None else int(limit)
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError('offset and limit must not be negative')
+    return offset, limit
+
+def page(result, offset, limit):
+    '''Cut the songs of the playlist read in `result` down to the
+    range asked for, adding their total as `music_count`'''
+    playlist = result['Items'][0]
+    music_id_list = playlist.get('music_id_list', [])
+    end = None if limit is None else offset + limit
+    playlist['music_count'] = len(music_id_list)
+    playlist['music_id_list'] = music_id_list[offset:end]
+    if 'music_list' in playlist:
+        playlist['music_list'] = playlist['music_list'][offset:end]
+    return result
+
+def read_chunked(playlist_id, result, fields, offset, limit, expand, auth):
+    '''
+    Return the read of a chunked playlist, whose head is in `result`,
+    with the songs from `offset` on, up to `limit` of them, and their
+    `music_list` if `expand`.
+
+    Only the chunks holding those songs are read.  The songs of chunks
+    stored without a view, or whose view is older than VIEW_MAX_AGE,
+    are read from the music table, and those views are rebuilt in the
+    background.
+    '''
+    for _ in range(CHUNK_READ_RETRIES):
+        playlist = result['Items'][0]
+        layout = playlist.pop('chunks', [])
+        spans = chunks.locate([c['count'] for c in layout], offset, limit)
+        items, error = read_chunks(
+            playlist_id, [layout[i] for i, _, _ in spans], auth)
+        if items is not None or error is not None:
+            break
+        # An edit has replaced chunks since the head was read
+        response = db.read("playlist", playlist_id, fields=fields,
+                           consistent=True, auth=auth)
+        if response.status_code != 200:
+            return datastore.relay(response)
+        result = response.json()
+    else:
+        return Response(json.dumps({"error": "Concurrent playlist updates"}),
+                        status=409,
+                        mimetype='application/json')
+    if error is not None:
+        return error
+    for attr in ('music_version', 'music_list_at'):
+        playlist.pop(attr, None)
+    music_id_list = []
+    music_list = []
+    now = time.time()
+    for (i, start, end), item in zip(spans, items):
+        music_id_list.extend(item['music_id_list'][start:end])
+        if not expand:
+            continue
+        matches = view_matches(item)
+        age = now - item.get('music_list_at', 0)
+        if matches and age <= VIEW_MAX_AGE:
+            music_list.extend(item['music_list'][start:end])
+        else:
+            music_list.extend([None] * (end - start))
+        if not matches or age > VIEW_REFRESH_AGE:
+            # A chunk has no music_version, so its view is stored
+            # unless the chunk has been deleted
+            schedule_refresh(chunk_id(playlist_id, layout[i]['chunk']),
+                             None, item['music_id_list'], None, auth)
+    playlist['music_id_list'] = music_id_list
+    playlist['music_count'] = sum(c['count'] for c in layout)
+    if expand:
+        unknown = [m for m, e in zip(music_id_list, music_list) if e is None]
+        if unknown:
+            entries = expand_music(unknown, auth)
+            if entries is None:
+                return Response(
+                    json.dumps({"error": "Failed to retrieve music"}),
+                    status=502,
+                    mimetype='application/json')
+            entries = iter(entries)
+            music_list = [e or next(entries) for e in music_list]
+        playlist['music_list'] = music_list
+    return result
+
+def chunk_id(playlist_id, key):
+    '''Return the key of a playlist's chunk item'''
+    return playlist_id + '#' + key
+
+def read_chunks(playlist_id, layout, auth):
+    '''
+    Read the chunk items listed in `layout`, a part of a head's
+    `chunks`.  Return (items, None), in order; (None, None) if an edit
+    has deleted one since the head was read; or (None, response) for
+    the error to return.
+    '''
+    if not layout:
+        return [], None
+    response = db.batch_read(
+        "playlist", [chunk_id(playlist_id, c['chunk']) for c in layout],
+        auth=auth)
+    if response.status_code == 200:
+        result = response.json()
+        if result.get('Missing'):
+            return None, None
+        if not result.get('Unprocessed'):
+            return [unpack(item) for item in result['Items']], None
+    return None, Response(json.dumps({"error": "Failed to retrieve playlist"}),
+                          status=502,
+                          mimetype='application/json')
+
+def discard_chunks(playlist_id, keys, auth):
+    '''Delete chunk items that no head lists.  One left behind by a
+    failure only takes up space.'''
+    if keys:
+        db.batch_delete("playlist",
+                        [chunk_id(playlist_id, k) for k in keys],
+                        auth=auth)
+
+def chunk_entry(key, music_ids):
+    '''Return the entry of a head's `chunks` for a chunk'''
+    return {"chunk": key, "count": len(music_ids),
+            "bloom": datastore.binary(chunks.bloom(music_ids))}
+
+def chunk_bloom(entry):
+    '''Return the Bloom filter of an entry of a head's `chunks` as
+    read, or None for a chunk stored without one'''
+    return base64.b64decode(entry['bloom']) if 'bloom' in entry else None
+
+def kept_entry(entry):
+    '''Return an entry of a head's `chunks` as read, to write back'''
+    entry = dict(entry)
+    if 'bloom' in entry:
+        entry['bloom'] = {"$binary": entry['bloom']}
+    return entry
+
+def store_chunks(playlist_id, playlist, songs, views, auth,
+                 views_at=None):
+    '''
+    Write the chunks of `songs`, a ChunkedList, that are not stored
+    yet, then switch the head `playlist` to them if it is unchanged
+    since it was read.  `views` maps music IDs to the view entries
+    already known, read from the music table at `views_at` (default:
+    now); the others are read from the music table.
+
+    Return (music_id_list, None) once stored, (None, None) if another
+    edit changed the playlist first, or (None, response) for the error
+    to return.
+    '''
+    layout = []
+    pending = []
+    for key, music_ids in songs.chunks():
+        if key is None:
+            key = chunks.new_chunk_key()
+            pending.append((key, music_ids))
+        layout.append(chunk_entry(key, music_ids))
+    error = write_chunks(playlist_id, pending, views, auth, views_at)
+    if error is not None:
+        return None, error
+    stored, error = switch_chunks(playlist_id, playlist, layout,
+                                  [key for key, _ in pending],
+                                  songs.replaced, auth)
+    if stored is None:
+        return None, error
+    return songs.music_ids(), None
+
+def write_chunks(playlist_id, pending, views, auth, views_at=None):
+    '''
+    Write the chunk items `pending`, as (key, music_ids), with the
+    views of their songs, as store_chunks() describes.  Return None
+    once all are written, or the error response to return, having
+    deleted those that were.
+    '''
+    unknown = [m for _, music_ids in pending for m in music_ids
+               if m not in views]
+    music_list = expand_music(unknown, auth) if unknown else []
+    # Without the songs, the chunk's view is built when it is read
+    if music_list is not None:
+        views.update((e['music_id'], e) for e in music_list)
+
+    now = int(time.time())
+    views_at = now if views_at is None else min(views_at, now)
+
+    def write(chunk):
+        key, music_ids = chunk
+        attrs, _ = id_attrs(music_ids)
+        if all(m in views for m in music_ids):
+            attrs["music_list"] = [views[m] for m in music_ids]
+            complete = not any('unavailable' in e
+                               for e in attrs["music_list"])
+        else:
+            attrs["music_list"] = []
+            complete = False
+        attrs["music_list_at"] = views_at if complete else 0
+        return db.update("playlist", chunk_id(playlist_id, key), attrs,
+                         auth=auth)
+
+    if len(pending) > 1:
+        responses = list(expand_pool.map(write, pending))
+    else:
+        responses = [write(chunk) for chunk in pending]
+    written = [key for (key, _), r in zip(pending, responses)
+               if r.status_code == 200]
+    if len(written) < len(pending):
+        discard_chunks(playlist_id, written, auth)
+        return Response(json.dumps({"error": "Failed to store playlist"}),
+                        status=502,
+                        mimetype='application/json')
+    return None
+
+def switch_chunks(playlist_id, playlist, layout, written, replaced, auth):
+    '''
+    Switch the head `playlist` to the chunks `layout`, if it is
+    unchanged since it was read, then delete the chunk items it no
+    longer lists, `replaced`.  If it cannot, delete the new chunk items
+    `written` instead.  Return (layout, None) once switched, or as
+    store_chunks() does.
+    '''
+    ops = [VERSION_BUMP]
+    if 'chunks' not in playlist:
+        # The songs move out of the head into chunks
+        ops.extend({"op": "remove", "attr": attr}
+                   for attr in ('music_id_list', 'music_ids_packed',
+                                'music_list', 'music_list_at'))
+    response = db.update("playlist", playlist_id, {"chunks": layout},
+                         ops=ops,
+                         condition=unchanged_since(
+                             playlist.get('music_version')),
+                         auth=auth)
+    if response.status_code != 200:
+        discard_chunks(playlist_id, written, auth)
+        if response.status_code == 409:
+            return None, None
+        return None, datastore.relay(response)
+    discard_chunks(playlist_id, replaced, auth)
+    return layout, None
+
+def view_matches(playlist):
+    '''Return whether the playlist's `music_list` lists the songs of
+    its `music_id_list`'''
+    music_list = playlist.get('music_list')
+    return (music_list is not None and
+            [e['music_id'] for e in music_list] ==
+            playlist.get('music_id_list', []))
+
+def song_entry(music_id, song=None, unavailable=False):
+    '''Return the view's entry for a song, given the music item, or
+    None if the song does not exist'''
+    if unavailable:
+        return {"music_id": music_id, "unavailable": True}
+    if song is None:
+        return {"music_id": music_id, "missing": True}
+    entry = {"music_id": music_id}
+    entry.update((f, song[f]) for f in VIEW_FIELDS if f in song)
+    return entry
+
+def unchanged_since(version):
+    '''Return the update conditions that the playlist exists and its
+    songs are as they were at `music_version` `version`'''
+    if version is None:
+        unchanged = {"attr": "music_version", "cmp": "not_exists"}
+    else:
+        unchanged = {"attr": "music_version", "cmp": "eq", "value": version}
+    return [{"attr": "playlist_id", "cmp": "exists"}, unchanged]
+
+def schedule_refresh(playlist_id, version, music_id_list, music_list, auth):
+    '''Have refresh_view() run in the background, unless it already is
+    for this playlist'''
+    with refreshing_lock:
+        if playlist_id in refreshing:
+            return
+        refreshing.add(playlist_id)
+    refresh_pool.submit(refresh_view, playlist_id, version, music_id_list,
+                        music_list, auth)
+
+def refresh_view(playlist_id, version, music_id_list, music_list, auth):
+    '''
+    Store `music_list` as the playlist's view, reading it afresh from
+    the music table if None, unless the playlist's songs have changed
+    since `version` was read.  `playlist_id` may also be the key of a
+    chunk item, whose `version` is None.
+    '''
+    try:
+        if music_list is None:
+            music_list = expand_music(music_id_list, auth)
+            if music_list is None:
+                return
+        # A view with songs that could not be read is refreshed again
+        # on its next read
+        complete = not any('unavailable' in e for e in music_list)
+        db.update("playlist", playlist_id,
+                  {"music_list": music_list,
+                   "music_list_at": int(time.time()) if complete else 0},
+                  condition=unchanged_since(version),
+                  auth=auth)
+    except Exception:
+        logging.exception('Refreshing the view of playlist %s', playlist_id)
+    finally:
+        with refreshing_lock:
+            refreshing.discard(playlist_id)
+
+def expand_music(music_ids, auth):
+    """Return the view's entries for `music_ids` (see song_entry()),
+    in order, reading each distinct song once.
+
+    The songs are read with batch reads of up to EXPAND_BATCH_SIZE,
+    which run in parallel.  An ID without a song is listed as
+    `{"music_id": id, "missing": true}`, or with `"unavailable": true`
+    if the database service could not read it in time.  Return None if
+    a batch read fails.
+    """
+    unique_ids = list(dict.fromkeys(music_ids))
+    batches = [unique_ids[i:i + EXPAND_BATCH_SIZE]
+               for i in range(0, len(unique_ids), EXPAND_BATCH_SIZE)]
+
+    def read(batch):
+        return db.batch_read("music", batch, auth=auth)
+
+    if len(batches) > 1:
+        responses = list(expand_pool.map(read, batches))
+    else:
+        responses = [read(batch) for batch in batches]
+    songs = {}
+    unavailable = set()
+    for response in responses:
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        songs.update((item['music_id'], item) for item in result['Items'])
+        unavailable.update(result.get('Unprocessed', []))
+    return [song_entry(m, songs.get(m), m in unavailable)
+            for m in music_ids]
 
 @bp.route('/', methods=['POST'])
 def create_playlist():
@@ -87,13 +599,42 @@ def create_playlist():
         music_id_list = content['music_id_list']
     except Exception:
         return Response(json.dumps({"message": "error reading arguments"}), status=400)
-    url = db['name'] + '/' + db['endpoint'][1]
-    response = requests.post(
-        url,
-        json={"objtype": "playlist", "playlist_name": playlist_name, "music_id_list": music_id_list},
-        headers={'Authorization': headers['Authorization']})
+    if len(music_id_list) > CHUNK_SIZE:
+        return create_chunked(playlist_name, music_id_list,
+                              headers['Authorization'])
+    playlist, _ = id_attrs(music_id_list)
+    playlist.update({"playlist_name": playlist_name,
+                     "music_version": 0})
+    music_list = expand_music(music_id_list, headers['Authorization'])
+    # Without the songs, the first expanded read builds the view
+    if music_list is not None:
+        complete = not any('unavailable' in e for e in music_list)
+        playlist["music_list"] = music_list
+        playlist["music_list_at"] = int(time.time()) if complete else 0
+    response = db.write("playlist", playlist, auth=headers['Authorization'])
     return (response.json())
 
+def create_chunked(playlist_name, music_id_list, auth):
+    '''Create a playlist too large for one item: its head, with no
+    songs, and then its chunks'''
+    playlist = {"playlist_name": playlist_name,
+                "music_version": 0,
+                "chunks": []}
+    response = db.write("playlist", playlist, auth=auth)
+    if response.status_code != 200:
+        return datastore.relay(response)
+    result = response.json()
+    music_id_list, error = store_chunks(
+        result['playlist_id'], playlist,
+        ChunkedList.split(music_id_list, CHUNK_SIZE), {}, auth)
+    if music_id_list is None:
+        db.delete("playlist", result['playlist_id'], auth=auth)
+        return error or Response(
+            json.dumps({"error": "Concurrent playlist updates"}),
+            status=409,
+            mimetype='application/json')
+    return result
+
 @bp.route('/<playlist_id>', methods=['DELETE'])
 def delete_playlist(playlist_id):
     headers = request.headers
@@ -102,12 +643,17 @@ def delete_playlist(playlist_id):
         return Response(json.dumps({"error": "missing auth"}),
                         status=401,
                         mimetype='application/json')
-    url = db['name'] + '/' + db['endpoint'][2]
-    response = requests.delete(
-        url,
-        params={"objtype": "playlist", "objkey": playlist_id},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db.read("playlist", playlist_id, fields=["chunks"],
+                       auth=headers['Authorization'])
+    layout = []
+    if response.status_code == 200:
+        layout = response.json()['Items'][0].get('chunks', [])
+    response = db.delete("playlist", playlist_id,
+                         auth=headers['Authorization'])
+    if response.status_code == 200:
+        discard_chunks(playlist_id, [c['chunk'] for c in layout],
+                       headers['Authorization'])
+    return datastore.relay(response)
 
 @bp.route('playlist-name/<playlist_id>', methods=['PUT'])
 def update_playlist_name(playlist_id):
@@ -127,13 +673,10 @@ def update_playlist_name(playlist_id):
         playlist_name = content['playlist_name']
     except Exception:
         return json.dumps({"message": "error reading arguments"})
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params={"objtype": "playlist", "objkey": playlist_id},
-        json={"playlist_name": playlist_name},
-        headers={'Authorization': headers['Authorization']})
-    return (response.json())
+    response = db.update("playlist", playlist_id,
+                         {"playlist_name": playlist_name},
+                         auth=headers['Authorization'])
+    return datastore.relay(response)
 
 @bp.route('/add_song', methods=['PUT'])
 def add_music_to_playlist():
@@ -151,27 +694,69 @@ def add_music_to_playlist():
         return Response(json.dumps({"error": "Unable to get params"}),
                     status=400,
                     mimetype='application/json')
-    payload = {"objtype": "playlist", "objkey": playlist_id}
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
-    if response.status_code != 200:
-        return Response(json.dumps({"error": "Failed to retrieve playlist"}),
-                        status=502,
-                        mimetype='application/json')
-    items = response.json()
-    music_id_list = items['Items'][0]['music_id_list']
-    if music_id not in music_id_list:
-        music_id_list.append(music_id)
-    payload = {"objtype": "playlist", "objkey": playlist_id}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params=payload,
-        json={"music_id_list": music_id_list})
-    return (response.json())
+    auth = headers['Authorization']
+
+    def append(playlist):
+        if 'chunks' in playlist:
+            return append_chunked(playlist_id, playlist, music_id, auth)
+        return edit_single(playlist_id, playlist,
+                           [{"op": "add", "music_id": music_id}], auth)
+
+    # The songs of a chunked playlist are not in its head, so tell one
+    # by the head before writing.  A read that misses a recent change
+    # only costs the fallback below.
+    response = db.read("playlist", playlist_id,
+                       fields=(None if MUSIC_ID_FORMAT != 'list'
+                               else ['chunks', 'music_version']),
+                       auth=auth)
+    chunked = (response.status_code == 200 and
+               'chunks' in response.json()['Items'][0])
+    if chunked or MUSIC_ID_FORMAT != 'list':
+        _, error = retry_edit(playlist_id, append, auth, response)
+        return error or {}
+    song = db.read("music", music_id, fields=VIEW_FIELDS,
+                   auth=headers['Authorization'])
+    if song.status_code == 200:
+        entry = song_entry(music_id, song.json()['Items'][0])
+    else:
+        entry = song_entry(music_id, unavailable=song.status_code != 404)
+    # Append server-side, only if the playlist exists, is neither
+    # chunked nor packed, has room and does not already hold the song,
+    # so concurrent adds cannot lose each other
+    ops = [{"op": "append",
+            "attr": "music_id_list",
+            "values": [music_id]},
+           {"op": "append",
+            "attr": "music_list",
+            "values": [entry]},
+           VERSION_BUMP]
+    if 'unavailable' in entry:
+        ops.append({"op": "set", "attr": "music_list_at", "value": 0})
+    response = db.update(
+        "playlist", playlist_id,
+        ops=ops,
+        condition=[{"attr": "playlist_id", "cmp": "exists"},
+                   {"attr": "chunks", "cmp": "not_exists"},
+                   {"attr": "music_ids_packed", "cmp": "not_exists"},
+                   {"attr": "music_id_list",
+                    "index": CHUNK_SIZE - 1,
+                    "cmp": "not_exists"},
+                   {"attr": "music_id_list",
+                    "cmp": "not_contains",
+                    "value": music_id}],
+        auth=headers['Authorization'])
+    if response.status_code != 409:
+        return datastore.relay(response)
+    # The condition failed: the song is already present (nothing to
+    # do), the playlist does not exist, or it is chunked, packed or full
+    response = db.read("playlist", playlist_id, consistent=True,
+                       auth=headers['Authorization'])
+    if response.status_code == 200:
+        playlist = unpack(response.json()['Items'][0])
+        if music_id in playlist.get('music_id_list', []):
+            return {}
+    _, error = retry_edit(playlist_id, append, auth, response)
+    return error or {}
 
 @bp.route('/remove_song', methods=['PUT'])
 def remove_music_from_playlist():
@@ -189,28 +774,293 @@ def remove_music_from_playlist():
         return Response(json.dumps({"error": "Unable to get params"}),
                     status=400,
                     mimetype='application/json')
-    payload = {"objtype": "playlist", "objkey": playlist_id}
-
-    url = db['name'] + '/' + db['endpoint'][0]
-    response = requests.get(
-        url,
-        params=payload,
-        headers={'Authorization': headers['Authorization']})
+    response = db.read("playlist", playlist_id,
+                       auth=headers['Authorization'])
+    if response.status_code == 404:
+        return Response(json.dumps({"error": "Playlist not found"}),
+                        status=404,
+                        mimetype='application/json')
     if response.status_code != 200:
         return Response(json.dumps({"error": "Failed to retrieve playlist"}),
                         status=502,
                         mimetype='application/json')
-    items = response.json()
-    music_id_list = items['Items'][0]['music_id_list']
-    if music_id in music_id_list:
-        music_id_list.remove(music_id)
-    payload = {"objtype": "playlist", "objkey": playlist_id}
-    url = db['name'] + '/' + db['endpoint'][3]
-    response = requests.put(
-        url,
-        params=payload,
-        json={"music_id_list": music_id_list})
-    return (response.json())
+    playlist = response.json()['Items'][0]
+    for _ in range(REMOVE_RETRIES):
+        if 'chunks' in playlist or 'music_ids_packed' in playlist:
+            _, error = edit_songs(playlist_id,
+                                  [{"op": "remove", "music_id": music_id}],
+                                  headers['Authorization'], response)
+            return error or {}
+        music_id_list = playlist.get('music_id_list', [])
+        if music_id not in music_id_list:
+            return {}
+        # Remove the element by position, guarded so that the write
+        # fails if a concurrent edit has moved it since our read.  A
+        # view that matched then still does: every edit keeps the two
+        # lists in step.
+        index = music_id_list.index(music_id)
+        ops = [{"op": "remove",
+                "attr": "music_id_list",
+                "index": index},
+               VERSION_BUMP]
+        if view_matches(playlist):
+            ops.append({"op": "remove", "attr": "music_list",
+                        "index": index})
+        response = db.update(
+            "playlist", playlist_id,
+            ops=ops,
+            condition=[{"attr": "music_id_list",
+                        "index": index,
+                        "cmp": "eq",
+                        "value": music_id}],
+            auth=headers['Authorization'])
+        if response.status_code != 409:
+            return datastore.relay(response)
+        response = db.read("playlist", playlist_id, consistent=True,
+                           auth=headers['Authorization'])
+        if response.status_code != 200:
+            break
+        playlist = response.json()['Items'][0]
+    return Response(json.dumps({"error": "Concurrent playlist updates"}),
+                    status=409,
+                    mimetype='application/json')
+
+@bp.route('/<playlist_id>', methods=['PATCH'])
+def edit_playlist(playlist_id):
+    """
+    Apply an ordered batch of edits to a playlist's songs atomically.
+
+    The body is `{"ops": [...]}`, each op one of:
+    - `{"op": "add", "music_id": id, "position": n}`: insert the song
+      before index n (default: at the end), unless it is already there.
+    - `{"op": "remove", "music_id": id}`: remove the song if present.
+    - `{"op": "move", "music_id": id, "position": n}`: move the song,
+      if present, so that it ends up at index n.
+    A position past the end means the end.  A playlist holds each song
+    at most once; a duplicate left by older clients is dropped.
+
+    This is a read-modify-write, not a single database call: the
+    playlist is read (with its chunks, and the new songs for the
+    `music_list` view), and the new list is written with one update
+    (for a chunked playlist, the chunks it changes and then one update
+    of the head) conditional on the playlist being unchanged since it
+    was read.  If another edit got there first, the edits are
+    recomputed from a fresh read, up to EDIT_RETRIES attempts in all;
+    after that the response is 409.  Otherwise it is
+    `{"music_id_list": [...]}` with the result.
+    """
+    headers = request.headers
+    # check header here
+    if 'Authorization' not in headers:
+        return Response(json.dumps({"error": "missing auth"}),
+                        status=401,
+                        mimetype='application/json')
+    content = request.get_json(silent=True)
+    if not isinstance(content, dict):
+        return Response(json.dumps({"error": "Body must be a JSON object"}),
+                        status=400,
+                        mimetype='application/json')
+    try:
+        ops = content['ops']
+        check_edits(ops)
+    except (KeyError, TypeError, ValueError) as e:
+        return Response(json.dumps({"error": "Invalid ops: " + str(e)}),
+                        status=400,
+                        mimetype='application/json')
+    music_id_list, error = edit_songs(playlist_id, ops,
+                                      headers['Authorization'])
+    if error is not None:
+        return error
+    return {"music_id_list": music_id_list}
+
+def edit_songs(playlist_id, ops, auth, response=None):
+    """
+    Apply the edits `ops` (see edit_playlist()) to a playlist, given
+    the `response` to a read of it if one has been made.  Return
+    (music_id_list, None) with the result, or (None, response) for the
+    error to return.
+    """
+    def edit(playlist):
+        if 'chunks' in playlist:
+            return edit_chunked(playlist_id, playlist, ops, auth)
+        return edit_single(playlist_id, playlist, ops, auth)
+    return retry_edit(playlist_id, edit, auth, response)
+
+def retry_edit(playlist_id, edit, auth, response=None):
+    """
+    Apply `edit` to a playlist, given the `response` to a read of it
+    if one has been made.
+
+    `edit(playlist)` is given the playlist read, and writes its change
+    conditional on the playlist being unchanged since.  It returns
+    (result, None) once written, (None, None) if another edit got there
+    first, or (None, response) for the error to return.  After a
+    conflict the playlist is read afresh and `edit` tried again, up to
+    EDIT_RETRIES attempts in all.  Return (result, None), or
+    (None, response) for the error to return.
+    """
+    if response is None:
+        response = db.read("playlist", playlist_id, auth=auth)
+    for attempt in range(EDIT_RETRIES):
+        if response.status_code == 404:
+            return None, Response(
+                json.dumps({"error": "Playlist not found"}),
+                status=404,
+                mimetype='application/json')
+        if response.status_code != 200:
+            return None, Response(
+                json.dumps({"error": "Failed to retrieve playlist"}),
+                status=502,
+                mimetype='application/json')
+        result, error = edit(unpack(response.json()['Items'][0]))
+        if result is not None or error is not None:
+            return result, error
+        time.sleep(random.uniform(0, EDIT_BACKOFF_BASE * 2 ** attempt))
+        response = db.read("playlist", playlist_id, consistent=True,
+                           auth=auth)
+    logging.warning('Edit of playlist %s still conflicted after %d attempts',
+                    playlist_id, EDIT_RETRIES)
+    return None, Response(json.dumps({"error": "Concurrent playlist updates"}),
+                          status=409,
+                          mimetype='application/json')
+
+def edit_single(playlist_id, playlist, ops, auth):
+    '''Apply `ops` to a playlist kept in one item, returning as
+    store_chunks() does'''
+    old_ids = playlist.get('music_id_list', [])
+    new_ids = apply_edits(old_ids, ops)
+    if new_ids == old_ids:
+        return new_ids, None
+    entries = {e['music_id']: e for e in playlist.get('music_list', [])}
+    if len(new_ids) > CHUNK_SIZE:
+        # Too large for one item from now on
+        return store_chunks(playlist_id, playlist,
+                            ChunkedList.split(new_ids, CHUNK_SIZE),
+                            entries, auth,
+                            playlist.get('music_list_at', 0)
+                            if entries else None)
+    attrs, drop = id_attrs(new_ids)
+    music_list = expand_music([m for m in new_ids if m not in entries],
+                              auth)
+    if music_list is not None:
+        entries.update((e['music_id'], e) for e in music_list)
+        attrs["music_list"] = [entries[m] for m in new_ids]
+        if any('unavailable' in e for e in music_list):
+            attrs["music_list_at"] = 0
+    else:
+        # Without the new songs the view cannot match; the next
+        # expanded read rebuilds it
+        attrs["music_list"] = []
+    response = db.update(
+        "playlist", playlist_id, attrs,
+        ops=[VERSION_BUMP] + drop,
+        condition=unchanged_since(playlist.get('music_version')),
+        auth=auth)
+    if response.status_code == 409:
+        return None, None
+    if response.status_code != 200:
+        return None, datastore.relay(response)
+    return new_ids, None
+
+def edit_chunked(playlist_id, playlist, ops, auth):
+    '''Apply `ops` to a chunked playlist, rewriting only the chunks
+    they change, and return as store_chunks() does'''
+    layout = playlist['chunks']
+    items, error = read_chunks(playlist_id, layout, auth)
+    if items is None:
+        return None, error
+    songs = ChunkedList([(c['chunk'], item['music_id_list'])
+                         for c, item in zip(layout, items)], CHUNK_SIZE)
+    for op in ops:
+        if op['op'] == 'add':
+            songs.add(op['music_id'], op.get('position'))
+        elif op['op'] == 'remove':
+            songs.remove(op['music_id'])
+        else:
+            songs.move(op['music_id'], op['position'])
+    if not songs.replaced and all(k is not None for k, _ in songs.chunks()):
+        return songs.music_ids(), None
+    viewed = [item for item in items if view_matches(item)]
+    views = {e['music_id']: e for item in viewed
+             for e in item['music_list']}
+    views_at = min((item.get('music_list_at', 0) for item in viewed),
+                   default=None)
+    return store_chunks(playlist_id, playlist, songs, views, auth,
+                        views_at)
+
+def append_chunked(playlist_id, playlist, music_id, auth):
+    '''
+    Add a song at the end of a chunked playlist, unless it already
+    holds the song, and return as switch_chunks() does.
+
+    Unlike edit_chunked(), this reads only the last chunk, which it
+    rewrites with the song added (or starts a new chunk after it if it
+    is full), and any other chunk whose Bloom filter says it may hold
+    the song.  The cost of an add thus does not grow with the playlist.
+    '''
+    layout = playlist['chunks']
+    tail = layout[-1] if layout and layout[-1]['count'] < CHUNK_SIZE else None
+    wanted = [c for c in layout
+              if c is tail or chunks.may_hold(chunk_bloom(c), music_id)]
+    items, error = read_chunks(playlist_id, wanted, auth)
+    if items is None:
+        return None, error
+    if any(music_id in item['music_id_list'] for item in items):
+        return layout, None
+    music_ids = [music_id]
+    views = {}
+    views_at = None
+    if tail is not None:
+        item = items[-1]
+        music_ids = item['music_id_list'] + music_ids
+        if view_matches(item):
+            views = {e['music_id']: e for e in item['music_list']}
+            views_at = item.get('music_list_at', 0)
+    key = chunks.new_chunk_key()
+    error = write_chunks(playlist_id, [(key, music_ids)], views, auth,
+                         views_at)
+    if error is not None:
+        return None, error
+    kept = layout[:-1] if tail is not None else layout
+    return switch_chunks(playlist_id, playlist,
+                         [kept_entry(c) for c in kept] +
+                         [chunk_entry(key, music_ids)],
+                         [key], [] if tail is None else [tail['chunk']],
+                         auth)
+
+def check_edits(ops):
+    '''Raise ValueError unless `ops` is a well-formed list of edits'''
+    if not isinstance(ops, list) or len(ops) > EDIT_MAX_OPS:
+        raise ValueError('ops must be a list of at most {} edits'.format(
+            EDIT_MAX_OPS))
+    for op in ops:
+        if op['op'] not in EDIT_OPS:
+            raise ValueError('Unknown op ' + str(op['op']))
+        if not isinstance(op['music_id'], str):
+            raise ValueError('music_id must be a string')
+        if op['op'] == 'move' or 'position' in op:
+            position = op['position']
+            if not isinstance(position, int) or position < 0:
+                raise ValueError('position must be a non-negative integer')
+
+def apply_edits(music_id_list, ops):
+    '''Return `music_id_list` after the edits `ops` of edit_playlist()'''
+    songs = list(dict.fromkeys(music_id_list))
+    present = set(songs)
+    for op in ops:
+        music_id = op['music_id']
+        if op['op'] == 'add':
+            if music_id in present:
+                continue
+            present.add(music_id)
+            songs.insert(op.get('position', len(songs)), music_id)
+        elif music_id in present:
+            songs.remove(music_id)
+            if op['op'] == 'remove':
+                present.discard(music_id)
+            else:
+                songs.insert(op['position'], music_id)
+    return songs
 
 # All database calls will have this prefix.  Prometheus metric
 # calls will not---they will have route '/metrics'.  This is
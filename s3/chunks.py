@@ -0,0 +1,188 @@
+"""
+SFU CMPT 756
+The songs of a large playlist, split into chunks.
+
+A DynamoDB item holds at most 400 KB, so a playlist of more than a few
+thousand songs cannot keep its whole `music_id_list` in one item.  A
+chunked playlist instead keeps its songs, in order, in chunk items of
+at most a fixed number of songs each.  Its head item, the one under the
+playlist's ID, lists the chunks, how many songs each holds and a Bloom
+filter of its songs.  The filter lets an add tell which chunks may
+already hold a song, and read only those, rather than every chunk.
+
+The songs of a chunk item are never changed in place; only its view
+of them is refreshed.  An edit writes the chunks it changes as new
+items, under fresh keys.  It then switches the head to
+list them, with one conditional update, and finally deletes the items
+they replace.  A reader of the head therefore always finds a consistent
+set of chunks, unless a later edit has already deleted some of them.
+"""
+
+# Standard library modules
+import hashlib
+import uuid
+
+# Bits of a chunk's Bloom filter per song, and bits set per song: a
+# false positive rate of about 2%, for a byte per song
+BLOOM_BITS = 8
+BLOOM_HASHES = 6
+
+
+def new_chunk_key():
+    '''Return a key, unique to one version of one chunk'''
+    return uuid.uuid4().hex
+
+
+def locate(counts, offset, limit=None):
+    '''Return [(chunk index, start, end)] for the songs from `offset`,
+    up to `limit` of them, given the song count of each chunk'''
+    end = None if limit is None else offset + limit
+    if end == offset:
+        return []
+    spans = []
+    first = 0
+    for i, count in enumerate(counts):
+        last = first + count
+        if end is not None and first >= end:
+            break
+        if last > offset:
+            spans.append((i, max(offset, first) - first,
+                          min(last if end is None else end, last) - first))
+        first = last
+    return spans
+
+
+def bloom(music_ids):
+    '''Return the Bloom filter of a chunk holding `music_ids`'''
+    bits = bytearray(max(1, BLOOM_BITS * len(music_ids) // 8))
+    for music_id in music_ids:
+        for i in _bit_positions(music_id, len(bits) * 8):
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
+def may_hold(bloom, music_id):
+    '''Return whether a chunk whose Bloom filter is `bloom` may hold
+    the song.  A chunk stored without one (None) may hold any.'''
+    if bloom is None:
+        return True
+    return all(bloom[i >> 3] & (1 << (i & 7))
+               for i in _bit_positions(music_id, len(bloom) * 8))
+
+
+def _bit_positions(music_id, nbits):
+    '''Return the filter bits of a song, by double hashing'''
+    digest = hashlib.blake2b(music_id.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % nbits for i in range(BLOOM_HASHES)]
+
+
+class ChunkedList():
+    """An editable playlist held as a sequence of chunks of at most
+    `size` songs each.
+
+    Edits change as few chunks as they can.  An append goes into the
+    last chunk, or a new one when that is full.  An insert into a full
+    chunk splits it in two.  A chunk left empty is dropped.  Each
+    playlist holds a song at most once, as edit_playlist() describes;
+    duplicates among the chunks it starts from are dropped.
+
+    Parameters
+    ----------
+    chunks: list
+        (key, music_ids) of each chunk in order.  The key is None for a
+        chunk that has not been stored yet.
+    size: int
+        Most songs a chunk may hold.
+    """
+    def __init__(self, chunks, size):
+        self.size = size
+        # Each chunk is a [key, music_ids] list; a chunk changed since
+        # it was stored has its key set to None
+        self._chunks = []
+        # Keys of the stored chunks that edits have replaced
+        self.replaced = []
+        # music_id -> the chunk holding it
+        self._where = {}
+        for key, music_ids in chunks:
+            chunk = [key, []]
+            for music_id in music_ids:
+                if music_id in self._where:
+                    self._changed(chunk)
+                    continue
+                self._where[music_id] = chunk
+                chunk[1].append(music_id)
+            if chunk[1]:
+                self._chunks.append(chunk)
+            else:
+                self._changed(chunk)
+
+    @classmethod
+    def split(cls, music_ids, size):
+        '''Return the ChunkedList of `music_ids`, in full chunks'''
+        return cls([(None, music_ids[i:i + size])
+                    for i in range(0, len(music_ids), size)], size)
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, music_id):
+        return music_id in self._where
+
+    def _changed(self, chunk):
+        if chunk[0] is not None:
+            self.replaced.append(chunk[0])
+            chunk[0] = None
+
+    def music_ids(self):
+        '''Return all the songs, in order'''
+        return [m for _, music_ids in self._chunks for m in music_ids]
+
+    def chunks(self):
+        '''Return (key, music_ids) of each chunk, in order; the key is
+        None for the chunks that need storing'''
+        return [(key, music_ids) for key, music_ids in self._chunks]
+
+    def add(self, music_id, position=None):
+        '''Insert the song before index `position` (default: at the
+        end), unless it is already present'''
+        if music_id in self._where:
+            return
+        if position is None or position >= len(self._where):
+            if not self._chunks or len(self._chunks[-1][1]) >= self.size:
+                self._chunks.append([None, []])
+            i, offset = len(self._chunks) - 1, len(self._chunks[-1][1])
+        else:
+            i, offset = 0, position
+            while offset >= len(self._chunks[i][1]):
+                offset -= len(self._chunks[i][1])
+                i += 1
+        chunk = self._chunks[i]
+        self._changed(chunk)
+        chunk[1].insert(offset, music_id)
+        self._where[music_id] = chunk
+        if len(chunk[1]) > self.size:
+            half = len(chunk[1]) // 2
+            rest = [None, chunk[1][half:]]
+            del chunk[1][half:]
+            for m in rest[1]:
+                self._where[m] = rest
+            self._chunks.insert(i + 1, rest)
+
+    def remove(self, music_id):
+        '''Remove the song, if present'''
+        chunk = self._where.pop(music_id, None)
+        if chunk is None:
+            return
+        self._changed(chunk)
+        chunk[1].remove(music_id)
+        if not chunk[1]:
+            self._chunks = [c for c in self._chunks if c is not chunk]
+
+    def move(self, music_id, position):
+        '''Move the song, if present, so that it ends up at index
+        `position`'''
+        if music_id in self._where:
+            self.remove(music_id)
+            self.add(music_id, position)
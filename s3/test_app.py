@@ -0,0 +1,71 @@
+"""
+Test the playlist service's handling of requests that need no
+database call or only relay its answer.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+
+# Installed packages
+import pytest
+import requests
+
+# Local modules
+import app
+
+AUTH = {'Authorization': 'Bearer A'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Any call to the database service fails the test
+    monkeypatch.setattr(app, 'db', None)
+    return app.app.test_client()
+
+
+def test_patch_malformed_body(client):
+    for body in (b'{"ops": [', b'[]', b''):
+        response = client.patch('/api/v1/playlist/p', data=body,
+                                content_type='application/json',
+                                headers=AUTH)
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Body must be a JSON object'}
+
+
+def test_patch_invalid_ops(client):
+    for ops in ([{'op': 'swap', 'music_id': 'a'}],
+                [{'op': 'move', 'music_id': 'a'}],
+                [{'op': 'add', 'music_id': 'a', 'position': -1}],
+                {'op': 'add'}):
+        response = client.patch('/api/v1/playlist/p', json={'ops': ops},
+                                headers=AUTH)
+        assert response.status_code == 400
+        assert response.get_json()['error'].startswith('Invalid ops')
+
+
+class CannedRead():
+    '''Stands in for the datastore client, answering every read with
+    `content`'''
+    def __init__(self, content):
+        self.content = content
+
+    def read(self, objtype, objkey, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = self.content
+        return response
+
+
+def test_get_relayed(client, monkeypatch):
+    content = (b'{"Count": 1, "Items": [{"playlist_id": "p", '
+               b'"music_id_list": ["a"], "playlist_name": "n"}]}')
+    monkeypatch.setattr(app, 'db', CannedRead(content))
+    response = client.get('/api/v1/playlist/p', headers=AUTH)
+    assert response.status_code == 200
+    assert response.get_data() == content
+    # A read that needs its songs is parsed and answered anew
+    response = client.get('/api/v1/playlist/p?limit=1', headers=AUTH)
+    assert response.get_data() != content
+    assert response.get_json()['Items'][0]['music_count'] == 1
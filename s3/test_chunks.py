@@ -0,0 +1,78 @@
+"""
+Test the chunking of large playlists.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+
+# Installed packages
+
+# Local modules
+import chunks
+from chunks import ChunkedList
+
+
+def test_locate():
+    counts = [3, 3, 2]
+    assert chunks.locate(counts, 0) == [(0, 0, 3), (1, 0, 3), (2, 0, 2)]
+    assert chunks.locate(counts, 2, 2) == [(0, 2, 3), (1, 0, 1)]
+    assert chunks.locate(counts, 3, 3) == [(1, 0, 3)]
+    assert chunks.locate(counts, 7, 10) == [(2, 1, 2)]
+    assert chunks.locate(counts, 8) == []
+    assert chunks.locate(counts, 1, 0) == []
+
+
+def test_split():
+    songs = ChunkedList.split(list('abcdefg'), 3)
+    assert songs.chunks() == [(None, list('abc')), (None, list('def')),
+                              (None, ['g'])]
+    assert len(songs) == 7 and 'g' in songs
+
+
+def test_append_fills_last_chunk():
+    songs = ChunkedList([('k1', list('abc')), ('k2', ['d'])], 3)
+    songs.add('e')
+    songs.add('f')
+    songs.add('g')
+    assert songs.chunks() == [('k1', list('abc')), (None, list('def')),
+                              (None, ['g'])]
+    assert songs.replaced == ['k2']
+
+
+def test_insert_splits_full_chunk():
+    songs = ChunkedList([('k1', list('abc')), ('k2', list('def'))], 3)
+    songs.add('x', 1)
+    assert songs.chunks() == [(None, ['a', 'x']), (None, ['b', 'c']),
+                              ('k2', list('def'))]
+    assert songs.replaced == ['k1']
+    # Moving a song keeps each chunk within its size
+    songs.move('d', 0)
+    assert songs.music_ids() == list('daxbcef')
+    assert all(len(ids) <= 3 for _, ids in songs.chunks())
+
+
+def test_remove_drops_empty_chunk():
+    songs = ChunkedList([('k1', ['a']), ('k2', list('bc'))], 3)
+    songs.remove('a')
+    songs.remove('z')
+    assert songs.chunks() == [('k2', list('bc'))]
+    assert songs.replaced == ['k1']
+
+
+def test_duplicates_dropped():
+    songs = ChunkedList([('k1', list('ab')), ('k2', list('bc'))], 3)
+    songs.add('a')
+    assert songs.chunks() == [('k1', list('ab')), (None, ['c'])]
+    assert songs.replaced == ['k2']
+
+
+def test_bloom():
+    music_ids = ['song-{}'.format(i) for i in range(1000)]
+    bloom = chunks.bloom(music_ids)
+    assert len(bloom) == 1000
+    assert all(chunks.may_hold(bloom, m) for m in music_ids)
+    others = ['other-{}'.format(i) for i in range(1000)]
+    assert sum(chunks.may_hold(bloom, m) for m in others) < 50
+    assert not chunks.may_hold(chunks.bloom([]), 'song-0')
+    assert chunks.may_hold(None, 'song-0')
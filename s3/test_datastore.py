@@ -0,0 +1,154 @@
+"""
+Test which calls the datastore client retries.
+
+These tests run against the copy of the top-level datastore.py that
+`make -f k8s-tpl.mak templates` puts in this directory.  They answer
+the client's calls from a queue of canned responses; run them with
+`pytest` in this directory.
+"""
+
+# Standard libraries
+
+# Installed packages
+import pytest
+import requests
+
+# Local modules
+import datastore
+
+
+class CannedSession():
+    '''Stands in for the client's requests.Session, answering each call
+    with the next of `answers`: a status, (status, Retry-After) or an
+    exception to raise'''
+    def __init__(self, *answers, content=b'{"Count": 1, "Items": [{}]}'):
+        self.answers = list(answers)
+        self.content = content
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        status, retry_after = (answer if isinstance(answer, tuple)
+                               else (answer, None))
+        response = requests.Response()
+        response.status_code = status
+        if retry_after is not None:
+            response.headers['Retry-After'] = retry_after
+        response._content = self.content
+        return response
+
+
+@pytest.fixture
+def client(request):
+    return datastore.DatastoreClient(
+        url='http://db', retries=2, backoff_base=0, max_retry_after=0.01,
+        misses=datastore.MissCache(0, 0))
+
+
+def answer(client, *answers, **kwargs):
+    client.session = CannedSession(*answers, **kwargs)
+    return client.session
+
+
+def test_idempotent_retries(client):
+    session = answer(client, (429, '0'), 503, 200)
+    assert client.read('music', 'k').status_code == 200
+    assert session.calls == 3
+    session = answer(client, requests.Timeout(), 502, 504)
+    assert client.batch_read('music', ['k']).status_code == 504
+    assert session.calls == 3
+
+
+def test_long_retry_after(client):
+    session = answer(client, (429, '5'), 200)
+    assert client.read('music', 'k').status_code == 429
+    assert session.calls == 1
+
+
+def test_write_not_retried(client):
+    # A batch write may be partly applied before its 429 or 503
+    for status in ((429, '0'), (503, '0'), 502):
+        session = answer(client, status, 200)
+        assert client.batch_write('music', [{}]).status_code != 200
+        assert session.calls == 1
+    session = answer(client, (429, '0'), 200)
+    assert client.write('music', {}).status_code == 429
+    session = answer(client, (503, '0'), 200)
+    assert client.update('music', 'k', ops=[{'op': 'add', 'attr': 'n',
+                                             'value': 1}]).status_code == 503
+    session = answer(client, requests.ReadTimeout(), 200)
+    with pytest.raises(requests.ReadTimeout):
+        client.write('music', {})
+    assert session.calls == 1
+
+
+def test_caller_keys_retried(client):
+    session = answer(client, (429, '0'), 200)
+    response = client.batch_write('music', [{'uuid': 'a'}, {'uuid': 'b'}])
+    assert response.status_code == 200
+    assert session.calls == 2
+    session = answer(client, (429, '0'), 200)
+    response = client.batch_write('music', [{'uuid': 'a'}, {}])
+    assert response.status_code == 429
+
+
+def test_connect_timeout_retried(client):
+    session = answer(client, requests.ConnectTimeout(), 200)
+    assert client.write('music', {}).status_code == 200
+    assert session.calls == 2
+
+
+def test_misses_cached_by_objtype():
+    client = datastore.DatastoreClient(
+        url='http://db', misses=datastore.MissCache(10, 30),
+        miss_objtypes=['playlist'])
+    for objtype, calls in (('playlist', 1), ('music', 2)):
+        session = answer(client, 200, 200,
+                         content=b'{"Count":0,"Items":[]}')
+        for _ in range(2):
+            response = client.read(objtype, 'k')
+            # As the database service answers a miss, but with a 404
+            assert response.status_code == 404
+            assert response.json() == {'Count': 0, 'Items': []}
+        assert session.calls == calls
+    # A write through the client ends the entry
+    answer(client, 200, content=b'{"playlist_id": "k"}')
+    client.write('playlist', {})
+    session = answer(client, 200, content=b'{"Count":1,"Items":[{}]}')
+    assert client.read('playlist', 'k').status_code == 200
+
+
+def test_relay():
+    response = requests.Response()
+    response.status_code = 429
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Retry-After'] = '2'
+    response.headers['Server'] = 'Werkzeug'
+    response._content = b'{"http_status_code": 429,  "reason": "x"}'
+    relayed = datastore.relay(response)
+    # The body is passed on as it is, never parsed and re-encoded
+    assert relayed.get_data() == response.content
+    assert relayed.status_code == 429
+    assert relayed.content_type == 'application/json'
+    assert relayed.headers['Retry-After'] == '2'
+    assert 'Server' not in relayed.headers
+
+
+def test_miss_cache_race():
+    misses = datastore.MissCache(2, 30)
+    # A read finds nothing, then a write of the key completes before
+    # the read records its miss
+    token = misses.token()
+    misses.discard('a')
+    misses.add('a', token)
+    assert 'a' not in misses
+    misses.add('b', misses.token())
+    assert 'b' in misses
+    # Discards forgotten beyond maxsize still refuse older reads
+    for key in 'cde':
+        misses.discard(key)
+    misses.add('c', token)
+    assert 'c' not in misses
@@ -0,0 +1,57 @@
+"""
+Test the packed storage format of playlists' music IDs.
+
+Run these tests with `pytest` in this directory.
+"""
+
+# Standard libraries
+import base64
+import uuid
+
+# Installed packages
+import pytest
+
+# Local modules
+import app
+
+
+def read_back(packed):
+    '''Return `packed` as a read returns a Binary attribute'''
+    return base64.b64encode(packed).decode()
+
+
+@pytest.mark.parametrize('music_id_format', ['packed', 'packed-zlib'])
+def test_round_trip(monkeypatch, music_id_format):
+    monkeypatch.setattr(app, 'MUSIC_ID_FORMAT', music_id_format)
+    # Random UUIDs do not compress, so both store them raw
+    music_ids = [str(uuid.uuid4()) for _ in range(50)]
+    packed = app.pack_ids(music_ids)
+    assert packed[0] == app.PACKED_RAW and len(packed) == 1 + 16 * 50
+    assert app.unpack_ids(read_back(packed)) == music_ids
+    assert app.unpack_ids(read_back(app.pack_ids([]))) == []
+
+
+def test_compressed(monkeypatch):
+    music_ids = [str(uuid.UUID(int=i)) for i in range(100)]
+    monkeypatch.setattr(app, 'MUSIC_ID_FORMAT', 'packed')
+    raw = app.pack_ids(music_ids)
+    monkeypatch.setattr(app, 'MUSIC_ID_FORMAT', 'packed-zlib')
+    packed = app.pack_ids(music_ids)
+    assert packed[0] == app.PACKED_ZLIB and len(packed) < len(raw)
+    assert app.unpack_ids(read_back(packed)) == music_ids
+
+
+def test_not_uuids_stored_as_list(monkeypatch):
+    monkeypatch.setattr(app, 'MUSIC_ID_FORMAT', 'packed-zlib')
+    music_id = str(uuid.uuid4())
+    for music_ids in (['dangling'], [music_id, 'dangling'],
+                      [music_id.upper()], [music_id.replace('-', '')],
+                      [None]):
+        assert app.pack_ids(music_ids) is None
+    attrs, drop = app.id_attrs([music_id, 'dangling'])
+    assert attrs == {'music_id_list': [music_id, 'dangling']}
+    assert drop == [{'op': 'remove', 'attr': 'music_ids_packed'}]
+    attrs, drop = app.id_attrs([music_id])
+    assert app.unpack(
+        {'music_ids_packed': attrs['music_ids_packed']['$binary']}) == {
+            'music_id_list': [music_id]}
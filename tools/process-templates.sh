@@ -45,6 +45,16 @@ fi
 #
 find . -name '*-tpl.*' -exec ./tools/call-sed.sh '{}'  ${vals} \;
 #
-# Step 3: Cleanup
+# Step 4: Copy the shared Gunicorn settings and database client into
+# each Python service, whose image is built from its own directory
+#
+for dir in s1 s2/v1 s2/v1.1 s2/v2 s3 db; do
+  cp gunicorn.conf.py ${dir}/gunicorn.conf.py
+done
+for dir in s1 s2/v1.1 s3; do
+  cp datastore.py ${dir}/datastore.py
+done
+#
+# Step 5: Cleanup
 #
 /bin/rm -f ./cluster/tpl-nocomments.txt